@@ -1,2 +1,5 @@
 from .github import Git, Github
-from .gcloud import *
\ No newline at end of file
+from .archive import Archive, archive_url
+from .gcloud import *
+from .mirror import Mirror
+from .catalog import Catalog, build_catalog
@@ -0,0 +1,274 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+from .github import Git, build_cache_dir
+from .tree import LocalTree
+
+# Written into each extracted archive, recording where and when it came from
+ARCHIVE_INFO_FILENAME = ".skcli_archive.json"
+# Github repository URLs, as given in the Github index
+GITHUB_URL_RX = re.compile(r"^https://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$")
+# Ref fetched for the "default" branch
+DEFAULT_REF = "HEAD"
+# Top level directories build() reads the whole of, if present
+TEMPLATE_DIRS = ["templates", "panos", "panorama"]
+
+
+class Archive(Git):
+    """
+    Archive remote
+
+    Fetches a branch or tag of a skillet repository as a compressed tarball over HTTP, instead of cloning it, so no git
+    client is needed. The archive is streamed, and only the template directories build() reads are kept, under the
+    store like a clone. Each fetch is cached by the ETag of the archive, so unchanged archives aren't downloaded again.
+
+    Usage::
+        from Remotes import Archive
+        a = Archive("https://github.com/PaloAltoNetworks/iron-skillet/archive/{ref}.tar.gz")
+        a.clone("iron-skillet", ref="panos_v9.1")
+        sc = a.build_cached()
+    """
+    def __init__(self, url, store=None, github_info=None):
+        """
+        :param url: URL of the archive, with {ref} in place of the branch or tag. Github repository URLs are turned
+        into the URL of their archives.
+        :param store: Directory to store repository in. Defaults to the current directory.
+        :param github_info: (dict): Repository attributes from Github, if any.
+        """
+        if store is None:
+            store = os.getcwd()
+
+        self.github_info = github_info
+        self.repo_url = archive_url(url) or url
+        self.store = store
+        self.Repo = None
+        self.name = ""
+        self.path = ""
+        self.update = False
+        self.sparse = False
+        self.fs = LocalTree()
+        self.ref = DEFAULT_REF
+        self.info = {}
+        self.cache_dir = build_cache_dir()
+
+    def clone(self, name, ow=False, update=False, ref=None, **kwargs):
+        """
+        Fetch the archive into the store, unless it is already there.
+        :param name: Name of repository
+        :param ow: OverWrite, bool, if True always download the archive again.
+        :param update: If True, check for a newer archive of the same ref.
+        :param ref: Branch or tag to fetch, the default branch if not set.
+        :param kwargs: Git clone options, which don't apply to archives and are ignored.
+        :return: (string): Path to the extracted archive
+        """
+        if not name:
+            raise ValueError("Missing or bad name passed to Clone command.")
+
+        self.name = name
+        self.update = update
+        self.path = self.store + os.sep + name
+        if ref:
+            self.ref = ref
+
+        self.info = self.read_info()
+        self.check_replaceable()
+        if self.info.get("ref") != self.ref or ow or update:
+            self.fetch(use_etag=not ow)
+        self.Repo = "archive"
+        return self.path
+
+    def fetch(self, use_etag=True):
+        """
+        Download and extract the archive of the current ref.
+        :param use_etag: Skip the download if the archive is unchanged since it was last fetched.
+        """
+        import requests
+
+        url = self.repo_url.format(ref=self.ref)
+        headers = {}
+        if use_etag and self.info.get("url") == url and self.info.get("etag"):
+            headers["If-None-Match"] = self.info["etag"]
+
+        print("Fetching {}".format(url))
+        with requests.get(url, headers=headers, stream=True) as r:
+            if r.status_code == 304:
+                return
+            r.raise_for_status()
+            # Undo any transfer encoding, leaving the archive's own compression to tarfile
+            r.raw.decode_content = True
+            files, commit = read_archive(r.raw)
+            info = {
+                "url": url,
+                "ref": self.ref,
+                "etag": r.headers.get("ETag"),
+                "commit": commit,
+            }
+
+        self.extract(files, info)
+        self.info = info
+
+    def extract(self, files, info):
+        """
+        Write the template directories of an archive into the store, replacing any earlier fetch.
+        :param files: (dict): Path: content, of every file in the archive
+        :param info: Archive details, saved alongside the files
+        """
+        keep = get_archive_dirs(files)
+        os.makedirs(self.store, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".skcli-archive-", dir=self.store)
+        for path, data in files.items():
+            if path.split("/")[0] not in keep:
+                continue
+            dest = os.path.join(tmp, *path.split("/"))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, "wb") as f:
+                f.write(data)
+
+        with open(os.path.join(tmp, ARCHIVE_INFO_FILENAME), "w") as f:
+            json.dump(info, f)
+
+        self.check_replaceable()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(tmp, self.path)
+
+    def check_replaceable(self):
+        """
+        Make sure the directory archives are extracted to is either missing or an earlier archive download, so nothing
+        else, such as a git clone of the same repository, is ever deleted.
+        """
+        if os.path.exists(self.path) and not os.path.isfile(self.path + os.sep + ARCHIVE_INFO_FILENAME):
+            print("{} already exists, and is not an archive download. It may be a git clone of the repository; remove "
+                  "it, or fetch the archive into another store, to use --repotype archive.".format(self.path))
+            sys.exit(1)
+
+    def read_info(self):
+        info_file = self.path + os.sep + ARCHIVE_INFO_FILENAME
+        if not os.path.isfile(info_file):
+            return {}
+        with open(info_file) as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+
+    def branch(self, branch_name):
+        """
+        Fetch the archive of another branch or tag.
+        """
+        print("Fetching branch: " + branch_name)
+        self.clone(self.name, update=self.update, ref=branch_name)
+
+    def list_branches(self):
+        """
+        Archives only have the ref that was fetched.
+        """
+        return [self.ref]
+
+    def build(self, ref=None):
+        """
+        Build the Skillet object from the extracted archive.
+        :param ref: Branch or tag to build, fetching it if it isn't the current one.
+        :return: SkilletCollection instance
+        """
+        if ref and ref not in [self.ref, self.info.get("commit")]:
+            self.branch(ref)
+        if not self.Repo:
+            self.clone(self.name)
+        return Git.build(self)
+
+    def cache_commit(self, ref=None):
+        """
+        Get the key to cache builds of the archive under: the commit it was made from if known, otherwise its ETag.
+        :return: (string), or None if the archive can't be identified.
+        """
+        if ref and ref not in [self.ref, self.info.get("commit")]:
+            self.branch(ref)
+        if not self.Repo:
+            self.clone(self.name)
+
+        if self.info.get("commit"):
+            return self.info["commit"]
+        if self.info.get("etag"):
+            return hashlib.sha1((self.info["url"] + self.info["etag"]).encode("utf-8")).hexdigest()
+        return None
+
+
+def read_archive(stream):
+    """
+    Read the files of a tar archive that build() could need from a stream, without seeking, dropping the top directory
+    that archives of a repository put everything in.
+
+    Files at the root of the repository are skipped unread. Files of any other directory besides the template
+    directories are held until its .meta-cnc.yaml is seen, and dropped at the end if it has none, as it isn't a
+    snippet directory.
+    :return: ((dict), string): Path: content of each file, and the commit the archive was made from if it says.
+    """
+    import tarfile
+
+    files = {}
+    # Directory: {path: content} of the files of directories not yet known to be snippet directories
+    held = {}
+    snippet_dirs = set()
+    top = None
+    with tarfile.open(fileobj=stream, mode="r|*") as tar:
+        for member in tar:
+            parts = [p for p in member.name.split("/") if p not in ["", "."]]
+            if top is None and parts:
+                # The top directory comes first
+                top = parts[0] if member.isdir() or len(parts) > 1 else ""
+            if top and parts and parts[0] == top:
+                parts = parts[1:]
+            if not member.isfile() or ".." in parts or len(parts) < 2:
+                continue
+
+            path = "/".join(parts)
+            data = tar.extractfile(member).read()
+            if parts[0] in TEMPLATE_DIRS or parts[0] in snippet_dirs:
+                files[path] = data
+            elif len(parts) == 2 and parts[1] == ".meta-cnc.yaml":
+                snippet_dirs.add(parts[0])
+                files.update(held.pop(parts[0], {}))
+                files[path] = data
+            else:
+                held.setdefault(parts[0], {})[path] = data
+        # git archive records the commit in the global header
+        commit = tar.pax_headers.get("comment")
+
+    return files, commit
+
+
+def get_archive_dirs(files):
+    """
+    Get the top level directories of an archive that build() needs, as per Git.get_sparse_dirs.
+    :param files: (dict): Path: content, of every file in the archive
+    :return: [ string ]: Directory names
+    """
+    dirs = []
+    for path in files:
+        parts = path.split("/")
+        if len(parts) < 2:
+            continue
+        if parts[0] == "templates":
+            return ["templates"]
+        if parts[0] in TEMPLATE_DIRS[1:] or (len(parts) == 2 and parts[1] == ".meta-cnc.yaml"):
+            if parts[0] not in dirs:
+                dirs.append(parts[0])
+
+    return dirs
+
+
+def archive_url(repo_url):
+    """
+    Get the archive URL of a Github repository.
+    :param repo_url: Clone URL of the repository
+    :return: (string): Archive URL, with {ref} in place of the branch or tag, or None if it isn't a Github URL.
+    """
+    m = GITHUB_URL_RX.match(repo_url or "")
+    if not m:
+        return None
+    return "https://github.com/{}/{}/archive/{{ref}}.tar.gz".format(m.group(1), m.group(2))
@@ -0,0 +1,162 @@
+import os
+import json
+import bisect
+from xml.etree import ElementTree
+from xml.etree.ElementTree import ParseError
+from .skillet import CONTENT_STORE
+
+# Searchable fields of each catalog record
+CATALOG_FIELDS = ["name", "xpath", "entry", "variable"]
+# Version of the catalog file format, bumped whenever records change shape
+CATALOG_VERSION = 1
+
+
+class Catalog:
+    """
+    Searchable index of every snippet in a skillet collection.
+
+    Each snippet is recorded with its skillet, stack, name, xpath, the names of the entries it configures and the
+    variables it uses, so discovery doesn't need to walk or parse the snippets themselves.
+
+    Usage::
+        catalog = build_catalog(sc)
+        catalog.search("/config/shared/log-settings", field="xpath", prefix=True)
+        catalog.search("Outbound-Block", field="entry")
+    """
+    def __init__(self, records):
+        """
+        :param records: [ dict ]: skillet, stack, name, xpath, entries and variables of each snippet
+        """
+        self.records = records
+        # field: sorted list of (term, record index), for prefix search by bisection
+        self.terms = {}
+        for field in CATALOG_FIELDS:
+            terms = []
+            for i, record in enumerate(records):
+                for term in record_terms(record, field):
+                    terms.append((term.lower(), i))
+            terms.sort()
+            self.terms[field] = terms
+
+    def search(self, query, field=None, prefix=False):
+        """
+        Find snippets with a field matching query, ignoring case.
+        :param query: Text to search for
+        :param field: One of CATALOG_FIELDS to search, or all of them if not set.
+        :param prefix: If True, only match fields that start with query, otherwise match anywhere within them.
+        :return: [ dict ]: Matching records, in the order they were built.
+        """
+        query = query.lower()
+        fields = [field] if field else CATALOG_FIELDS
+        matches = set()
+        for f in fields:
+            terms = self.terms[f]
+            if prefix:
+                i = bisect.bisect_left(terms, (query, -1))
+                while i < len(terms) and terms[i][0].startswith(query):
+                    matches.add(terms[i][1])
+                    i += 1
+            else:
+                for term, index in terms:
+                    if query in term:
+                        matches.add(index)
+
+        return [self.records[i] for i in sorted(matches)]
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": CATALOG_VERSION, "records": self.records}, f)
+        os.replace(tmp, path)
+
+
+def record_terms(record, field):
+    if field == "entry":
+        return record["entries"]
+    if field == "variable":
+        return record["variables"]
+    return [record[field]]
+
+
+def build_catalog(sc):
+    """
+    Build the catalog of a skillet collection.
+
+    Xpaths and entry names are taken from each snippet rendered with its default variables.
+    :param sc: SkilletCollection
+    :return: Catalog
+    """
+    from jinja2 import meta
+
+    records = []
+    env = CONTENT_STORE.get_env()
+    for skillet_name, skillet in sc.skillet_map.items():
+        for stack_name, stack in skillet.snippet_stack.items():
+            for snippet in stack.snippets:
+                s = snippet.copy()
+                try:
+                    s.template(None)
+                    xpath = s.rendered_xpath
+                    xmlstr = s.rendered_xmlstr
+                except Exception:
+                    # Snippets without usable defaults are indexed as written
+                    xpath = snippet.xpath
+                    xmlstr = snippet.xmlstr
+
+                variables = set()
+                for source in [snippet.xpath, snippet.xmlstr]:
+                    try:
+                        variables |= meta.find_undeclared_variables(env.parse(source))
+                    except Exception:
+                        pass
+
+                records.append({
+                    "skillet": skillet_name,
+                    "stack": stack_name,
+                    "name": snippet.name,
+                    "xpath": xpath,
+                    "entries": entry_names(xmlstr),
+                    "variables": sorted(variables),
+                })
+
+    return Catalog(records)
+
+
+def entry_names(xmlstr):
+    """
+    Get the names of the top level entries of a snippet.
+    """
+    try:
+        root = ElementTree.fromstring("<root>" + xmlstr + "</root>")
+    except ParseError:
+        return []
+    return [e.attrib["name"] for e in root.findall("./entry") if "name" in e.attrib]
+
+
+def load_catalog(path):
+    """
+    Load a saved catalog.
+    :return: Catalog, or None if there is no usable catalog at path.
+    """
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            return None
+
+    if data.get("version") != CATALOG_VERSION:
+        return None
+    return Catalog(data["records"])
+
+
+def page(records, number, size):
+    """
+    Get one page of results.
+    :param number: Page number, starting at 1
+    :param size: Records per page
+    """
+    start = (max(number, 1) - 1) * size
+    return records[start:start + size]
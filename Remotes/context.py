@@ -0,0 +1,122 @@
+import os
+import json
+import threading
+from collections import ChainMap
+
+# Parsed variable files, by path, with the modification time and size they were parsed at
+LOADED_LAYERS = {}
+LAYERS_LOCK = threading.Lock()
+
+
+class Context(ChainMap):
+    """
+    Template variables made up of layers, such as base, site and device variables.
+
+    Layers are looked up from the top down and are never copied, so many device contexts can share the same base and
+    site layers. Variables set on a context only ever change its own top layer.
+
+    Usage::
+        base = layered_context([load_variables("base.yaml")])
+        site = base.overlay(load_variables("site.yaml"))
+        device = site.overlay({"FW_NAME": "fw1"})
+        device.changed()  # Names of the variables that differ from base.yaml
+    """
+    def overlay(self, variables):
+        """
+        Get a new context with variables layered over this one. This context is left unchanged.
+        :param variables: (dict): Variables to overlay
+        :return: Context
+        """
+        # An empty top layer holds no variables, so doesn't need to be kept
+        layers = list(self.maps) if len(self.maps[0]) > 0 else self.maps[1:]
+        if variables:
+            layers = [variables] + layers
+        return type(self)({}, *layers)
+
+    def base(self):
+        """
+        Get the bottom layer of variables.
+        """
+        return self.maps[-1]
+
+    def changed(self):
+        """
+        Get the names of the variables whose value is different to the base layer.
+        :return: (set)
+        """
+        base = self.maps[-1]
+        changed = set()
+        for layer in self.maps[:-1]:
+            for k in layer:
+                if k not in changed and (k not in base or self[k] != base[k]):
+                    changed.add(k)
+        return changed
+
+    def fingerprint(self):
+        """
+        Get a string that is identical for any two contexts with the same variables, for use as a cache key.
+        """
+        return json.dumps(dict(self), sort_keys=True, default=str)
+
+
+def layered_context(layers):
+    """
+    Build a context from layers of variables.
+    :param layers: [ dict ]: Bottom layer first. Empty or None layers are skipped.
+    :return: Context
+    """
+    layers = [l for l in layers if l]
+    if not layers:
+        return Context({})
+    return Context({}, *reversed(layers))
+
+
+def load_variables(path):
+    """
+    Load a YAML or JSON variable file into a dict of variable names and values.
+
+    Each file is read and parsed once; later loads return the same dict until the file changes, so it must not be
+    modified.
+    :param path: Path of the variable file, in the same format as config_variables.yaml.
+    :return: (dict), or None if the file does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    key = os.path.abspath(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with LAYERS_LOCK:
+        if key in LOADED_LAYERS and LOADED_LAYERS[key][0] == stamp:
+            return LOADED_LAYERS[key][1]
+
+    with open(path) as f:
+        text = f.read()
+
+    variables = parse_variables(text)
+    with LAYERS_LOCK:
+        LOADED_LAYERS[key] = (stamp, variables)
+    return variables
+
+
+def parse_variables(text):
+    """
+    Parse the text of a variable file, trying YAML and then JSON.
+    :raises ValueError: If the text can't be parsed as either.
+    """
+    import oyaml
+    from yaml import YAMLError
+
+    try:
+        data = oyaml.safe_load(text)
+    except YAMLError:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            raise ValueError("Configuration file could not be decoded as YAML or JSON!")
+
+    variables = {}
+    for var in (data or {}).get("variables", []):
+        variables[var["name"]] = var["value"]
+    return variables
@@ -1,6 +1,14 @@
-import requests
+import codecs
+import sys
+import json
 from .skillet import *
 
+# Size of each chunk read from a streamed API response
+STREAM_CHUNK_SIZE = 64 * 1024
+# Number of concurrent requests made by BatchQuery
+BATCH_WORKERS = 8
+
+
 class Gcloud():
     """
     Remote skillet retrieval from Gcloud based API
@@ -13,6 +21,17 @@ class Gcloud():
 
         # List all snippets
         json_data = gc.List('iron-skillet')
+
+        # Stream snippets as the response arrives
+        for snippet in gc.StreamQuery('iron-skillet', 'panos', 'snippets', ['all'], '9.0', {}):
+            print(snippet.name)
+
+        # Run several queries at once
+        results = gc.BatchQuery([
+            ('iron-skillet', 'panos', 'snippets', ['all'], '9.0', {}),
+            ('iron-skillet', 'panorama', 'snippets', ['all'], '9.1', {}),
+        ])
+        snippets = results[query_key('iron-skillet', 'panos', 'snippets', ['all'], '9.0', {})]
     """
     def __init__(self, url):
         self.url = url
@@ -28,6 +47,19 @@ class Gcloud():
         :param panos_version:
         :return: List of Snippet instances.
         """
+        return list(self.StreamQuery(skillet_name, type, stack, snippet_names, major_version, context))
+
+    def StreamQuery(self, skillet_name, type, stack, snippet_names, major_version, context, session=None):
+        """
+        Query the skillet API, yielding each snippet as soon as it has been received.
+
+        Takes the same arguments as Query.
+        :param session: requests.Session to send the query with, so connections can be reused between calls.
+        :return: Generator of Snippet instances.
+        """
+        if not session:
+            import requests
+            session = requests
         QUERY = {
             "skillet": skillet_name,
             "filters": {
@@ -36,21 +68,50 @@ class Gcloud():
                 "stack": stack,
                 "panos_version": major_version,
             },
-            "template_variables": context
+            # Layered contexts are flattened to send them
+            "template_variables": dict(context) if context else context
         }
-        res = requests.post(self.url + "/snippet", json=QUERY).json()
-        snippets = []
-        for sjson in res:
-            snippet = Snippet(
-                sjson['path'],
-                sjson['xml']
-            )
-            # Because the snippet API does it for us, setup the rendered strings automatically
-            snippet.rendered_xmlstr = snippet.xmlstr
-            snippet.rendered_xpath = snippet.xpath
-            snippets.append(snippet)
-
-        return snippets
+        with session.post(self.url + "/snippet", json=QUERY, stream=True) as res:
+            for sjson in iter_json_array(res.iter_content(chunk_size=STREAM_CHUNK_SIZE)):
+                yield snippet_from_json(sjson)
+
+    def BatchQuery(self, queries, workers=BATCH_WORKERS):
+        """
+        Run many queries against the skillet API concurrently over a shared connection pool.
+
+        Identical queries are only sent once.
+        :param queries: Iterable of (skillet_name, type, stack, snippet_names, major_version, context) tuples, as
+        per the arguments to Query.
+        :param workers: Maximum number of concurrent requests.
+        :return: (dict): query_key(*query): [ Snippet ]
+        """
+        unique = {}
+        for query in queries:
+            key = query_key(*query)
+            if key not in unique:
+                unique[key] = query
+
+        results = {}
+        if len(unique) == 0:
+            return results
+
+        import requests
+        from concurrent.futures import ThreadPoolExecutor
+
+        workers = max(1, min(workers, len(unique)))
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for key, query in unique.items():
+                    futures[key] = executor.submit(lambda q: list(self.StreamQuery(*q, session=session)), query)
+
+                for key, future in futures.items():
+                    results[key] = future.result()
+
+        return results
 
     def List(self, skillet_name, **kwargs):
         """
@@ -60,16 +121,149 @@ class Gcloud():
         :param kwargs: Key/value filters to append to filter.
         :return: Json representation of snippets
         """
+        return list(self.StreamList(skillet_name, **kwargs))
+
+    def StreamList(self, skillet_name, **kwargs):
+        """
+        List all snippets in a Skillet, yielding the JSON of each snippet as it is received.
+
+        :param skillet_name: Skillet to query
+        :param kwargs: Key/value filters to append to filter.
+        :return: Generator of snippet dicts
+        """
+        import requests
+        with requests.get(self.list_url(skillet_name, **kwargs), stream=True) as res:
+            for sjson in iter_json_array(res.iter_content(chunk_size=STREAM_CHUNK_SIZE)):
+                yield sjson
+
+    def StreamNames(self, skillet_name, **kwargs):
+        """
+        Yield each unique snippet name in a Skillet, in the order they are first received.
+
+        :param skillet_name: Skillet to query
+        :param kwargs: Key/value filters to append to filter.
+        :return: Generator of snippet names
+        """
+        names = set()
+        for sjson in self.StreamList(skillet_name, **kwargs):
+            name = sjson['name']
+            if name not in names:
+                names.add(name)
+                yield name
+
+    def list_url(self, skillet_name, **kwargs):
         params = []
         for k,v in kwargs.items():
             params.append('{}={}'.format(k,v))
 
         qs = "&".join(params)
+        return self.url + "/snippet?skillet={}&{}".format(skillet_name, qs)
+
 
-        if len(params) > 0:
-            res = requests.get(self.url + "/snippet?skillet={}&{}".format(skillet_name, qs))
+def query_key(skillet_name, type, stack, snippet_names, major_version, context):
+    """
+    Build the hashable key used to identify a query in the results of Gcloud.BatchQuery.
+
+    Takes the same arguments as Gcloud.Query.
+    :return: tuple
+    """
+    return (
+        skillet_name,
+        type,
+        stack,
+        tuple(snippet_names),
+        major_version,
+        json.dumps(dict(context) if context else context, sort_keys=True),
+    )
+
+
+def snippet_from_json(sjson):
+    """
+    Create a Snippet from the JSON representation returned by the snippet API.
+    :param sjson: (dict): Snippet JSON
+    :return: Snippet instance
+    """
+    snippet = Snippet(
+        sjson['path'],
+        sjson['xml']
+    )
+    snippet.name = sys.intern(sjson.get('name', ""))
+    # Because the snippet API does it for us, setup the rendered strings automatically
+    snippet.rendered_xmlstr = snippet.xmlstr
+    snippet.rendered_xpath = snippet.xpath
+    return snippet
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally decode a JSON array, yielding each element as soon as it is complete.
+
+    Only the undecoded tail of the response is held in memory, so arbitrarily large arrays can be processed with a
+    flat memory profile.
+    :param chunks: Iterable of bytes, such as requests' Response.iter_content()
+    :return: Generator of decoded array elements
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    started = False
+    count = 0
+    finished = False
+    chunks = iter(chunks)
+    eof = False
+
+    while not finished:
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buf += utf8.decode(b"", final=True)
         else:
-            res = requests.get(self.url + "/snippet?skillet={}&{}".format(skillet_name, qs))
+            buf += utf8.decode(chunk)
+
+        pos = skip_ws(buf, 0)
+        if not started:
+            if pos == len(buf):
+                if eof:
+                    raise ValueError("Empty response where a JSON array was expected.")
+                buf = ""
+                continue
+            if buf[pos] != "[":
+                raise ValueError("Response is not a JSON array: {}".format(buf[pos:pos + 80]))
+            started = True
+            pos = skip_ws(buf, pos + 1)
+
+        while pos < len(buf):
+            if count == 0 and buf[pos] == "]":
+                finished = True
+                break
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Incomplete element, wait for more data.
+                break
+
+            sep = skip_ws(buf, end)
+            if sep == len(buf) and not eof:
+                # Can't tell if a trailing scalar is complete until we see what follows it.
+                break
+
+            count += 1
+            yield element
+            if sep == len(buf):
+                raise ValueError("Truncated JSON array in response.")
+            if buf[sep] == "]":
+                finished = True
+                break
+            if buf[sep] != ",":
+                raise ValueError("Unexpected character {} in JSON array.".format(buf[sep]))
+            pos = skip_ws(buf, sep + 1)
+
+        buf = buf[pos:]
+        if eof and not finished:
+            raise ValueError("Truncated JSON array in response.")
+
 
-        j = res.json()
-        return j
\ No newline at end of file
+def skip_ws(s, pos):
+    while pos < len(s) and s[pos] in " \t\r\n":
+        pos += 1
+    return pos
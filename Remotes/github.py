@@ -1,11 +1,35 @@
-from git import Repo
 import sys
 import os, stat, shutil
 import re
+import json
+import time
+import pickle
+import threading
+import hashlib
+import copy
+from pathlib import Path
 from .skillet import *
-import oyaml
+from .tree import LocalTree, GitTree
+from .catalog import build_catalog, load_catalog
+from panosxml.trace import span, traced
+from panosxml.metrics import CACHE
 from colorama import Fore, Back, Style
-import requests
+
+# Github index cache, stored in the users home directory
+INDEX_CACHE_FILENAME = ".skcli_github.json"
+# Seconds the cached index is used for before it is revalidated against Github
+INDEX_CACHE_TTL = 3600
+# Directory, within the home directory, that built skillets are cached in. Can also use envvar SKCLI_CACHE_DIR.
+BUILD_CACHE_DIR = ".skcli_cache"
+# Format of the build cache. Bump when the pickled classes change, so older builds are ignored.
+BUILD_CACHE_VERSION = 3
+# Number of repositories synced concurrently
+SYNC_WORKERS = 4
+# Number of builds kept in memory
+BUILT_COLLECTIONS_SIZE = 16
+# Builds loaded or made by this process, by build cache file
+BUILT_COLLECTIONS = BoundedDict(BUILT_COLLECTIONS_SIZE)
+BUILT_COLLECTIONS_LOCK = threading.Lock()
 
 def on_rm_error( func, path, exc_info):
     # path contains the path of the file that couldn't be removed
@@ -18,33 +42,134 @@ class Github:
     Github remote
     Github provides a wrapper to Git instances and provides indexing/search methods.
 
+    The search results are cached on disk. Within the TTL the cache is used as-is; after it, each page is revalidated
+    with a conditional request so unchanged results are not downloaded again.
+
     Usage::
         from Remotes import github
         g = Github()
         repos = g.index()
     """
-    def __init__(self, topic="skillets", user="PaloAltoNetworks"):
+    def __init__(self, topic="skillets", user="PaloAltoNetworks", cache_file=None, ttl=INDEX_CACHE_TTL):
         self.url = "https://api.github.com"
         self.topic = topic
         self.user = user
         self.search_endpoint = "/search/repositories"
+        self.ttl = ttl
+        if cache_file is None:
+            cache_file = str(Path.home()) + os.sep + INDEX_CACHE_FILENAME
+        self.cache_file = cache_file
 
-    def index(self):
+    def index(self, remote=None):
         """
         Retrieves the list of repositories as a list of Git instances.
+        :param remote: Remote class to create for each repository, Git by default.
         :return: [ Github.Git ]
         """
-        r = requests.get(self.url + self.search_endpoint, params="q=topic:{}+user:{}".format(self.topic, self.user))
-        j = r.json()
-        self.check_resp(j)
-
+        if remote is None:
+            remote = Git
         repos = []
-        for i in j['items']:
-            g = Git(i['clone_url'], github_info=i)
+        for i in self.search():
+            g = remote(i['clone_url'], github_info=i)
             repos.append(g)
 
         return repos
 
+    def search(self):
+        """
+        Retrieve every repository matching the topic and user, following all result pages.
+        :return: [ dict ]: Github repository attributes
+        """
+        query = "q=topic:{}+user:{}&per_page=100".format(self.topic, self.user)
+        cache = self.load_cache()
+        if cache.get("query") != query:
+            cache = {"query": query, "fetched": 0, "pages": {}}
+
+        if time.time() - cache["fetched"] < self.ttl:
+            return self.cached_items(cache)
+
+        import requests
+        pages = {}
+        url = self.url + self.search_endpoint + "?" + query
+        first_url = url
+        while url:
+            cached_page = cache["pages"].get(url)
+            headers = {}
+            if cached_page and cached_page.get("etag"):
+                headers["If-None-Match"] = cached_page["etag"]
+
+            try:
+                r = requests.get(url, headers=headers)
+                j = r.json() if r.status_code != 304 else None
+            except (requests.RequestException, ValueError) as e:
+                return self.stale_items(cache, str(e))
+
+            if r.status_code == 304:
+                page = cached_page
+            else:
+                if "items" not in j:
+                    # Rate limited or failed
+                    return self.stale_items(cache, j.get("message", "HTTP {}".format(r.status_code)))
+                self.check_resp(j)
+                next_link = r.links.get("next")
+                page = {
+                    "etag": r.headers.get("ETag"),
+                    "items": j['items'],
+                    "next": next_link["url"] if next_link else None,
+                }
+
+            pages[url] = page
+            url = page["next"]
+
+        cache = {"query": query, "fetched": time.time(), "first": first_url, "pages": pages}
+        self.save_cache(cache)
+        return self.cached_items(cache)
+
+    def stale_items(self, cache, reason):
+        """
+        Fall back to the cached index, however old, when Github can't be searched.
+        :param reason: Why the search failed
+        """
+        if not cache.get("first"):
+            raise RuntimeError("Github API Call failed! Github err: {}".format(reason))
+        print("Warning: could not search Github ({}), using the cached repository index.".format(reason),
+              file=sys.stderr)
+        return self.cached_items(cache)
+
+    def cached_items(self, cache):
+        items = []
+        url = cache.get("first")
+        while url:
+            page = cache["pages"][url]
+            items = items + page["items"]
+            url = page["next"]
+        return items
+
+    def load_cache(self):
+        if not os.path.isfile(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except ValueError:
+            # A corrupt cache is simply rebuilt
+            return {}
+
+    def save_cache(self, cache):
+        tmp = self.cache_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, self.cache_file)
+
+    def sync(self, workers=SYNC_WORKERS, **clone_options):
+        """
+        Clone, or update, every repository in the index concurrently and prebuild each of their skillets.
+        :param workers: Number of repositories to sync at once
+        :param clone_options: Extra options passed to Git.clone, such as depth or sparse.
+        :return: [ dict ]: Per repository result with name, seconds, snippet count and error (None if successful).
+        """
+        return sync_repositories(self.index(), workers=workers, **clone_options)
+
     def check_resp(self, j):
         if "errors" in j:
             if len(j["errors"]) > 0:
@@ -56,7 +181,7 @@ class Git:
 
     This class provides an interface to Github repositories containing Skillets or XML snippets.
     """
-    def __init__(self, repo_url, store=os.getcwd(), github_info=None):
+    def __init__(self, repo_url, store=None, github_info=None):
         """
         Initilize a new Git repo object
         :param repo_url: URL path to repository.
@@ -69,23 +194,37 @@ class Git:
             print("See README.md for more details.")
             sys.exit(1)
 
+        if store is None:
+            store = os.getcwd()
+
         self.github_info = github_info
         self.repo_url = repo_url
         self.store = store
         self.Repo = None
         self.name = ""
         self.path = ""
+        self.update = False
+        self.sparse = False
+        self.fs = LocalTree()
+        self.cache_dir = build_cache_dir()
 
-    def clone(self, name, ow=False, update=False):
+    @traced("git.clone")
+    def clone(self, name, ow=False, update=False, depth=None, blob_filter=None, sparse=False):
         """
         Clone a remote directory into the store.
         :param name: Name of repository
         :param ow: OverWrite, bool, if True will remove any existing directory in the location.
+        :param depth: (int): If set, only fetch this many commits of history for each branch.
+        :param blob_filter: (string): Partial clone filter spec, such as blob:none, so file contents are only fetched
+        when they are checked out.
+        :param sparse: bool, if True only the directories read by build() are checked out.
         :return: (string): Path to cloned repository
         """
         if not name:
             raise ValueError("Missing or bad name passed to Clone command.")
 
+        from git import Repo
+
         self.update = update
         self.name = name
         path = self.store + os.sep + name
@@ -106,18 +245,72 @@ class Git:
                     sys.exit(1)
             else:
                 self.Repo = Repo(path)
+                self.sparse = self.is_sparse()
                 if update:
                     print("Updating repository...")
                     self.Repo.remotes.origin.pull()
+                    if self.sparse:
+                        self.sparse_checkout()
 
                 return path
-        else:
-            print("Cloning into {}".format(path))
-            self.Repo = Repo.clone_from(self.repo_url, path)
+
+        print("Cloning into {}".format(path))
+        clone_options = {}
+        if depth:
+            clone_options["depth"] = depth
+            # Shallow clones default to a single branch, but we still want to list and checkout the others.
+            clone_options["no_single_branch"] = True
+        if blob_filter:
+            clone_options["filter"] = blob_filter
+        if sparse:
+            clone_options["no_checkout"] = True
+
+        self.Repo = Repo.clone_from(self.repo_url, path, **clone_options)
+        self.sparse = sparse
+        if sparse:
+            self.Repo.git.sparse_checkout("init", "--cone")
+            self.sparse_checkout()
+            self.Repo.git.checkout(self.Repo.active_branch.name)
 
         self.path = path
         return path
 
+    def is_sparse(self):
+        """
+        Check if the existing clone was made with sparse=True.
+        """
+        from git import GitCommandError
+        # Newer git clients keep this in the per-worktree config, so ask git rather than reading .git/config
+        try:
+            return self.Repo.git.config("--get", "--bool", "core.sparseCheckout") == "true"
+        except GitCommandError:
+            return False
+
+    def sparse_checkout(self):
+        """
+        Limit the working tree to the directories that build() reads from the current HEAD.
+        """
+        dirs = self.get_sparse_dirs(self.Repo.head.commit.tree)
+        self.Repo.git.sparse_checkout("set", *dirs)
+
+    def get_sparse_dirs(self, tree):
+        """
+        Get the top level directories of a commit tree that build() needs.
+
+        Mirrors the logic of get_first_real_dir and get_type_directories: if there is a templates directory only it is
+        required, otherwise the type and snippet directories at the root of the repository are.
+        :param tree: git.Tree of the commit to be checked out
+        :return: [ string ]: Directory names
+        """
+        dirs = []
+        for t in tree.trees:
+            if t.name == "templates":
+                return ["templates"]
+            if t.name in ['panos', 'panorama'] or ".meta-cnc.yaml" in [b.name for b in t.blobs]:
+                dirs.append(t.name)
+
+        return dirs
+
     def branch(self, branch_name):
         """
         Checkout the specified branch.
@@ -130,6 +323,9 @@ class Git:
             print("Updating branch.")
             self.Repo.remotes.origin.pull()
         self.Repo.git.checkout(branch_name)
+        # Each branch can lay out its templates differently
+        if self.sparse:
+            self.sparse_checkout()
 
     def list_branches(self):
         """
@@ -144,17 +340,32 @@ class Git:
         return branch_names
 
 
-    def build(self):
+    @traced("git.build")
+    def build(self, ref=None):
         """
         Build the Skillet object using the git repository.
 
         Must be called after clone.
 
+        :param ref: Branch, tag or commit to build. If set, the skillet files are read straight from the git object
+        database rather than the working tree, so nothing is checked out and builds of different refs can run
+        concurrently.
         :return: SkilletCollection instance
         """
         if not self.Repo:
             self.clone(self.name)
 
+        if ref:
+            from git import Repo
+            # Each build gets its own Repo instance, as GitPython's object readers are not thread safe.
+            repo = Repo(self.path)
+            try:
+                view = copy.copy(self)
+                view.fs = GitTree(self.resolve_ref(ref, repo=repo).tree, self.path)
+                return view.build()
+            finally:
+                repo.close()
+
         # The following section is all hard coded pointers to important stuff #
         #   We expect all of these files in every skillet structure to work.  #
         template_dirs = [
@@ -185,11 +396,117 @@ class Git:
 
         return sc
 
+    def build_cached(self, ref=None):
+        """
+        Build the Skillet object, reusing a previous build of the same commit if there is one.
+
+        Builds are cached by commit in the user's build cache directory. Local repositories and clones with uncommitted changes are always
+        built from scratch, unless a ref is given.
+        :param ref: Branch, tag or commit to build, as per build().
+        :return: SkilletCollection instance
+        """
+        commit = self.cache_commit(ref)
+        if not commit:
+            return self.build()
+
+        cache_file = self.build_cache_path(commit)
+        sc = BUILT_COLLECTIONS.get(cache_file)
+        if sc:
+            CACHE.inc(cache="build", result="hit")
+            return sc
+
+        if os.path.isfile(cache_file):
+            with open(cache_file, "rb") as f:
+                try:
+                    sc = pickle.load(f)
+                except Exception:
+                    # Written by a version of skilletcli with different classes, so build it again
+                    sc = None
+            if sc:
+                CACHE.inc(cache="build", result="hit")
+                with BUILT_COLLECTIONS_LOCK:
+                    return BUILT_COLLECTIONS.add(cache_file, sc)
+
+        CACHE.inc(cache="build", result="miss")
+        sc = self.build(ref=commit if ref else None)
+        with BUILT_COLLECTIONS_LOCK:
+            BUILT_COLLECTIONS.add(cache_file, sc)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp = cache_file + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(sc, f)
+        os.replace(tmp, cache_file)
+        return sc
+
+    def cache_commit(self, ref=None):
+        """
+        Get the commit to cache a build of the given ref under.
+        :return: (string): Commit hash, or None if the build can't be cached.
+        """
+        if not self.Repo:
+            self.clone(self.name)
+
+        if ref:
+            return self.resolve_ref(ref).hexsha
+        elif self.Repo == "local" or self.Repo.is_dirty(untracked_files=True):
+            return None
+        return self.Repo.head.commit.hexsha
+
+    def catalog(self, ref=None):
+        """
+        Get the searchable catalog of every snippet, as built by build_cached.
+
+        Catalogs are saved alongside the build cache, so they are only built once per commit.
+        :param ref: Branch, tag or commit, as per build().
+        :return: Catalog instance
+        """
+        commit = self.cache_commit(ref)
+        if not commit:
+            return build_catalog(self.build())
+
+        catalog_file = self.catalog_path(commit)
+        catalog = load_catalog(catalog_file)
+        if catalog:
+            return catalog
+
+        catalog = build_catalog(self.build_cached(ref))
+        os.makedirs(os.path.dirname(catalog_file), exist_ok=True)
+        catalog.save(catalog_file)
+        return catalog
+
+    def resolve_ref(self, ref, repo=None):
+        """
+        Resolve a branch, tag or commit to a commit, falling back to the remote branch of the same name.
+        :param ref: Branch, tag or commit
+        :param repo: Repo instance to resolve with, defaults to the clone.
+        :return: git.Commit
+        """
+        from gitdb.exc import BadName
+        if not repo:
+            repo = self.Repo
+        try:
+            return repo.commit(ref)
+        except (BadName, ValueError):
+            return repo.commit("origin/" + ref)
+
+    def build_cache_path(self, commit):
+        return self.cache_dir + os.sep + "{}-{}.pickle".format(self.name, self.cache_key(commit))
+
+    def catalog_path(self, commit):
+        return self.cache_dir + os.sep + "{}-{}.catalog.json".format(self.name, self.cache_key(commit))
+
+    def cache_key(self, commit):
+        """
+        Get what a build is cached under: the commit, and everything else that changes what is built from it.
+        """
+        key = "\0".join([str(BUILD_CACHE_VERSION), self.repo_url, str(self.sparse), commit])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
     def get_type_directories(self, template_dir):
         skillet_types = {}
-        for dir in os.listdir(template_dir):
+        for dir in self.fs.listdir(template_dir):
             fp = template_dir + os.sep + dir
-            if not os.path.isfile(fp):
+            if not self.fs.isfile(fp):
                 # If dir is a valid type
                 if dir in ['panos', 'panorama']:
                     skillet_types[dir] = fp
@@ -206,7 +523,7 @@ class Git:
         """
         # Resolve the specified template directories to actual directories
         for template_dir in template_dirs:
-            if os.path.isdir(template_dir):
+            if self.fs.isdir(template_dir):
                 return template_dir
 
     def is_snippet_dir(self, fp):
@@ -214,7 +531,7 @@ class Git:
         Check if the directory at fp is a snippet directory
         """
         meta_file = fp + os.sep + ".meta-cnc.yaml"
-        if os.path.exists(meta_file):
+        if self.fs.exists(meta_file):
             return True
 
         return False
@@ -222,16 +539,16 @@ class Git:
     def get_snippets_in_dir(self, fp):
         snippet_dirs = {}
 
-        for dir in os.listdir(fp):
-            if not os.path.isfile(dir):
+        for dir in self.fs.listdir(fp):
+            if not self.fs.isfile(dir):
                 if self.is_snippet_dir(fp + os.sep + dir):
                     snippet_dirs[dir] = fp + os.sep + dir
 
         snippets_map = {}
         for dir_name, snippet_dir in snippet_dirs.items():
             meta_file = snippet_dir + os.sep + ".meta-cnc.yaml"
-            if os.path.isfile(meta_file):
-                metadata = oyaml.safe_load(open(meta_file).read())
+            if self.fs.isfile(meta_file):
+                metadata = self.read_metafile(meta_file)
                 snippets = self.snippets_from_metafile(meta_file)
                 if len(snippets) > 0:
                     ss = SnippetStack(snippets, metadata)
@@ -241,7 +558,7 @@ class Git:
 
     def snippets_from_metafile(self, meta_file):
         rel_dir = os.path.dirname(meta_file)
-        metadata = oyaml.safe_load(open(meta_file).read())
+        metadata = self.read_metafile(meta_file)
         if "snippets" not in metadata:
             raise ValueError("Malformed metadata file: {}. Missing snippet definition.".format(meta_file))
 
@@ -252,14 +569,37 @@ class Git:
             if self.validate_snippet_meta(snippet_def, rel_dir):
                 snippet_file = rel_dir + os.sep + snippet_def["file"]
                 snippet_xpath = snippet_def["xpath"]
-                xmlstr = open(snippet_file).read()
+                xmlstr = self.read_file(snippet_file)
                 s = Snippet(snippet_xpath, xmlstr)
-                s.name = snippet_def["name"]
+                s.name = sys.intern(snippet_def["name"])
                 s.set_metadata(metadata)
                 snippets.append(s)
 
         return snippets
 
+    def read_file(self, path):
+        """
+        Read a skillet file through the content store, so identical files are only held in memory once.
+        If the file is already in the store, and the tree knows its hash, it is not read at all.
+        :param path: Path of the file
+        :return: (string): File contents
+        """
+        h = self.fs.blob_id(path)
+        if h:
+            text = CONTENT_STORE.get_blob(h)
+            if text is not None:
+                return text
+        return CONTENT_STORE.blob(self.fs.read(path), h=h)
+
+    def read_metafile(self, meta_file):
+        """
+        Read and parse a metafile, reusing the parse of any identical metafile.
+        The returned metadata is shared and must not be modified.
+        """
+        import oyaml
+        with span("metafile.parse", path=meta_file):
+            return CONTENT_STORE.parsed(self.read_file(meta_file), oyaml.safe_load)
+
     def build_from_local(self, path):
         self.path = path
         self.Repo = "local"
@@ -274,10 +614,47 @@ class Git:
 
         # Validate the values are valid
         snippet_file = rel_dir + os.sep + snippet_def["file"]
-        if not os.path.isfile(snippet_file):
+        if not self.fs.isfile(snippet_file):
             return False
 
         return True
 
+def build_cache_dir():
+    """
+    Get the directory builds are cached in. It is only ever read by this user, as the cache is unpickled.
+    """
+    return os.getenv("SKCLI_CACHE_DIR") or str(Path.home()) + os.sep + BUILD_CACHE_DIR
+
+
+def sync_repositories(repos, workers=SYNC_WORKERS, **clone_options):
+    """
+    Clone, or update, a list of Git repositories concurrently, then prebuild their skillets into the build cache.
+    :param repos: [ Git ]: Repositories, as returned from Github.index()
+    :param workers: Number of repositories to sync at once
+    :param clone_options: Extra options passed to Git.clone, such as depth or sparse.
+    :return: [ dict ]: Per repository result with name, seconds, snippet count and error (None if successful).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def sync_one(g):
+        name = g.github_info['name'] if g.github_info else g.name
+        start = time.time()
+        result = {"name": name, "snippets": 0, "error": None}
+        try:
+            g.clone(name, update=True, **clone_options)
+            sc = g.build_cached()
+            g.catalog()
+            for skillet in sc.skillet_map.values():
+                for ss in skillet.snippet_stack.values():
+                    result["snippets"] += len(ss.snippets)
+        except Exception as e:
+            # One broken repository should not stop the rest from syncing
+            result["error"] = "{}: {}".format(type(e).__name__, e)
+        result["seconds"] = time.time() - start
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(sync_one, repos))
+
 def check_git_exists():
     return shutil.which("git")
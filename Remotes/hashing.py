@@ -0,0 +1,205 @@
+import hmac
+import hashlib
+import itertools
+import threading
+import contextlib
+
+# Password hash scheme of each template filter
+HASH_FILTERS = {
+    "md5_hash": "md5_crypt",
+    "sha512_hash": "sha512_crypt",
+}
+# Salt length of each scheme
+SALT_SIZES = {
+    "md5_crypt": 8,
+    "sha512_crypt": 16,
+}
+SALT_CHARS = "./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# Template variable renders are given the HashService their cache key was made with in, for the hash filters to use
+SERVICE_VARIABLE = "__skcli_hash_service"
+
+
+class HashService:
+    """
+    Password hashing behind the md5_hash and sha512_hash template filters, with the settings of one run.
+
+    Hashes are memoized, so a password used by many snippets or devices in a run is only hashed once. Salts are random
+    unless a salt secret is set, in which case they are derived from the secret, the password and the device's salt
+    key - the value of salt_variable in the template context - so re-rendering for the same device always gives the
+    same hash, and renders can be diffed and cached.
+
+    Each run uses its own service, so runs served by the daemon at the same time don't share settings or hashes.
+    Templates rendered by the thread that set it with use_service() hash with it.
+
+    Usage::
+        with use_service(HashService(secret="s3cret", salt_variable="FW_NAME")) as service:
+            service.hash_many([("sha512_crypt", "password", "fw1"), ("sha512_crypt", "password", "fw2")], workers=4)
+            service.hash("sha512_crypt", "password", "fw1")  # Already hashed
+    """
+    # Identifies each service, as random salts make renders hashing a password differ between them
+    ids = itertools.count()
+
+    def __init__(self, secret=None, salt_variable=None):
+        """
+        :param secret: Secret to derive salts from. Salts are random if not set.
+        :param salt_variable: Template variable whose value makes the salts of each device different, such as FW_NAME.
+        """
+        self.hashes = {}
+        self.secret = secret
+        self.salt_variable = salt_variable
+        self.id = next(HashService.ids)
+        self.lock = threading.Lock()
+
+    def key(self, scheme, txt, salt_key=None):
+        # Random salts don't depend on the device, so one hash serves every device
+        return (scheme, txt, salt_key if self.secret else None)
+
+    def salt(self, scheme, txt, salt_key=None):
+        """
+        Get the salt to hash a password with.
+        :return: (string), or None for a random salt.
+        """
+        if not self.secret:
+            return None
+        msg = "\0".join([scheme, str(salt_key or ""), txt]).encode("utf-8")
+        digest = hmac.new(self.secret.encode("utf-8"), msg, hashlib.sha256).digest()
+        return "".join(SALT_CHARS[b % len(SALT_CHARS)] for b in digest[:SALT_SIZES[scheme]])
+
+    def hash(self, scheme, txt, salt_key=None):
+        """
+        Hash a password, reusing any earlier hash of it.
+        :param scheme: md5_crypt or sha512_crypt
+        :param txt: Password
+        :param salt_key: Device the hash is for, only used with a salt secret.
+        :return: (string): Password hash, in crypt format
+        """
+        key = self.key(scheme, txt, salt_key)
+        h = self.hashes.get(key)
+        if h is None:
+            h = hash_password(scheme, txt, self.salt(scheme, txt, salt_key))
+            with self.lock:
+                h = self.hashes.setdefault(key, h)
+        return h
+
+    def hash_many(self, requests, workers=1, pool=None):
+        """
+        Hash many passwords at once, across worker processes, so later calls to hash() return straight away.
+        Hashing holds the GIL, so threads wouldn't run it in parallel.
+        :param requests: Iterable of (scheme, password, salt key)
+        :param workers: Number of processes to hash with
+        :param pool: ProcessPoolExecutor to hash with, so callers hashing many times start the processes only once.
+            One is started for this call if not given.
+        """
+        todo = {}
+        for scheme, txt, salt_key in requests:
+            key = self.key(scheme, txt, salt_key)
+            if key not in self.hashes and key not in todo:
+                todo[key] = (scheme, txt, self.salt(scheme, txt, salt_key))
+
+        if not todo:
+            return
+        if workers <= 1 or len(todo) == 1:
+            results = [hash_password(*args) for args in todo.values()]
+        elif pool:
+            results = list(pool.map(hash_password, *zip(*todo.values())))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            jobs = list(todo.values())
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+                results = list(executor.map(hash_password, *zip(*jobs)))
+
+        with self.lock:
+            for key, h in zip(todo.keys(), results):
+                self.hashes.setdefault(key, h)
+
+    def salt_key(self, context):
+        """
+        Get the salt key of a template context.
+        """
+        if not self.salt_variable:
+            return None
+        return context.get(self.salt_variable)
+
+    def fingerprint(self, context):
+        """
+        Get everything, besides the password, that the hashes rendered with a context depend on, for render cache keys.
+        Hashes with random salts are only reused by the same service.
+        """
+        if not self.secret:
+            return ("random", self.id)
+        return (hashlib.sha1(self.secret.encode("utf-8")).hexdigest(), str(self.salt_key(context)))
+
+
+def hash_filter(scheme):
+    """
+    Get a Jinja filter hashing with a scheme, using the service the template is rendered with: the SERVICE_VARIABLE of
+    the template context if given, otherwise the current service.
+    """
+    try:
+        from jinja2 import pass_context
+    except ImportError:
+        from jinja2 import contextfilter as pass_context
+
+    @pass_context
+    def hash_with_service(context, txt):
+        service = context.get(SERVICE_VARIABLE) or current_service()
+        return service.hash(scheme, txt, service.salt_key(context))
+    return hash_with_service
+
+
+def current_service():
+    """
+    Get the HashService of the current thread, as set by use_service(), or the default one.
+    """
+    return getattr(LOCAL, "service", None) or DEFAULT_HASH_SERVICE
+
+
+@contextlib.contextmanager
+def use_service(service):
+    """
+    Hash with a service in this thread, for as long as the context lasts.
+    Threads started meanwhile must be given the service to use themselves.
+    """
+    previous = getattr(LOCAL, "service", None)
+    LOCAL.service = service
+    try:
+        yield service
+    finally:
+        LOCAL.service = previous
+
+
+def hash_password(scheme, txt, salt=None):
+    """
+    Hash a password. A module level function, so it can be run in worker processes.
+    :param scheme: Name of a passlib hash, md5_crypt or sha512_crypt
+    :param txt: Password
+    :param salt: Salt to use, random if not set.
+    """
+    from passlib import hash as passlib_hash
+    handler = getattr(passlib_hash, scheme)
+    if salt:
+        handler = handler.using(salt=salt)
+    return handler.hash(txt)
+
+
+def hashed_variables(ast):
+    """
+    Find the passwords a template hashes.
+    :param ast: Parsed template
+    :return: [ (scheme, variable name) ]: Hash filters applied directly to a variable. Filters applied to anything else
+    have a variable name of None.
+    """
+    from jinja2 import nodes
+
+    r = []
+    for f in ast.find_all(nodes.Filter):
+        if f.name in HASH_FILTERS:
+            name = f.node.name if isinstance(f.node, nodes.Name) else None
+            r.append((HASH_FILTERS[f.name], name))
+    return r
+
+
+# Hashing used outside of runs, such as by the library, with random salts
+DEFAULT_HASH_SERVICE = HashService()
+# Service of each thread, set by use_service()
+LOCAL = threading.local()
@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import hashlib
+from .skillet import *
+from .gcloud import Gcloud
+
+# Name of the index file kept for each mirrored skillet
+INDEX_FILENAME = "index.json"
+# Directory, within each mirrored skillet, that holds the snippet bodies
+BLOB_DIR = "blobs"
+# Snippet fields queries are matched against. Snippets the list API doesn't give these for can't be checked against the
+# device, so are only queried if asked for.
+INDEX_FIELDS = ["type", "stack", "panos_version"]
+
+
+class Mirror:
+    """
+    Local mirror of the SkilletCloud catalog.
+
+    Snippets are synced from the API into an on-disk store and then queried and rendered locally, so no network access
+    is required once a mirror has been synced. Mirror provides the same query interface as Gcloud.
+
+    Usage::
+        from Remotes import Mirror
+        m = Mirror("skilletcloud-mirror")
+        m.sync("https://api-dot-skilletcloud-prod.appspot.com", "iron-skillet")
+        m.Query('iron-skillet', 'panos', 'snippets', ['tag'], '9.0', {})
+    """
+    def __init__(self, path):
+        self.path = path
+        self.indexes = {}
+
+    def sync(self, url, skillet_name):
+        """
+        Sync a skillet from the snippet API into the mirror.
+
+        Snippet bodies are stored by content hash, so only new or changed snippets are written on later syncs.
+        :param url: URL of the snippet API
+        :param skillet_name: Skillet to mirror
+        :return: (dict): Counts of added, unchanged and removed snippet bodies.
+        """
+        skillet_dir = self.skillet_dir(skillet_name)
+        blob_dir = skillet_dir + os.sep + BLOB_DIR
+        os.makedirs(blob_dir, exist_ok=True)
+
+        previous = self.load_index(skillet_name)
+        old_hashes = set(e['hash'] for e in previous['snippets'])
+
+        gc = Gcloud(url)
+        entries = []
+        hashes = set()
+        added = 0
+        for sjson in gc.StreamList(skillet_name):
+            xml = sjson['xml']
+            h = hashlib.sha1(xml.encode("utf-8")).hexdigest()
+            if h not in hashes and not os.path.isfile(self.blob_path(skillet_name, h)):
+                write_atomic(self.blob_path(skillet_name, h), xml)
+                added += 1
+            hashes.add(h)
+            entries.append({
+                "name": sjson['name'],
+                "type": sjson.get('type'),
+                "stack": sjson.get('stack'),
+                "panos_version": sjson.get('panos_version'),
+                "path": sjson['path'],
+                "variables": sjson.get('variables', []),
+                "hash": h,
+            })
+
+        untyped = [e['name'] for e in entries if e['type'] is None or e['stack'] is None]
+        if untyped:
+            print("Warning: the snippet list for {} doesn't give the type or stack of {} snippets ({}), so they are left "
+                  "out of queries unless --mirror_untyped is given.".format(
+                    skillet_name, len(untyped), ", ".join(sorted(set(untyped)))))
+
+        removed = old_hashes - hashes
+        for h in removed:
+            try:
+                os.remove(self.blob_path(skillet_name, h))
+            except FileNotFoundError:
+                pass
+
+        index = {
+            "skillet": skillet_name,
+            "source": url,
+            "synced": time.time(),
+            "snippets": entries,
+        }
+        write_atomic(skillet_dir + os.sep + INDEX_FILENAME, json.dumps(index))
+        self.indexes.pop(skillet_name, None)
+
+        return {
+            "added": added,
+            "unchanged": len(hashes) - added,
+            "removed": len(removed),
+        }
+
+    def Query(self, skillet_name, type, stack, snippet_names, major_version, context, untyped=False):
+        """
+        Query the mirror, rendering the matching snippets locally.
+
+        Takes the same arguments as Gcloud.Query.
+        :param untyped: Also match snippets the list API didn't give a type or stack for, whatever the device type.
+        :return: List of Snippet instances.
+        """
+        return list(self.StreamQuery(skillet_name, type, stack, snippet_names, major_version, context, untyped))
+
+    def StreamQuery(self, skillet_name, type, stack, snippet_names, major_version, context, untyped=False):
+        """
+        Query the mirror, yielding each matching snippet once it has been rendered.
+
+        Takes the same arguments as Query.
+        :return: Generator of Snippet instances.
+        """
+        index = self.get_index(skillet_name)
+        candidates = index['by_type_stack'].get((type, stack), [])
+        if untyped:
+            candidates = candidates + index['untyped']
+        for entry in candidates:
+            if "all" not in snippet_names and entry['name'] not in snippet_names:
+                continue
+            if not version_matches(entry.get('panos_version'), major_version):
+                continue
+
+            with open(self.blob_path(skillet_name, entry['hash'])) as f:
+                xml = f.read()
+            snippet = Snippet(entry['path'], xml)
+            snippet.name = sys.intern(entry['name'])
+            snippet.set_metadata({"variables": entry.get('variables') or []})
+            snippet.template(context)
+            yield snippet
+
+    def List(self, skillet_name, **kwargs):
+        """
+        List all snippets in a mirrored Skillet.
+
+        :param skillet_name: Skillet to query
+        :param kwargs: Key/value filters, matched against the snippet fields.
+        :return: List of snippet dicts
+        """
+        return list(self.StreamList(skillet_name, **kwargs))
+
+    def StreamList(self, skillet_name, **kwargs):
+        """
+        List all snippets in a mirrored Skillet, one at a time.
+
+        Takes the same arguments as List.
+        :return: Generator of snippet dicts
+        """
+        index = self.get_index(skillet_name)
+        for entry in index['snippets']:
+            if all(str(entry.get(k)) == str(v) for k, v in kwargs.items()):
+                yield entry
+
+    def StreamNames(self, skillet_name, **kwargs):
+        """
+        List the distinct names of the snippets in a mirrored Skillet, in the order they were mirrored.
+
+        Takes the same arguments as List.
+        :return: Generator of snippet names
+        """
+        names = set()
+        for entry in self.StreamList(skillet_name, **kwargs):
+            if entry['name'] not in names:
+                names.add(entry['name'])
+                yield entry['name']
+
+    def get_index(self, skillet_name):
+        """
+        Get the index of a mirrored skillet, loading it from disk the first time it is used.
+        :param skillet_name: Skillet name
+        :return: (dict): Index
+        """
+        if skillet_name in self.indexes:
+            return self.indexes[skillet_name]
+
+        index = self.load_index(skillet_name)
+        if not index['snippets'] and not os.path.isfile(self.skillet_dir(skillet_name) + os.sep + INDEX_FILENAME):
+            raise ValueError("Skillet {} has not been mirrored to {}. Run with --mirror first.".format(
+                skillet_name, self.path))
+
+        # Snippets without a type or stack can't be indexed, so are only checked by queries asking for them
+        by_type_stack = {}
+        untyped = []
+        for entry in index['snippets']:
+            if entry.get('type') is None or entry.get('stack') is None:
+                untyped.append(entry)
+            else:
+                by_type_stack.setdefault((entry['type'], entry['stack']), []).append(entry)
+        index['by_type_stack'] = by_type_stack
+        index['untyped'] = untyped
+
+        self.indexes[skillet_name] = index
+        return index
+
+    def load_index(self, skillet_name):
+        index_file = self.skillet_dir(skillet_name) + os.sep + INDEX_FILENAME
+        if not os.path.isfile(index_file):
+            return {"skillet": skillet_name, "snippets": []}
+
+        with open(index_file) as f:
+            return json.load(f)
+
+    def skillet_dir(self, skillet_name):
+        return self.path + os.sep + skillet_name
+
+    def blob_path(self, skillet_name, h):
+        return self.skillet_dir(skillet_name) + os.sep + BLOB_DIR + os.sep + h + ".xml"
+
+
+def version_matches(snippet_version, major_version):
+    """
+    Check whether a snippet is valid for a PANOS version, using the same rules as the snippet API filter.
+    :param snippet_version: Version, or list of versions, supported by the snippet. Empty if it supports all versions.
+    :param major_version: Major version of the device (9.0)
+    """
+    if not snippet_version or not major_version:
+        return True
+    if isinstance(snippet_version, list):
+        return major_version in snippet_version
+    return snippet_version == major_version
+
+
+def write_atomic(path, data):
+    """
+    Write a file such that readers only ever see either the old or the new contents.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,160 @@
+import re
+from xml.etree import ElementTree
+from xml.etree.ElementTree import ParseError
+
+# Splits an xpath into steps, ignoring any / within a predicate
+XPATH_STEP_RX = re.compile(r"(?:[^/\[]|\[[^\]]*\])+")
+# Name of the entry selected by an xpath step, such as entry[@name='vsys1']
+ENTRY_NAME_RX = re.compile(r"""^entry\[@name=['"](.*)['"]\]$""")
+# Elements whose text names another object. Lists of references are made of members, such as the tags of a rule; the
+# rest refer to a single object, such as a rule's log forwarding profile.
+REFERENCE_TAGS = {
+    "member", "log-setting", "schedule", "interface", "virtual-router", "management-profile", "zone-protection-profile",
+    "netflow-profile", "ike-crypto-profile", "ipsec-crypto-profile", "authentication-profile", "certificate-profile",
+    "server-profile", "tunnel-interface", "ike-gateway",
+}
+
+
+class PushScheduler:
+    """
+    Orders rendered snippets so that everything a snippet depends on is pushed before it.
+
+    A snippet depends on:
+        - Any snippet set at an ancestor of its xpath, which creates the configuration it is set within.
+        - Any snippet defining an object its XML refers to by name, such as the tags and addresses used by a security
+          rule.
+
+    Snippets without dependencies between them keep their original order. If snippets depend on each other in a
+    cycle, the cycle is broken in original order.
+
+    Usage::
+        scheduler = PushScheduler(snippets)
+        for wave in scheduler.waves():
+            # Snippets within a wave don't depend on each other, so can be pushed concurrently
+            ...
+    """
+    def __init__(self, snippets):
+        """
+        :param snippets: [ Snippet ]: Rendered snippets, in their original order.
+        """
+        self.snippets = snippets
+        self.deps = [set() for s in snippets]
+
+        steps = [xpath_steps(s.rendered_xpath) for s in snippets]
+        by_path = {}
+        for i, path in enumerate(steps):
+            by_path.setdefault(path, []).append(i)
+
+        definers = {}
+        trees = []
+        for i, s in enumerate(snippets):
+            tree = parse_snippet(s.rendered_xmlstr)
+            trees.append(tree)
+            for name in defined_names(steps[i], tree):
+                definers.setdefault(name, []).append(i)
+
+        for i, path in enumerate(steps):
+            # Snippets at an ancestor xpath
+            for depth in range(1, len(path)):
+                for j in by_path.get(path[:depth], []):
+                    self.deps[i].add(j)
+            # Snippets defining referenced objects
+            if trees[i] is not None:
+                for name in referenced_names(trees[i]):
+                    for j in definers.get(name, []):
+                        if j != i:
+                            self.deps[i].add(j)
+
+    def waves(self):
+        """
+        Group the snippets into waves, where every dependency of a snippet is in an earlier wave.
+        :return: [ [ Snippet ] ]
+        """
+        return [[self.snippets[i] for i in wave] for wave in self.wave_indexes()]
+
+    def wave_indexes(self):
+        """
+        Group the snippets into waves, as per waves(), by their position in the original order.
+        :return: [ [ int ] ]
+        """
+        n = len(self.snippets)
+        waiting = [len(d) for d in self.deps]
+        dependents = [[] for i in range(n)]
+        for i, deps in enumerate(self.deps):
+            for j in deps:
+                dependents[j].append(i)
+
+        done = [False] * n
+        earliest = 0
+        waves = []
+        wave = [i for i in range(n) if waiting[i] == 0]
+        while earliest < n:
+            if not wave:
+                # Everything left is in, or waiting on, a cycle. Break it at the earliest snippet.
+                while done[earliest]:
+                    earliest += 1
+                wave = [earliest]
+            for i in wave:
+                done[i] = True
+            waves.append(wave)
+
+            ready = []
+            for i in wave:
+                for k in dependents[i]:
+                    waiting[k] -= 1
+                    if waiting[k] == 0 and not done[k]:
+                        ready.append(k)
+            wave = sorted(ready)
+            while earliest < n and done[earliest]:
+                earliest += 1
+
+        return waves
+
+    def order(self):
+        """
+        Get the snippets in the order they should be pushed.
+        :return: [ Snippet ]
+        """
+        return [s for wave in self.waves() for s in wave]
+
+
+def xpath_steps(xpath):
+    """
+    Split an xpath into a tuple of normalized steps.
+    """
+    return tuple(step.strip().replace('"', "'") for step in XPATH_STEP_RX.findall(xpath or ""))
+
+
+def parse_snippet(xmlstr):
+    try:
+        return ElementTree.fromstring("<root>" + xmlstr + "</root>")
+    except ParseError:
+        return None
+
+
+def defined_names(steps, tree):
+    """
+    Get the names of the objects a snippet defines: the entry its xpath selects, or the entries at its top level.
+    """
+    names = []
+    if steps:
+        m = ENTRY_NAME_RX.match(steps[-1])
+        if m:
+            names.append(m.group(1))
+    if tree is not None:
+        for e in tree.findall("./entry"):
+            if "name" in e.attrib:
+                names.append(e.attrib["name"])
+    return names
+
+
+def referenced_names(tree):
+    """
+    Get the names of the objects a snippet refers to, from the text of its member and other reference elements.
+    Other text, such as yes or allow, is configuration rather than a reference.
+    """
+    names = set()
+    for e in tree.iter():
+        if e.tag in REFERENCE_TAGS and e.text and e.text.strip():
+            names.add(e.text.strip())
+    return names
@@ -1,8 +1,298 @@
-from jinja2 import Template, Environment, BaseLoader
-from passlib.hash import des_crypt
-from passlib.hash import md5_crypt
-from passlib.hash import sha512_crypt
 from xml.etree import ElementTree
+import sys
+import json
+import contextlib
+import hashlib
+import threading
+from panosxml.trace import traced
+from panosxml.metrics import CACHE, SPLITS, SPLIT_PIECES
+from .hashing import HASH_FILTERS, SERVICE_VARIABLE, current_service, hash_filter, hashed_variables
+
+
+# Total characters of rendered templates kept for reuse
+RENDER_CACHE_SIZE = 32 * 1024 * 1024
+# Total characters of snippet bodies and other source text kept for sharing
+BLOB_CACHE_SIZE = 64 * 1024 * 1024
+# Number of parsed metafiles, and of compiled templates, kept for reuse
+OBJECT_CACHE_ENTRIES = 20000
+# Contexts rendered together by each step of a batch render
+RENDER_BATCH_SIZE = 256
+
+
+class ContentStore:
+    """
+    Content addressed store of snippet bodies, parsed metafiles and compiled templates.
+
+    Everything is keyed by the git blob hash of its source text, so identical files from different branches,
+    repositories or forks are only held, parsed and compiled once. Each part of the store is bounded, dropping its
+    oldest entries when full, so a long running process doesn't grow without limit.
+
+    Usage::
+        store = ContentStore()
+        xmlstr = store.blob(text)
+        metadata = store.parsed(text, oyaml.safe_load)
+        template = store.template(xmlstr)
+    """
+    def __init__(self):
+        self.env = None
+        self.lock = threading.Lock()
+        self.clear()
+
+    def blob(self, text, h=None):
+        """
+        Get the shared copy of a piece of text.
+        :param text: Text to store
+        :param h: Blob hash of text, if already known.
+        :return: (string): text, or the identical string already in the store.
+        """
+        if not h:
+            h = blob_hash(text)
+        with self.lock:
+            return self.blobs.add(h, text)
+
+    def get_blob(self, h):
+        """
+        Get text by blob hash, without needing the text itself.
+        :return: (string) or None if it is not in the store.
+        """
+        return self.blobs.get(h)
+
+    def parsed(self, text, parser, h=None):
+        """
+        Parse text, reusing the result of any previous parse of the same text.
+        The result is shared, so must not be modified.
+        :param text: Text to parse
+        :param parser: Function to parse text with, such as oyaml.safe_load
+        :param h: Blob hash of text, if already known.
+        """
+        if not h:
+            h = blob_hash(text)
+        key = (h, parser)
+        result = self.parsed_objects.get(key)
+        if result is None:
+            result = parser(text)
+            with self.lock:
+                result = self.parsed_objects.add(key, result)
+        return result
+
+    def template(self, source, h=None):
+        """
+        Get the compiled Jinja template for the given source.
+        :param source: Template source
+        :param h: Blob hash of source, if already known.
+        :return: jinja2.Template
+        """
+        if not h:
+            h = blob_hash(source)
+        t = self.templates.get(h)
+        if t is None:
+            t = self.get_env().from_string(source)
+            with self.lock:
+                t = self.templates.add(h, t)
+        return t
+
+    def variables(self, source, h=None):
+        """
+        Get the names of the variables a template reads from its context.
+        :return: (tuple): Sorted variable names
+        """
+        if not h:
+            h = blob_hash(source)
+        names = self.template_variables.get(h)
+        if names is None:
+            from jinja2 import meta
+            names = tuple(sorted(meta.find_undeclared_variables(self.get_env().parse(source))))
+            with self.lock:
+                names = self.template_variables.add(h, names)
+        return names
+
+    def hashes(self, source, h=None):
+        """
+        Get the passwords a template hashes with the md5_hash and sha512_hash filters.
+        :return: [ (scheme, variable name) ]: As per hashing.hashed_variables
+        """
+        if not h:
+            h = blob_hash(source)
+        found = self.template_hashes.get(h)
+        if found is None:
+            found = hashed_variables(self.get_env().parse(source)) if "_hash" in source else []
+            with self.lock:
+                found = self.template_hashes.add(h, found)
+        return found
+
+    def render(self, source, context, h=None):
+        """
+        Render a template, reusing the output of an earlier render if the variables it uses had the same values.
+
+        Contexts that only differ in variables a template doesn't use, such as device overlays of a shared base, share
+        its rendered output.
+        :param source: Template source
+        :param context: Template variables, a dict or Context.
+        :param h: Blob hash of source, if already known.
+        :return: (string): Rendered template
+        """
+        if not h:
+            h = blob_hash(source)
+        # The hashes are rendered with the same service as the key is made with
+        service = current_service() if self.hashes(source, h) else None
+        key = self.render_key(h, self.variables(source, h), context, service)
+        rendered = self.rendered.get(key)
+        CACHE.inc(cache="render", result="miss" if rendered is None else "hit")
+        if rendered is None:
+            rendered = self.template(source, h).render(context, **{SERVICE_VARIABLE: service})
+            with self.lock:
+                self.rendered.add(key, rendered)
+        return rendered
+
+    def render_key(self, h, names, context, service=None):
+        """
+        :param service: HashService the template hashes passwords with, if it hashes any.
+        """
+        values = tuple((name in context, json.dumps(context.get(name), sort_keys=True, default=str)) for name in names)
+        if service:
+            # Password hashes also depend on the salt secret and the device they are for
+            values += (service.fingerprint(context),)
+        return (h, values)
+
+    def render_many(self, sources, contexts, workers=1):
+        """
+        Render templates with each of many contexts.
+
+        Each template is compiled and analysed once for the whole batch, and rendered once for each distinct set of
+        values of the variables it uses, so contexts that differ only in variables a template doesn't use share its
+        output. Output is produced as contexts are consumed, so contexts may be a generator of any length.
+        :param sources: [ string ]: Template sources
+        :param contexts: Iterable of template variables, each a dict or Context.
+        :param workers: Number of threads to render with. Passwords the templates hash are hashed beforehand, for each
+            batch, across this many processes, as hashing holds the GIL. The processes are started once, and only if
+            there is something to hash.
+        :return: Iterator of (tuple): The rendered sources, for each context in order.
+        """
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        hashes = [blob_hash(source) for source in sources]
+        names = [self.variables(source, h) for source, h in zip(sources, hashes)]
+        templates = [self.template(source, h) for source, h in zip(sources, hashes)]
+        hashed = [self.hashes(source, h) for source, h in zip(sources, hashes)]
+        # Captured here, as the renders run in other threads
+        service = current_service()
+        services = [service if p else None for p in hashed]
+        rendered = {}
+        rendered_size = 0
+
+        with contextlib.ExitStack() as stack:
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=workers)) if workers > 1 else None
+            pool = None
+            for batch in batches(contexts, RENDER_BATCH_SIZE):
+                keys = []
+                todo = {}
+                passwords = []
+                for context in batch:
+                    ks = [self.render_key(h, n, context, s) for h, n, s in zip(hashes, names, services)]
+                    keys.append(ks)
+                    for i, key in enumerate(ks):
+                        if key not in rendered and key not in todo:
+                            todo[key] = (templates[i], context)
+                            passwords += [(scheme, context.get(name), service.salt_key(context))
+                                          for scheme, name in hashed[i] if isinstance(context.get(name), str)]
+
+                CACHE.inc(len(todo), cache="render", result="miss")
+                CACHE.inc(len(batch) * len(sources) - len(todo), cache="render", result="hit")
+                jobs = [(t.render, context) for t, context in todo.values()]
+                if workers > 1:
+                    if passwords and pool is None:
+                        pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+                    service.hash_many(passwords, workers, pool)
+                    outputs = executor.map(lambda job: job[0](job[1], **{SERVICE_VARIABLE: service}), jobs)
+                else:
+                    outputs = [render(context, **{SERVICE_VARIABLE: service}) for render, context in jobs]
+
+                batch_rendered = dict(zip(todo.keys(), outputs))
+                for ks in keys:
+                    yield tuple(batch_rendered[k] if k in batch_rendered else rendered[k] for k in ks)
+
+                # Keep renders for later batches, while they fit in the cache size
+                for key, output in batch_rendered.items():
+                    if rendered_size + len(output) <= RENDER_CACHE_SIZE:
+                        rendered[key] = output
+                        rendered_size += len(output)
+
+    def get_env(self):
+        if not self.env:
+            from jinja2 import Environment, BaseLoader
+            e = Environment(loader=BaseLoader)
+            for name, scheme in HASH_FILTERS.items():
+                e.filters[name] = hash_filter(scheme)
+            self.env = e
+        return self.env
+
+    def clear(self):
+        with self.lock:
+            self.blobs = BoundedDict(BLOB_CACHE_SIZE, len)
+            self.parsed_objects = BoundedDict(OBJECT_CACHE_ENTRIES)
+            self.templates = BoundedDict(OBJECT_CACHE_ENTRIES)
+            self.template_variables = BoundedDict(OBJECT_CACHE_ENTRIES)
+            self.template_hashes = BoundedDict(OBJECT_CACHE_ENTRIES)
+            self.rendered = BoundedDict(RENDER_CACHE_SIZE, len)
+
+
+class BoundedDict(dict):
+    """
+    A dict that drops its oldest entries to stay within a total size.
+
+    Entries are only added with add(), under the owner's lock. Reads don't need the lock.
+    """
+    def __init__(self, limit, size=None):
+        """
+        :param limit: Largest total size of the values
+        :param size: Function giving the size of a value. Each value counts as 1 if not set.
+        """
+        super().__init__()
+        self.limit = limit
+        self.size = size or (lambda value: 1)
+        self.total = 0
+
+    def add(self, key, value):
+        """
+        Add an entry, unless the key is already present.
+        :return: The value now stored under key, or value itself if it is too big to keep.
+        """
+        if key in self:
+            return self[key]
+        n = self.size(value)
+        if n > self.limit:
+            return value
+        while self.total + n > self.limit:
+            self.total -= self.size(self.pop(next(iter(self))))
+        self[key] = value
+        self.total += n
+        return value
+
+# Store shared by every skillet loaded in this process
+CONTENT_STORE = ContentStore()
+
+def batches(items, size):
+    """
+    Group an iterable into lists of up to size items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def blob_hash(text):
+    """
+    Hash text the same way git hashes a blob, so hashes from the git object database can be used directly.
+    """
+    data = text.encode("utf-8")
+    h = hashlib.sha1()
+    h.update("blob {}\0".format(len(data)).encode("utf-8"))
+    h.update(data)
+    return h.hexdigest()
 
 
 class SkilletCollection:
@@ -79,11 +369,7 @@ class Skillet:
             return self.snippet_stack[stack_name].snippets
 
         for nameentry in names:
-            vals = nameentry.split("/")
-            name = vals[0]
-            entry_name = None
-            if len(vals) > 1:
-                entry_name = vals[1]
+            name, entry_name = split_name_entry(nameentry)
 
             for snippet in self.snippet_stack[stack_name].snippets:
                 if snippet.name == name:
@@ -93,9 +379,73 @@ class Skillet:
 
         return r
 
+    def render(self, stack_name, names, context):
+        """
+        Template and select snippets, as per template() followed by select_snippets(), but on copies of the snippets.
+        The skillet itself is left untouched, so it can be rendered with different contexts at the same time.
+        :param stack_name: Snippet stack to select from
+        :param names: Snippet names, optionally with an entry (name/entry), or "all"
+        :param context: Template variables
+        :return: [ Snippet ]: Rendered copies
+        """
+        r = []
+        if "all" in names:
+            for snippet in self.snippet_stack[stack_name].snippets:
+                s = snippet.copy()
+                s.template(context)
+                r.append(s)
+            return r
+
+        for nameentry in names:
+            name, entry_name = split_name_entry(nameentry)
+
+            for snippet in self.snippet_stack[stack_name].snippets:
+                if snippet.name == name:
+                    s = snippet.copy()
+                    s.template(context)
+                    s.select_entry(entry_name)
+                    r = r + self.split_snippet(s)
+
+        return r
+
+    def render_many(self, stack_name, names, contexts, workers=1):
+        """
+        Render snippets with each of many contexts, such as one per device group or site, as per render() but
+        compiling and analysing each snippet only once for the whole batch.
+        :param stack_name: Snippet stack to select from
+        :param names: Snippet names, optionally with an entry (name/entry), or "all"
+        :param contexts: Iterable of template variables
+        :param workers: Number of threads to render with
+        :return: Iterator of [ Snippet ]: Rendered copies, for each context in order.
+        """
+        selected = []
+        for nameentry in (["all"] if "all" in names else names):
+            name, entry_name = split_name_entry(nameentry)
+            for snippet in self.snippet_stack[stack_name].snippets:
+                if name == "all" or snippet.name == name:
+                    selected.append((snippet, entry_name))
+
+        sources = []
+        for snippet, entry_name in selected:
+            sources += [snippet.xpath, snippet.xmlstr]
+
+        for rendered in snippet_contexts(selected, sources, contexts, workers):
+            r = []
+            for i, (snippet, entry_name) in enumerate(selected):
+                s = snippet.copy()
+                s.rendered_xpath = sys.intern(rendered[2 * i])
+                s.rendered_xmlstr = rendered[2 * i + 1]
+                if "all" in names:
+                    r.append(s)
+                else:
+                    s.select_entry(entry_name)
+                    r = r + self.split_snippet(s)
+            yield r
+
     def get_all_stacks(self):
         return self.snippet_stack.keys()
 
+    @traced("snippet.split")
     def split_snippet(self, snippet):
         """
         Cuts an oversized snippet into smaller snippets on the basis that most snippets are
@@ -107,31 +457,25 @@ class Skillet:
         length = len(snippet_string)
 
         if length > 6000:
-            # Wrap the xml in root elements so we can parse it
-            snippet_string = "<root>" + snippet_string + "</root>"
-            root = ElementTree.fromstring(snippet_string)
-            elems = root.findall("./entry")
+            spans = entry_spans(snippet_string)
         else:
             return [snippet]
 
-        new_snippets = []
-        if not elems:
+        if not spans:
             print("Error: Oversized snippet that cannot be split, exiting.")
             exit(1)
 
-        for e in elems:
-            xmlstr = ElementTree.tostring(e)
-            xmlstr = xmlstr.decode("utf-8")
-            s = snippet.copy()
-            s.rendered_xmlstr = xmlstr
-            new_snippets.append(s)
-
-        return new_snippets
+        SPLITS.inc()
+        SPLIT_PIECES.inc(len(spans))
+        # Each piece is a view of the rendered snippet, rather than a copy of its entry
+        return [snippet.view(start, end) for start, end in spans]
 
 class SnippetStack:
     """
     Represents a "stack" of snippets, a logical grouping of configuration snippets within a skillet.
     """
+    __slots__ = ["snippets", "metadata"]
+
     def __init__(self, snippets, metadata):
         self.snippets = snippets
         self.metadata = metadata
@@ -140,42 +484,99 @@ class SnippetStack:
 class Snippet:
     """
     Snippet represents an XML blob along with some metadata such as xpath and required variables
+
+    Snippets are kept small, as large skillets have many thousands of them: there is no per instance __dict__, xpaths
+    are interned, metadata is shared by every snippet in a stack, and the pieces of a split snippet are views into the
+    rendered XML of the snippet they were split from.
     """
+    __slots__ = ["xpath", "xmlstr", "metadata", "name", "rendered_xpath", "rendered_buffer", "rendered_start",
+                 "rendered_end", "hashes"]
+
     def __init__(self, xpath, xmlstr):
-        self.xpath = xpath
+        self.xpath = sys.intern(xpath) if xpath else xpath
         self.xmlstr = xmlstr
         self.metadata = {}
         self.name = ""
+        # (xpath, xmlstr, and their blob hashes), once rendered
+        self.hashes = None
 
         self.rendered_xpath = ""
         self.rendered_xmlstr = ""
 
+    @property
+    def rendered_xmlstr(self):
+        if self.rendered_end is None:
+            return self.rendered_buffer
+        return self.rendered_buffer[self.rendered_start:self.rendered_end]
+
+    @rendered_xmlstr.setter
+    def rendered_xmlstr(self, xmlstr):
+        self.rendered_buffer = xmlstr
+        self.rendered_start = 0
+        self.rendered_end = None
+
     def get_xpath(self):
         return self.xpath
 
     def set_metadata(self, metadata):
         self.metadata = metadata
         
+    def default_context(self):
+        context = {}
+        variables = self.metadata['variables']
+        for snippet_var in variables:
+            context[snippet_var['name']] = snippet_var['default']
+        return context
+
+    @traced("snippet.template")
     def template(self, context):
         if not context:
-            context = {}
-            variables = self.metadata['variables']
-            for snippet_var in variables:
-                context[snippet_var['name']] = snippet_var['default']
+            context = self.default_context()
 
-        e = Environment(loader=BaseLoader)
-        e.filters["md5_hash"] = md5_hash
+        xpath_hash, xmlstr_hash = self.source_hashes()
+        self.rendered_xpath = sys.intern(CONTENT_STORE.render(self.xpath, context, xpath_hash))
+        self.rendered_xmlstr = CONTENT_STORE.render(self.xmlstr, context, xmlstr_hash)
 
-        t = e.from_string(self.xpath)
-        self.rendered_xpath = t.render(context)
+    def source_hashes(self):
+        """
+        Get the blob hashes of the xpath and XML templates, only hashing them again if they have changed.
+        """
+        hashes = self.hashes
+        if hashes is None or hashes[0] is not self.xpath or hashes[1] is not self.xmlstr:
+            hashes = self.hashes = (self.xpath, self.xmlstr, blob_hash(self.xpath), blob_hash(self.xmlstr))
+        return hashes[2], hashes[3]
 
-        t = e.from_string(self.xmlstr)
-        self.rendered_xmlstr = t.render(context)
+    def render_many(self, contexts, workers=1):
+        """
+        Render this snippet with each of many contexts, without changing the snippet itself.
+        :param contexts: Iterable of template variables. Empty contexts use the snippet's default variables.
+        :param workers: Number of threads to render with
+        :return: Iterator of (rendered xpath, rendered xmlstr), for each context in order.
+        """
+        for xpath, xmlstr in snippet_contexts([(self, None)], [self.xpath, self.xmlstr], contexts, workers):
+            yield sys.intern(xpath), xmlstr
 
     def copy(self):
         s = Snippet(self.xpath, self.xmlstr)
-        s.rendered_xmlstr = self.rendered_xmlstr
+        s.name = self.name
+        s.metadata = self.metadata
+        s.hashes = self.hashes
         s.rendered_xpath = self.rendered_xpath
+        s.rendered_buffer = self.rendered_buffer
+        s.rendered_start = self.rendered_start
+        s.rendered_end = self.rendered_end
+        return s
+
+    def view(self, start, end):
+        """
+        Get a copy of this snippet whose rendered XML is part of this snippet's rendered XML, without copying it.
+        :param start: Start offset within rendered_xmlstr
+        :param end: End offset within rendered_xmlstr
+        :return: Snippet
+        """
+        s = self.copy()
+        s.rendered_start = self.rendered_start + start
+        s.rendered_end = self.rendered_start + end
         return s
 
     def select_entry(self, name):
@@ -203,6 +604,88 @@ class Snippet:
         for e in elems:
             print("      " + e.attrib["name"])
 
+def snippet_contexts(selected, sources, contexts, workers):
+    """
+    Batch render snippet sources, filling any empty context with the default variables of the first snippet.
+    """
+    defaults = []
+
+    def fill(context):
+        if context:
+            return context
+        if not defaults:
+            defaults.append(selected[0][0].default_context() if selected else {})
+        return defaults[0]
+
+    return CONTENT_STORE.render_many(sources, (fill(c) for c in contexts), workers)
+
+def entry_spans(xmlstr):
+    """
+    Find each top level <entry> element of a snippet, without parsing it into a tree or serializing it again.
+    :param xmlstr: Snippet XML
+    :return: [ (start, end) ]: Offsets of each entry within xmlstr
+    """
+    from xml.parsers import expat
+
+    prefix = "<root>"
+    data = (prefix + xmlstr + "</root>").encode("utf-8")
+    parser = expat.ParserCreate()
+    byte_spans = []
+    state = {"depth": 0, "start": None, "ended": False}
+
+    def event(*args):
+        # An entry ends wherever the next piece of XML starts
+        if state["ended"]:
+            byte_spans.append((state["start"], parser.CurrentByteIndex))
+            state["ended"] = False
+
+    def start_element(name, attrs):
+        event()
+        state["depth"] += 1
+        if state["depth"] == 2 and name == "entry":
+            state["start"] = parser.CurrentByteIndex
+
+    def end_element(name):
+        event()
+        if state["depth"] == 2 and name == "entry":
+            state["ended"] = True
+        state["depth"] -= 1
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = event
+    parser.CommentHandler = event
+    parser.ProcessingInstructionHandler = event
+    parser.StartCdataSectionHandler = event
+    parser.Parse(data, True)
+
+    offset = len(prefix)
+    if len(data) == len(xmlstr) + len(prefix) + len("</root>"):
+        # Plain ASCII, so byte and character offsets are the same
+        return [(start - offset, end - offset) for start, end in byte_spans]
+
+    spans = []
+    byte_pos = offset
+    char_pos = 0
+    for start, end in byte_spans:
+        char_pos += len(data[byte_pos:start].decode("utf-8"))
+        char_start = char_pos
+        char_pos += len(data[start:end].decode("utf-8"))
+        byte_pos = end
+        spans.append((char_start, char_pos))
+    return spans
+
+def split_name_entry(nameentry):
+    """
+    Split a snippet selection of the form name/entry.
+    :return: (name, entry name or None)
+    """
+    vals = nameentry.split("/")
+    entry_name = None
+    if len(vals) > 1:
+        entry_name = vals[1]
+    return vals[0], entry_name
+
 # define functions for custom jinja filters
 def md5_hash(txt):
     '''
@@ -211,4 +694,13 @@ def md5_hash(txt):
     :return: password hash of the string with salt and configuration information. Suitable to place in the phash field
     in the configurations
     '''
-    return md5_crypt.hash(txt)
\ No newline at end of file
+    return current_service().hash("md5_crypt", txt)
+
+
+def sha512_hash(txt):
+    '''
+    Returns the SHA512 Hashed secret for use as a password hash in the PanOS configuration
+    :param txt: text to be hashed
+    :return: password hash of the string, in sha512_crypt format.
+    '''
+    return current_service().hash("sha512_crypt", txt)
\ No newline at end of file
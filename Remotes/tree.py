@@ -0,0 +1,98 @@
+import os
+
+
+class LocalTree:
+    """
+    Read access to skillet files on local disk.
+
+    The Git remote reads all skillet files through a tree object, so the same build logic works whether the files are
+    on disk or somewhere else, such as in the git object database.
+    """
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def blob_id(self, path):
+        # Files on disk have to be read to be hashed
+        return None
+
+
+class GitTree:
+    """
+    Read access to skillet files in a git commit, without checking it out.
+
+    Paths are given as they would be in the working tree of the repository, and are resolved relative to root.
+    """
+    def __init__(self, tree, root):
+        """
+        :param tree: git.Tree of the commit to read from
+        :param root: Path of the repository working tree
+        """
+        self.tree = tree
+        self.root = root
+
+    def get(self, path):
+        """
+        Get the git object at a working tree path.
+        :return: git.Tree or git.Blob, or None if the path does not exist in the commit.
+        """
+        rel = os.path.relpath(os.path.normpath(path), os.path.normpath(self.root))
+        if rel.startswith(os.pardir):
+            return None
+
+        obj = self.tree
+        for part in rel.split(os.sep):
+            if part in ["", os.curdir]:
+                continue
+            if obj.type != "tree":
+                return None
+            try:
+                obj = obj / part
+            except KeyError:
+                return None
+
+        return obj
+
+    def isdir(self, path):
+        obj = self.get(path)
+        return obj is not None and obj.type == "tree"
+
+    def isfile(self, path):
+        obj = self.get(path)
+        return obj is not None and obj.type == "blob"
+
+    def exists(self, path):
+        return self.get(path) is not None
+
+    def listdir(self, path):
+        obj = self.get(path)
+        if obj is None or obj.type != "tree":
+            raise NotADirectoryError(path)
+        return [o.name for o in obj]
+
+    def read(self, path):
+        obj = self.get(path)
+        if obj is None or obj.type != "blob":
+            raise FileNotFoundError(path)
+        return obj.data_stream.read().decode("utf-8")
+
+    def blob_id(self, path):
+        """
+        Get the git blob hash of a file without reading it.
+        """
+        obj = self.get(path)
+        if obj is None or obj.type != "blob":
+            raise FileNotFoundError(path)
+        return obj.hexsha
@@ -0,0 +1,381 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import threading
+import contextlib
+import subprocess
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from Remotes import Git
+from Remotes.skillet import CONTENT_STORE
+from panosxml import Panos
+from skilletcli import ResultLog
+
+"""
+benchmark
+
+Repeatable performance benchmarks of building, rendering, listing and pushing skillets, run against generated
+skillet repositories so that results are comparable between runs and machines.
+
+Each run is appended to a results file, and compared with the previous run of the same size so regressions stand out.
+
+Usage::
+    python benchmark.py --size medium --repeat 5
+    python benchmark.py --size large --only build,template
+    python benchmark.py --size large --memory
+"""
+
+# Shape of the generated repository for each size: snippet stacks, snippets per stack, <entry> elements per snippet,
+# and how deeply the Jinja in each snippet is nested.
+SIZES = {
+    "tiny": {"stacks": 2, "snippets": 2, "entries": 200, "depth": 1},
+    "small": {"stacks": 20, "snippets": 10, "entries": 500, "depth": 2},
+    "medium": {"stacks": 200, "snippets": 10, "entries": 2000, "depth": 3},
+    "large": {"stacks": 2000, "snippets": 5, "entries": 20000, "depth": 4},
+}
+# Results file, appended to by every run
+RESULTS_FILENAME = ".skcli_benchmarks.jsonl"
+# Relative slowdown, against the previous run, reported as a regression
+REGRESSION_THRESHOLD = 0.2
+# Slowdowns smaller than this many seconds are treated as noise
+NOISE_FLOOR = 0.01
+# Number of contexts, such as device groups, rendered by the render_many benchmark
+RENDER_CONTEXTS = 1000
+
+
+def make_repo(path, stacks, snippets, entries, depth):
+    """
+    Generate a skillet repository.
+
+    Every snippet body is a list of <entry> elements, built with variables, filters, a macro and depth levels of nested
+    loops and conditionals.
+    :param path: Directory to create the repository in
+    :param stacks: Number of snippet stacks
+    :param snippets: Number of snippets in each stack
+    :param entries: Number of <entry> elements in each snippet
+    :param depth: Nesting depth of Jinja blocks in each snippet
+    :return: Path of the repository
+    """
+    for stack in range(stacks):
+        stack_name = "stack{}".format(stack)
+        snippet_dir = os.path.join(path, "templates", "panos", stack_name)
+        os.makedirs(snippet_dir)
+        meta = [
+            "name: {}".format(stack_name),
+            "type: panos",
+            "variables:",
+            "  - name: TAG_COLOR",
+            "    default: color1",
+            "  - name: PREFIX",
+            "    default: bench",
+            "  - name: COMMENT",
+            "    default: generated",
+            "  - name: ENABLED",
+            "    default: true",
+            "snippets:",
+        ]
+        for snippet in range(snippets):
+            name = "{}-snippet{}".format(stack_name, snippet)
+            meta += [
+                "  - name: {}".format(name),
+                "    xpath: /config/shared/tag/{{{{ PREFIX }}}}-{}".format(snippet),
+                "    file: {}.xml".format(name),
+            ]
+            with open(os.path.join(snippet_dir, name + ".xml"), "w") as f:
+                f.write(snippet_body(name, entries, depth))
+
+        with open(os.path.join(snippet_dir, ".meta-cnc.yaml"), "w") as f:
+            f.write("\n".join(meta) + "\n")
+
+    git = ["git", "-C", path, "-c", "user.name=benchmark", "-c", "user.email=benchmark@localhost"]
+    subprocess.run(git[:3] + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "-A"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "Generated skillet"], check=True)
+    return path
+
+
+def snippet_body(name, entries, depth):
+    lines = [
+        "{% macro entry(n, color) -%}",
+        "<entry name='{{ PREFIX }}-{{ n }}'><color>{{ color }}</color>"
+        "{% if COMMENT %}<comments>{{ COMMENT | upper }} {{ n | string | length }}</comments>{% endif %}</entry>",
+        "{%- endmacro %}",
+    ]
+    # Nested blocks, each level adding a handful of entries
+    for level in range(depth):
+        lines.append("{{% if ENABLED %}}{{% for i{0} in range(2) %}}".format(level))
+        lines.append("{{{{ entry('{}-l{}-' ~ i{}, TAG_COLOR) }}}}".format(name, level, level))
+    lines += ["{% endfor %}{% endif %}"] * depth
+    # The bulk of the snippet is plain entries, so the body is large once rendered
+    for i in range(entries):
+        if i % 10 == 0:
+            lines.append("{{{{ entry('{}-{}', TAG_COLOR) }}}}".format(name, i))
+        else:
+            lines.append("<entry name='{}-{}'><color>{{{{ TAG_COLOR }}}}</color></entry>".format(name, i))
+
+    return "\n".join(lines)
+
+
+class DeviceHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in PANOS device that accepts every request.
+    """
+    response = b'<response status="success" code="20"><msg>command succeeded</msg></response>'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.response)))
+        self.end_headers()
+        self.wfile.write(self.response)
+
+    def log_message(self, *args):
+        pass
+
+
+class Benchmarks:
+    """
+    The benchmarks, run against one generated repository.
+
+    Each benchmark is a method named bench_<name>, timed separately from any setup it needs.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.sc = None
+        self.skillet = None
+        self.snippets = []
+
+    def names(self):
+        return [m[len("bench_"):] for m in dir(self) if m.startswith("bench_")]
+
+    def setup(self):
+        self.sc = Git("").build_from_local(self.path)
+        self.skillet = self.sc.get_skillet("panos")
+        self.skillet.template(None)
+        stack = sorted(self.skillet.snippet_stack.keys())[0]
+        self.snippets = self.skillet.select_snippets(stack, [s.name for s in self.skillet.snippet_stack[stack].snippets])
+
+    def bench_build(self):
+        # Measure a cold build, as a new process would see it
+        CONTENT_STORE.clear()
+        Git("").build_from_local(self.path)
+
+    def bench_template(self):
+        self.skillet.template(None)
+
+    def bench_render_many(self):
+        stack = sorted(self.skillet.snippet_stack.keys())[0]
+        contexts = ({"PREFIX": "dg{}".format(i), "TAG_COLOR": "color1", "COMMENT": "generated", "ENABLED": True}
+                    for i in range(RENDER_CONTEXTS))
+        for snippets in self.skillet.render_many(stack, ["all"], contexts):
+            pass
+
+    def bench_select(self):
+        for stack_name, stack in self.skillet.snippet_stack.items():
+            self.skillet.select_snippets(stack_name, [s.name for s in stack.snippets])
+
+    def bench_list(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.sc.print_all_skillets(elements=True)
+
+    def bench_push(self):
+        server = HTTPServer(("127.0.0.1", 0), DeviceHandler)
+        t = threading.Thread(target=server.serve_forever, daemon=True)
+        t.start()
+        try:
+            fw = Panos("127.0.0.1:{}".format(server.server_port), apikey="benchmark")
+            fw.url = "http://127.0.0.1:{}/api".format(server.server_port)
+            results = ResultLog("jsonl", stream=io.StringIO())
+            for snippet in self.snippets:
+                results.push(fw, snippet)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def run_benchmarks(size, repeat=3, only=None, workdir=None):
+    """
+    Generate a repository and time each benchmark against it.
+    :param size: Name of the size in SIZES, or a dict of make_repo arguments.
+    :param repeat: Number of times to run each benchmark
+    :param only: Names of the benchmarks to run, all if not set.
+    :param workdir: Directory to generate the repository in, a temporary directory if not set.
+    :return: (dict): Benchmark name: min, median and mean seconds
+    """
+    shape = SIZES[size] if isinstance(size, str) else size
+    tmp = None
+    if not workdir:
+        tmp = workdir = tempfile.mkdtemp(prefix="skcli-bench-")
+
+    try:
+        path = make_repo(os.path.join(workdir, "skillet"), **shape)
+        benchmarks = Benchmarks(path)
+        benchmarks.setup()
+        results = {}
+        for name in benchmarks.names():
+            if only and name not in only:
+                continue
+            times = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                getattr(benchmarks, "bench_" + name)()
+                times.append(time.perf_counter() - start)
+            times.sort()
+            results[name] = {
+                "min": round(times[0], 6),
+                "median": round(times[len(times) // 2], 6),
+                "mean": round(sum(times) / len(times), 6),
+            }
+        return results
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def measure_memory(size, workdir=None):
+    """
+    Generate a repository and measure the memory held by building, rendering and splitting every snippet in it.
+    :param size: Name of the size in SIZES, or a dict of make_repo arguments.
+    :param workdir: Directory to generate the repository in, a temporary directory if not set.
+    :return: (dict): Bytes allocated at each stage, and per snippet once split.
+    """
+    shape = SIZES[size] if isinstance(size, str) else size
+    tmp = None
+    if not workdir:
+        tmp = workdir = tempfile.mkdtemp(prefix="skcli-bench-")
+
+    try:
+        path = make_repo(os.path.join(workdir, "skillet"), **shape)
+        CONTENT_STORE.clear()
+        tracemalloc.start()
+        try:
+            sc = Git("").build_from_local(path)
+            built = tracemalloc.get_traced_memory()[0]
+            skillet = sc.get_skillet("panos")
+            skillet.template(None)
+            rendered = tracemalloc.get_traced_memory()[0]
+            pieces = []
+            for stack_name, stack in skillet.snippet_stack.items():
+                pieces += skillet.select_snippets(stack_name, [s.name for s in stack.snippets])
+            split, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            CONTENT_STORE.clear()
+
+        return {
+            "build": built,
+            "template": rendered - built,
+            "split": split - rendered,
+            "peak": peak,
+            "pieces": len(pieces),
+            "split_per_piece": round((split - rendered) / max(len(pieces), 1), 1),
+        }
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def current_commit():
+    r = subprocess.run(["git", "-C", os.path.dirname(os.path.abspath(__file__)), "rev-parse", "--short", "HEAD"],
+                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return r.stdout.decode("utf-8").strip() or None
+
+
+def load_results(results_file):
+    if not os.path.isfile(results_file):
+        return []
+
+    with open(results_file) as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+
+def save_result(results_file, run):
+    with open(results_file, "a") as f:
+        f.write(json.dumps(run) + "\n")
+
+
+def compare(run, previous, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare a run with a previous run of the same size, using the fastest time of each as the least noisy.
+    :return: [ (benchmark, previous time, time, relative change, regressed) ]
+    """
+    r = []
+    for name, result in run["results"].items():
+        if name not in previous["results"]:
+            continue
+        before = previous["results"][name]["min"]
+        after = result["min"]
+        change = (after - before) / before if before > 0 else 0
+        r.append((name, before, after, change, change > threshold and after - before > NOISE_FLOOR))
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark skilletcli against generated skillet repositories.")
+    parser.add_argument("--size", default="small", choices=SIZES.keys(), help="Size of repository to generate.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to run each benchmark.")
+    parser.add_argument("--only", help="Comma separated benchmarks to run.")
+    parser.add_argument("--results", default=RESULTS_FILENAME, help="File to append results to.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Slowdown, relative to the previous run, to report as a regression.")
+    parser.add_argument("--memory", action="store_true", help="Measure memory use instead of timing.")
+    args = parser.parse_args()
+
+    if args.memory:
+        print("Measuring {} memory use: {}".format(args.size, SIZES[args.size]))
+        memory = measure_memory(args.size)
+        previous = [r for r in load_results(args.results) if r["size"] == args.size and "memory" in r]
+        save_result(args.results, {
+            "time": time.time(),
+            "commit": current_commit(),
+            "python": platform.python_version(),
+            "size": args.size,
+            "memory": memory,
+        })
+        if previous:
+            print("Compared with {} ({})".format(previous[-1]["commit"], time.ctime(previous[-1]["time"])))
+        for name, value in memory.items():
+            before = previous[-1]["memory"].get(name) if previous else None
+            if before:
+                print("  {:<16} {:>14,} -> {:>14,} {:>+7.1%}".format(name, before, value, (value - before) / before))
+            else:
+                print("  {:<16} {:>14,}".format(name, value))
+        return
+
+    only = args.only.split(",") if args.only else None
+    print("Running {} benchmarks: {}".format(args.size, SIZES[args.size]))
+    run = {
+        "time": time.time(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "size": args.size,
+        "repeat": args.repeat,
+        "results": run_benchmarks(args.size, repeat=args.repeat, only=only),
+    }
+
+    previous = [r for r in load_results(args.results) if r["size"] == args.size and "results" in r]
+    save_result(args.results, run)
+
+    regressions = 0
+    if previous:
+        print("Compared with {} ({})".format(previous[-1]["commit"], time.ctime(previous[-1]["time"])))
+        for name, before, after, change, regressed in compare(run, previous[-1], args.threshold):
+            regressions += regressed
+            print("  {:<10} {:>10.4f}s -> {:>10.4f}s {:>+7.1%}{}".format(name, before, after, change,
+                                                                         "  REGRESSION" if regressed else ""))
+    else:
+        for name, result in run["results"].items():
+            print("  {:<10} {:>10.4f}s".format(name, result["min"]))
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
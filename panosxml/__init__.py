@@ -1,2 +1,7 @@
 from .keydb import *
-from .device import Panos
\ No newline at end of file
+from .device import Panos
+from .trace import TRACER, TraceHook
+from .journal import Journal
+from .ledger import Ledger
+from .config import ConfigTree
+from .metrics import METRICS
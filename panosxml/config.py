@@ -0,0 +1,137 @@
+import re
+import hashlib
+from xml.etree import ElementTree
+
+# Splits an xpath into steps, ignoring any / within a predicate
+XPATH_STEP_RX = re.compile(r"(?:[^/\[]|\[[^\]]*\])+")
+# A step selecting a child by tag, and optionally by one attribute, such as entry[@name='vsys1']
+STEP_RX = re.compile(r"""^([\w.:-]+)(?:\[@([\w.:-]+)=(?:'([^']*)'|"([^"]*)")\])?$""")
+# Number of xpath steps that load config partial applies at, so the whole config is applied in a few requests
+PARTIAL_DEPTH = 3
+
+
+class ConfigTree:
+    """
+    A PANOS configuration built up locally, by merging snippets into it the same way a "set" request would on the
+    device.
+
+    Once every snippet is merged, the configuration can be imported and applied to a device in a few requests, rather
+    than one request per snippet.
+
+    Usage::
+        tree = ConfigTree()
+        tree.set("/config/shared/tag", "<entry name='red'><color>color1</color></entry>")
+        tree.tostring()
+        tree.partial_xpaths()  # ["/config/shared/tag"]
+    """
+    def __init__(self, base=None):
+        """
+        :param base: XML of a configuration to start from, such as a device export. An empty config if not set.
+        :raises ValueError: If base is not a configuration.
+        :raises ParseError: If base is not XML.
+        """
+        if base:
+            self.root = ElementTree.fromstring(base)
+            if self.root.tag != "config":
+                raise ValueError("expected a <config>, got <{}>".format(self.root.tag))
+        else:
+            self.root = ElementTree.Element("config")
+        self.xpaths = []
+
+    def set(self, xpath, element):
+        """
+        Merge an element into the configuration at xpath, creating any missing parents.
+        :param xpath: Absolute xpath, such as /config/shared/tag
+        :param element: XML to merge into the node at xpath. May be several elements.
+        :raises ValueError: If the xpath can't be followed, as it uses a predicate other than [@attribute='value'].
+        """
+        steps = parse_xpath(xpath)
+        if not steps or steps[0] != (self.root.tag, None, None):
+            raise ValueError("xpath {} is not within <{}>".format(xpath, self.root.tag))
+
+        node = self.root
+        for tag, attr, value in steps[1:]:
+            child = None
+            for c in node.findall(tag):
+                if attr is None or c.get(attr) == value:
+                    child = c
+                    break
+            if child is None:
+                child = ElementTree.SubElement(node, tag)
+                if attr is not None:
+                    child.set(attr, value)
+            node = child
+
+        for e in ElementTree.fromstring("<root>" + element + "</root>"):
+            merge(node, e)
+        self.xpaths.append(xpath)
+
+    def partial_xpaths(self, depth=PARTIAL_DEPTH):
+        """
+        Get the xpaths to apply with load config partial, covering everything that has been set.
+
+        Each xpath is cut down to at most depth steps, and any xpath within another is dropped, so a whole baseline
+        is applied in a handful of requests.
+        :return: [ string ]: In the order they were first set.
+        """
+        r = []
+        for xpath in self.xpaths:
+            steps = XPATH_STEP_RX.findall(xpath)
+            path = "/" + "/".join(steps[:depth])
+            if path not in r:
+                r.append(path)
+
+        return [p for p in r if not any(p.startswith(other + "/") for other in r)]
+
+    def tostring(self):
+        return ElementTree.tostring(self.root, encoding="unicode")
+
+    def filename(self):
+        """
+        Get a name for this configuration when imported, unique to its content.
+        """
+        return "skilletcli-{}.xml".format(hashlib.sha1(self.tostring().encode("utf-8")).hexdigest()[:12])
+
+
+def parse_xpath(xpath):
+    """
+    Split an xpath into (tag, attribute, value) steps.
+    """
+    steps = []
+    for step in XPATH_STEP_RX.findall(xpath or ""):
+        m = STEP_RX.match(step.strip())
+        if not m:
+            raise ValueError("Unsupported xpath step {} in {}".format(step, xpath))
+        tag, attr, single, double = m.groups()
+        steps.append((tag, attr, single if single is not None else double))
+    return steps
+
+
+def element_key(e):
+    """
+    Get what identifies an element among its siblings: its name, for entries, or its text, for list members.
+    """
+    if "name" in e.attrib:
+        return (e.tag, e.attrib["name"])
+    if e.tag == "member":
+        return (e.tag, (e.text or "").strip())
+    return (e.tag,)
+
+
+def merge(parent, e):
+    """
+    Merge an element into parent. Matching elements are merged recursively, and the text of a matching leaf replaced.
+    """
+    key = element_key(e)
+    for existing in parent:
+        if element_key(existing) == key:
+            if len(e) == 0:
+                existing.text = e.text
+                existing.attrib.update(e.attrib)
+                return
+            existing.attrib.update(e.attrib)
+            for child in e:
+                merge(existing, child)
+            return
+
+    parent.append(e)
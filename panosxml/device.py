@@ -1,8 +1,9 @@
 from xml.etree import ElementTree
 from xml.etree.ElementTree import ParseError
-from urllib3.exceptions import ProtocolError
-import requests
 import re
+import time
+from .trace import span, traced
+from .metrics import REQUESTS, REQUEST_BYTES, RESPONSE_BYTES, REQUEST_SECONDS, KEYGEN_SECONDS
 class Panos:
     """
     PANOS Device class.
@@ -24,12 +25,18 @@ class Panos:
 
         self.verify = verify
 
+        self.addr = addr
         self.url = "https://{}/api".format(addr)
         self.user = user
         self.pw = pw
         self.key = ''
         self.model = ''
+        self.device_type = ''
+        self.sw_version = ''
+        self.major_sw_version = ''
         self.system_info = {}
+        # Connections are kept open between requests to the same device
+        self.session = None
         if debug == True:
             self.log_level = 1
         else:
@@ -44,6 +51,7 @@ class Panos:
             self.connect()
 
 
+    @traced("panos.keygen")
     def connect(self):
         """
         Connect to a PANOS device and retrieve an API key.
@@ -55,7 +63,9 @@ class Panos:
             "password": self.pw,
         }
         self.log("Connecting to {}".format(self.url))
+        start = time.perf_counter()
         r = self.send(params)
+        KEYGEN_SECONDS.observe(time.perf_counter() - start, device=self.addr)
         if not self.check_resp(r):
             print("Error on login received from PANOS: {}".format(r.text))
             exit(1)
@@ -71,24 +81,140 @@ class Panos:
         :param params: dict: POST parameters for query ({ "type": "op" })
         :return: GET Response type
         """
+        import requests
+        from urllib3.exceptions import ProtocolError
         url = self.url
         params["key"] = self.key
         self.log("{} : {}".format(url, params), level=2)
+        if not self.session:
+            self.session = requests.Session()
         try:
             # = requests.get(url, params=params, verify=False)
-            r = requests.post(url, data=params, verify=self.verify)
+            start = time.perf_counter()
+            with span("panos.send", type=params.get("type"), action=params.get("action")):
+                r = self.session.post(url, data=params, verify=self.verify)
         except ProtocolError:
             print("Failed to send a rqequest.")
             exit(1)
+        self.record(params, r, time.perf_counter() - start)
         return r
 
-    def get_type(self):
+    def record(self, params, r, seconds):
+        """
+        Record the metrics of a request to this device.
+        """
+        t = params.get("type")
+        REQUESTS.inc(device=self.addr, type=t, action=params.get("action") or params.get("category") or "",
+                     code=r.status_code)
+        REQUEST_BYTES.inc(len(r.request.body or ""), device=self.addr, type=t)
+        RESPONSE_BYTES.inc(len(r.content), device=self.addr, type=t)
+        REQUEST_SECONDS.observe(seconds, device=self.addr, type=t)
+
+    def upload(self, params, filename, content):
+        """
+        Send a request with a file attached, such as an import.
+        :param params: dict: POST parameters for query ({ "type": "import" })
+        :param filename: Name of the file on the device
+        :param content: (string): File content
+        :return: Response
+        """
+        import requests
+        url = self.url
+        params["key"] = self.key
+        self.log("{} : {} {}".format(url, params, filename), level=2)
+        if not self.session:
+            self.session = requests.Session()
+        start = time.perf_counter()
+        with span("panos.send", type=params.get("type"), action=params.get("category")):
+            r = self.session.post(url, data=params, files={"file": (filename, content.encode("utf-8"))},
+                                  verify=self.verify)
+        self.record(params, r, time.perf_counter() - start)
+        return r
+
+    def candidate_config(self):
+        """
+        Get the candidate configuration of this device, including any changes that haven't been committed yet.
+        :return: (string): Configuration XML, starting at <config>
+        """
+        r = self.send({"type": "config", "action": "show", "xpath": "/config"})
+        config = None
+        try:
+            config = ElementTree.fromstring(r.content).find("./result/config")
+        except ParseError:
+            pass
+        if config is None:
+            print("Error reading the candidate configuration from PANOS: {}".format(r.text))
+            exit(1)
+        return ElementTree.tostring(config, encoding="unicode")
+
+    def import_config(self, filename, xml):
+        """
+        Import a configuration file onto the device, without loading it.
+        :param filename: Name to save the configuration as
+        :param xml: Configuration XML
+        :return: Response
+        """
+        return self.upload({"type": "import", "category": "configuration"}, filename, xml)
+
+    def load_partial(self, filename, xpath, mode="merge"):
+        """
+        Load part of an imported configuration file into the candidate configuration.
+        :param filename: Name of an imported configuration file
+        :param xpath: xpath to load, taken from the same xpath in the file.
+        :param mode: merge, replace or append
+        :return: Response
+        """
+        cmd = ElementTree.Element("load")
+        partial = ElementTree.SubElement(ElementTree.SubElement(cmd, "config"), "partial")
+        ElementTree.SubElement(partial, "from").text = filename
+        ElementTree.SubElement(partial, "from-xpath").text = xpath
+        ElementTree.SubElement(partial, "to-xpath").text = xpath
+        ElementTree.SubElement(partial, "mode").text = mode
+        return self.send({"type": "op", "cmd": ElementTree.tostring(cmd, encoding="unicode")})
+
+    def config_version(self):
+        """
+        Get the version number of the committed configuration of this device, which goes up by one with every commit.
+        It is taken from the configuration audit history, so the configuration itself isn't read.
+        :return: (int), or None if the device doesn't support it.
+        """
+        r = self.send({"type": "op", "cmd": "<show><config><audit><info></info></audit></config></show>"})
+        try:
+            root = ElementTree.fromstring(r.content)
+        except ParseError:
+            return None
+        if root.get("status") != "success":
+            return None
+        versions = [v.text.strip() for v in root.findall("./result/entry/version") if v.text]
+        if not versions or not all(v.isdigit() for v in versions):
+            return None
+        return max(int(v) for v in versions)
+
+    def pending_changes(self):
+        """
+        Check if the candidate configuration of this device has changes that haven't been committed.
+        :return: (bool), or None if the device didn't say.
+        """
+        r = self.send({"type": "op", "cmd": "<check><pending-changes></pending-changes></check>"})
+        try:
+            root = ElementTree.fromstring(r.content)
+        except ParseError:
+            return None
+        result = root.find("./result")
+        if root.get("status") != "success" or result is None or result.text not in ["yes", "no"]:
+            return None
+        return result.text == "yes"
+
+    def get_type(self, refresh=True):
         """
         Get the type of PANOS device using show system info
 
-        :param panosxml: PANOS device object
+        :param refresh: If False, and the device details have already been retrieved, don't ask the device again.
         :return:
         """
+        if not refresh and self.device_type:
+            return self.device_type
+
         params = {
             "type": "op",
             "cmd": "<show><system><info></info></system></show>"
@@ -121,6 +247,7 @@ class Panos:
         self.major_sw_version = ".".join(self.sw_version.split(".")[0:2])
         self.log("Device details: {}:{} {} {}".format(type_result, t, self.sw_version, self.major_sw_version))
 
+        self.device_type = type_result
         return type_result
 
     def get_version(self):
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class Journal:
+    """
+    Durable record of every configuration request that has completed, so an interrupted run can be resumed without
+    repeating them.
+
+    The journal is an append only JSON Lines file. Each record is flushed to disk before the next request is sent, and
+    a partly written last line, from a run that died mid write, is ignored.
+
+    Usage::
+        journal = Journal(".skcli_journal.jsonl", resume=True)
+        key = journal.key("10.0.0.1", "tag", 0, xpath, element)
+        if not journal.done(key):
+            ...
+            journal.record(key)
+    """
+    def __init__(self, path, resume=False):
+        """
+        :param path: Journal file
+        :param resume: If True, keep the completed work from the existing journal. Otherwise start a new journal.
+        """
+        self.path = path
+        self.completed = set()
+        self.file = None
+        self.lock = threading.Lock()
+        if resume:
+            self.load()
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            # Cut off a record that was only partly written, so the next record starts on its own line
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+
+        for line in data[:end].decode("utf-8").splitlines():
+            try:
+                r = json.loads(line)
+            except ValueError:
+                continue
+            self.completed.add((r["job"], r["device"], r["snippet"], r["chunk"], r["hash"]))
+
+    def key(self, device, snippet, chunk, xpath, element, job=None):
+        """
+        Get the key identifying a request.
+        :param device: Device address
+        :param snippet: Snippet name
+        :param chunk: Position of this request within the snippet, for snippets split into many requests.
+        :param xpath: Rendered xpath
+        :param element: Rendered element
+        :param job: Plan job name, if any
+        """
+        h = hashlib.sha1()
+        h.update(xpath.encode("utf-8"))
+        h.update(b"\0")
+        h.update(element.encode("utf-8"))
+        return (job, device, snippet, chunk, h.hexdigest())
+
+    def done(self, key):
+        return key in self.completed
+
+    def record(self, key):
+        """
+        Record a request as complete, returning once it is on disk.
+        """
+        job, device, snippet, chunk, h = key
+        line = json.dumps({
+            "job": job,
+            "device": device,
+            "snippet": snippet,
+            "chunk": chunk,
+            "hash": h,
+            "time": time.time(),
+        })
+        with self.lock:
+            if not self.file:
+                self.file = open(self.path, "a")
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.completed.add(key)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
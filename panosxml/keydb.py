@@ -6,6 +6,7 @@ import json
 class KeyDB:
     """
     Maintains a mapping of Device to Apikey in the users home directory.
+    The credentials file is only read the first time a key is looked up or stored.
     Usage::
         kdb = Keystore("filename")
         kdb.enable()
@@ -16,7 +17,8 @@ class KeyDB:
         self.filename = fn
         self.enabled = False
         self.keys = {}
-        self.get_creds_file()
+        self.loaded = False
+        self.path = str(Path.home()) + os.sep + fn
 
     def enable(self):
         """
@@ -30,11 +32,8 @@ class KeyDB:
         Also configures this instance with all of the keys.
         :return: (dict): Index: keys mapping
         """
-        filename = self.filename
-
-        home = str(Path.home())
-        filepath = home + os.sep + filename
-        self.path = filepath
+        filepath = self.path
+        self.loaded = True
         if not os.path.isfile(filepath):
             return False
 
@@ -42,12 +41,24 @@ class KeyDB:
         self.keys = j
         return j
 
+    def load(self):
+        if not self.loaded:
+            self.get_creds_file()
+
+    def reload(self):
+        """
+        Read the credentials file again the next time a key is looked up, to pick up keys added by other processes.
+        """
+        self.keys = {}
+        self.loaded = False
+
     def lookup(self, device):
         """
         Lookup a single key from the store by index
         :param device: (string): Index
         :return: Key value
         """
+        self.load()
         if device in self.keys:
             return self.keys[device]
 
@@ -59,6 +70,7 @@ class KeyDB:
         """
         if not self.enabled:
             return
+        self.load()
         self.keys[device] = key
         fh = open(self.path, "w")
         json.dump(self.keys, fh)
@@ -71,6 +83,7 @@ class KeyDB:
         Does not delete the keystore file.
         """
         self.keys = {}
+        self.loaded = True
         fh = open(self.path, "w")
         json.dump(self.keys, fh)
         fh.close()
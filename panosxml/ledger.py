@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+# Name of the entry an element configures, if it is an entry
+ENTRY_NAME_RX = re.compile(r"""^\s*<entry\s+name=(['"])(.*?)\1""")
+
+
+class Ledger:
+    """
+    Record of what has been successfully pushed to each device, so unchanged snippets can be skipped on later runs
+    without reading from or writing to the device.
+
+    Pushes only change the candidate configuration, so they are recorded as pending, on top of the entries known to be
+    in the device's committed configuration. Once per run, the device's committed version and whether its candidate
+    has uncommitted changes are checked:
+    * If the candidate has no changes, any pending entries were reverted, and are dropped.
+    * If the configuration has been committed exactly once, and the only changes were our own pushes, they are now
+      committed.
+    * Any other change, such as a commit or uncommitted changes made by someone else, drops the device's entries, and
+      everything is pushed again.
+
+    Usage::
+        ledger = Ledger(".skcli_ledger.json")
+        if not ledger.unchanged(fw, xpath, element):
+            ...
+            ledger.record(fw, xpath, element)
+        ledger.save()
+    """
+    def __init__(self, path):
+        """
+        :param path: Ledger file, created on save if it doesn't exist.
+        """
+        self.path = path
+        # Device address: {"version": config version, "entries": {key: content hash}, "pending": {key: content hash}}
+        self.devices = {}
+        # Devices whose config version has been checked during this run
+        self.checked = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as f:
+            try:
+                self.devices = json.load(f)
+            except ValueError:
+                # A corrupt ledger only means everything is pushed again
+                self.devices = {}
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.devices, f)
+            os.replace(tmp, self.path)
+            self.changed = False
+
+    def version(self, fw):
+        """
+        Get the config version of a device, asking it only once per run, and bring its entries up to date with any
+        commits or reverts since the last run.
+        :return: (string), or None if the device didn't say, in which case nothing is skipped or recorded.
+        """
+        with self.lock:
+            if fw.addr in self.checked:
+                return self.checked[fw.addr]
+
+        version = fw.config_version()
+        pending = fw.pending_changes() if version is not None else None
+        if pending is None:
+            version = None
+        with self.lock:
+            self.checked[fw.addr] = version
+            if version is not None:
+                self.update(fw.addr, version, pending)
+        return version
+
+    def update(self, addr, version, pending):
+        """
+        Bring the entries of a device up to date with its configuration. Call with the lock held.
+        :param addr: Device address
+        :param version: Version number of the committed configuration
+        :param pending: Whether the candidate configuration has uncommitted changes.
+        """
+        device = self.devices.get(addr)
+        ours = device.get("pending", {}) if device else {}
+        # Ledgers from before versions were numbers are reset
+        if device and not isinstance(device["version"], int):
+            device = None
+        if device and device["version"] == version and not pending:
+            # Anything pushed since the last commit was reverted
+            if ours:
+                device["pending"] = {}
+                self.changed = True
+        elif device and device["version"] == version and ours:
+            # The uncommitted changes are our own pushes
+            pass
+        elif device and ours and not pending and version == device["version"] + 1:
+            # Our pushes were the only uncommitted changes, and have been committed. Any more commits could have changed
+            # them again, so aren't known to be ours.
+            device["entries"].update(ours)
+            device["pending"] = {}
+            device["version"] = version
+            self.changed = True
+        else:
+            self.devices[addr] = {"version": version, "entries": {}, "pending": {}}
+            self.changed = True
+
+    def unchanged(self, fw, xpath, element):
+        """
+        Check if an element was last pushed to this xpath of the device with the same content.
+        """
+        if self.version(fw) is None:
+            return False
+        with self.lock:
+            device = self.devices[fw.addr]
+            key = ledger_key(xpath, element)
+            pending = device.get("pending", {})
+            return pending.get(key, device["entries"].get(key)) == content_hash(element)
+
+    def record(self, fw, xpath, element):
+        """
+        Record an element as successfully pushed, to the candidate configuration.
+        """
+        if self.version(fw) is None:
+            return
+        with self.lock:
+            self.devices[fw.addr].setdefault("pending", {})[ledger_key(xpath, element)] = content_hash(element)
+            self.changed = True
+
+
+def ledger_key(xpath, element):
+    """
+    Get what an element is recorded under: its xpath, and the name of the entry it configures, as snippets split into
+    one request per entry share an xpath.
+    """
+    m = ENTRY_NAME_RX.match(element)
+    if m:
+        return xpath + "\0" + m.group(2)
+    return xpath
+
+
+def content_hash(element):
+    return hashlib.sha256(element.encode("utf-8")).hexdigest()
@@ -0,0 +1,250 @@
+import os
+import math
+import threading
+
+"""
+Aggregate metrics of everything skilletcli does: requests sent to devices, bytes, latencies, snippet splits and cache
+use.
+
+Metrics are always collected, as recording one is just a dict update, and can be exported in the Prometheus text
+format, either as a file for a textfile collector or from an HTTP endpoint::
+    from panosxml.metrics import METRICS, REQUESTS
+
+    REQUESTS.inc(device="10.0.0.1", type="config", action="set", code="200")
+    METRICS.write("skilletcli.prom")
+    serve_metrics(9150)
+"""
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric:
+    """
+    A named metric, with one series for each combination of label values.
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        """
+        :param name: Metric name, such as skcli_requests_total
+        :param help: Description of the metric
+        :param labels: Names of the labels every series has
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("{} needs labels {}, got {}".format(self.name, self.labels, sorted(labels)))
+        return tuple(str(labels[l]) for l in self.labels)
+
+    def label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(k, escape(v)) for k, v in pairs) + "}"
+
+    def clear(self):
+        with self.lock:
+            self.series = {}
+
+    def snapshot(self):
+        """
+        Get a copy of every series, to later export only what changed since.
+        """
+        import copy
+        with self.lock:
+            return copy.deepcopy(self.series)
+
+
+class Counter(Metric):
+    """
+    A count that only goes up, such as requests sent.
+    """
+    type = "counter"
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + value
+
+    def value(self, **labels):
+        return self.series.get(self.key(labels), 0)
+
+    def lines(self, since=None):
+        """
+        :param since: Snapshot to subtract, leaving out series that haven't changed since it was taken.
+        """
+        since = since or {}
+        with self.lock:
+            return ["{}{} {}".format(self.name, self.label_text(key), format_value(v - since.get(key, 0)))
+                    for key, v in sorted(self.series.items()) if since.get(key) != v]
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values, such as request latencies, counted into buckets.
+    """
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.series:
+                # Count in each bucket, sum and count of observations
+                self.series[key] = [[0] * len(self.buckets), 0, 0]
+            series = self.series[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self.series.get(self.key(labels))
+        return series[2] if series else 0
+
+    def lines(self, since=None):
+        """
+        :param since: Snapshot to subtract, leaving out series that haven't changed since it was taken.
+        """
+        since = since or {}
+        r = []
+        with self.lock:
+            for key, (counts, total, n) in sorted(self.series.items()):
+                if key in since:
+                    if since[key][2] == n:
+                        continue
+                    counts = [c - s for c, s in zip(counts, since[key][0])]
+                    total -= since[key][1]
+                    n -= since[key][2]
+                for bound, c in zip(self.buckets, counts):
+                    r.append("{}_bucket{} {}".format(self.name, self.label_text(key, [("le", format_value(bound))]), c))
+                r.append("{}_bucket{} {}".format(self.name, self.label_text(key, [("le", "+Inf")]), n))
+                r.append("{}_sum{} {}".format(self.name, self.label_text(key), format_value(total)))
+                r.append("{}_count{} {}".format(self.name, self.label_text(key), n))
+        return r
+
+
+class Metrics:
+    """
+    Registry of every metric, exported together.
+    """
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric {} is already registered".format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def exposition(self, since=None):
+        """
+        Get every metric in the Prometheus text format.
+        :param since: Snapshot from snapshot(), to only export what was recorded after it was taken.
+        """
+        since = since or {}
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append("# HELP {} {}".format(name, metric.help))
+            lines.append("# TYPE {} {}".format(name, metric.type))
+            lines += metric.lines(since.get(name))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Get the current value of every metric, such as at the start of a run whose metrics are exported on their own.
+        """
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def write(self, path, since=None):
+        """
+        Write every metric to a file, replacing it atomically so collectors never read a partial file.
+        :param since: Snapshot from snapshot(), to only write what was recorded after it was taken.
+        """
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.exposition(since))
+        os.replace(tmp, path)
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(v):
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf" if v > 0 else "-Inf"
+        return repr(v)
+    return str(v)
+
+
+def serve_metrics(port, addr="127.0.0.1"):
+    """
+    Serve every metric over HTTP, at /metrics, from a background thread.
+    :param port: Port to listen on, or 0 for any free port.
+    :param addr: Address to listen on
+    :return: HTTPServer. Stop it with shutdown().
+    """
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = METRICS.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((addr, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+METRICS = Metrics()
+
+REQUESTS = METRICS.counter(
+    "skcli_requests_total", "API requests sent to devices.", ["device", "type", "action", "code"])
+REQUEST_BYTES = METRICS.counter(
+    "skcli_request_bytes_total", "Bytes of API requests sent to devices.", ["device", "type"])
+RESPONSE_BYTES = METRICS.counter(
+    "skcli_response_bytes_total", "Bytes of API responses received from devices.", ["device", "type"])
+REQUEST_SECONDS = METRICS.histogram(
+    "skcli_request_seconds", "Latency of API requests to devices.", ["device", "type"])
+KEYGEN_SECONDS = METRICS.histogram(
+    "skcli_keygen_seconds", "Time taken to log in to devices and get an API key.", ["device"])
+SPLITS = METRICS.counter(
+    "skcli_snippet_splits_total", "Oversized snippets split into one request per entry.")
+SPLIT_PIECES = METRICS.counter(
+    "skcli_snippet_split_pieces_total", "Requests made from split snippets.")
+CACHE = METRICS.counter(
+    "skcli_cache_requests_total", "Lookups in the build and render caches.", ["cache", "result"])
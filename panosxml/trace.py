@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import threading
+import importlib
+import functools
+
+"""
+Tracing of where time is spent building, rendering and pushing skillets.
+
+Code marks out phases of work as named spans::
+    from panosxml.trace import span, traced
+
+    with span("panos.send", type="config"):
+        ...
+
+    @traced("git.build")
+    def build(self):
+        ...
+
+Spans cost next to nothing unless spans are being recorded, for --profile, or a hook has been added with
+TRACER.add_hook for external telemetry.
+"""
+
+
+class TraceHook:
+    """
+    Interface for receiving spans as they happen, such as to forward them to a telemetry system.
+
+    Hooks are called from whichever thread ran the span, so must be thread safe.
+    """
+    def span_started(self, span):
+        pass
+
+    def span_finished(self, span):
+        pass
+
+
+class Span:
+    """
+    A named, timed phase of work.
+    """
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = 0
+        self.duration = 0
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.tracer.started(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.finished(self)
+        return False
+
+
+class NullSpan:
+    """
+    Stands in for a span when nothing is listening.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """
+    Creates spans, records them, and passes them to hooks.
+    """
+    def __init__(self):
+        self.hooks = []
+        self.recording = False
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def span(self, name, **attrs):
+        """
+        Start a span, for use as a context manager.
+        :param name: Name of the phase, such as git.clone
+        :param attrs: Details of this span, such as the repository being cloned.
+        """
+        if not self.recording and not self.hooks:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def started(self, span):
+        for hook in self.hooks:
+            hook.span_started(span)
+
+    def finished(self, span):
+        if self.recording:
+            with self.lock:
+                self.spans.append(span)
+        for hook in self.hooks:
+            hook.span_finished(span)
+
+    def add_hook(self, hook):
+        """
+        Add a hook to receive every span.
+        :param hook: TraceHook instance
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def start_recording(self):
+        """
+        Record all spans from now on, discarding any previously recorded.
+        """
+        with self.lock:
+            self.spans = []
+            self.origin = time.perf_counter()
+        self.recording = True
+
+    def stop_recording(self):
+        self.recording = False
+
+    def totals(self):
+        """
+        Get the total time spent in each named span.
+        :return: [ (name, count, seconds) ]: Slowest first
+        """
+        totals = {}
+        for s in self.spans:
+            count, seconds = totals.get(s.name, (0, 0))
+            totals[s.name] = (count + 1, seconds + s.duration)
+
+        return sorted([(name, c, t) for name, (c, t) in totals.items()], key=lambda x: x[2], reverse=True)
+
+    def chrome_trace(self):
+        """
+        Get the recorded spans in the Chrome trace event format, as read by chrome://tracing and Perfetto.
+        :return: (dict): Trace
+        """
+        pid = os.getpid()
+        events = []
+        for s in self.spans:
+            events.append({
+                "name": s.name,
+                "cat": s.name.split(".")[0],
+                "ph": "X",
+                "ts": round((s.start - self.origin) * 1000000, 3),
+                "dur": round(s.duration * 1000000, 3),
+                "pid": pid,
+                "tid": s.thread,
+                "args": {k: str(v) for k, v in s.attrs.items()},
+            })
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+TRACER = Tracer()
+
+
+def span(name, **attrs):
+    """
+    Start a span on the global tracer.
+    """
+    return TRACER.span(name, **attrs)
+
+
+def traced(name):
+    """
+    Decorator running every call of a function in a span.
+    :param name: Name of the span
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def load_hook(spec):
+    """
+    Load a hook from a "module:name" spec. If name is a class or function, it is called to create the hook.
+    :param spec: Such as mytelemetry:SpanExporter
+    :return: TraceHook
+    """
+    module_name, _, attr = spec.partition(":")
+    if not module_name or not attr:
+        raise ValueError("Trace hook {} must be given as module:name".format(spec))
+
+    hook = getattr(importlib.import_module(module_name), attr)
+    if callable(hook):
+        hook = hook()
+    return hook
@@ -2,21 +2,30 @@
 
 import os
 import sys
-import oyaml
-import requests
-from yaml.scanner import ScannerError
 from xml.etree import ElementTree
 from xml.etree.ElementTree import ParseError
 from panosxml import Panos
 from colorama import init as colorama_init
-from panosxml import KeyDB
+from panosxml import KeyDB, Journal, ConfigTree, Ledger
+from panosxml.trace import TRACER, load_hook
+from panosxml.metrics import METRICS, serve_metrics
 import re
 from colorama import Fore, Back, Style
 import getpass
 import argparse
-from Remotes import Git, Gcloud, Github
+from Remotes import Git, Gcloud, Github, Mirror, Archive, query_key
+from Remotes.catalog import build_catalog, page, CATALOG_FIELDS
+from Remotes.context import load_variables, layered_context
+from Remotes.scheduler import PushScheduler
+from Remotes.hashing import HashService, current_service, use_service
+from Remotes.skillet import BoundedDict
 import json
-from beautifultable import BeautifulTable
+import io
+import threading
+import contextlib
+import traceback
+import time
+from pathlib import Path
 
 """
 skilletcli
@@ -30,39 +39,54 @@ CREDS_FILENAME = ".skcli.json"
 KEY_DB = KeyDB(CREDS_FILENAME)
 # API
 DEFAULT_API_URL = "https://api-dot-skilletcloud-prod.appspot.com"
+# Journal of completed requests, used by --resume
+JOURNAL_FILENAME = ".skcli_journal.jsonl"
+# Default record of what has been pushed to each device, in the users home directory
+LEDGER_FILENAME = ".skcli_ledger.json"
+# Daemon socket, in the users home directory
+SOCKET_FILENAME = ".skcli.sock"
+# Number of connected devices kept for reuse
+DEVICE_POOL_SIZE = 256
+# Connected devices, by (address, validate)
+DEVICE_POOL = BoundedDict(DEVICE_POOL_SIZE)
+DEVICE_POOL_LOCK = threading.Lock()
+# Opened SkilletCloud mirrors, by path
+MIRRORS = {}
+# Daemon requests change process wide state such as the working directory and stdout, so only one runs at a time
+DAEMON_LOCK = threading.Lock()
+# Whether there is a user to prompt for input. The daemon has none, so prompting fails rather than waiting forever.
+INTERACTIVE = True
 
-def create_context(config_var_file):
-    # read the metafile to get variables and values
-    try:
-        open(config_var_file, 'r')
-    except IOError as ioe:
-        fail_message = """{}Note: {} not found. Default variables for snippet stack will be used.{}
-        """.format(Fore.YELLOW, config_var_file, Style.RESET_ALL)
-        print(fail_message)
-        return None
+def create_context(config_var_file, overlays=()):
+    """
+    Build the template variables from a variable file, with any overlay files layered on top.
 
-    try_json = False
-    with open(config_var_file, 'r') as f:
+    Each file is only parsed once per process, and overlays share the layers below them rather than copying them.
+    :param config_var_file: Base variable file
+    :param overlays: Variable files overriding the base, such as site then device variables.
+    :return: Context, or None if none of the files exist.
+    """
+    layers = []
+    for i, path in enumerate([config_var_file] + list(overlays)):
         try:
-            variables = oyaml.safe_load(f.read())
-        except ScannerError:
-            try_json = True
-
-    if try_json:
-        with open(config_var_file, 'r') as f:
-            try:
-                variables = json.load(f)
-            except json.decoder.JSONDecodeError:
-                print("Configuration file could not be decoded as YAML or JSON!")
-                exit(1)
-
-    # grab the metadata values and convert to key-based dictionary
-    jinja_context = dict()
-
-    for snippet_var in variables['variables']:
-        jinja_context[snippet_var['name']] = snippet_var['value']
+            variables = load_variables(path)
+        except ValueError as e:
+            print("{}: {}".format(path, e))
+            exit(1)
+        if variables is None:
+            if i == 0:
+                fail_message = """{}Note: {} not found. Default variables for snippet stack will be used.{}
+            """.format(Fore.YELLOW, path, Style.RESET_ALL)
+            else:
+                fail_message = "{}Note: overlay {} not found, so it is not applied.{}".format(
+                    Fore.YELLOW, path, Style.RESET_ALL)
+            print(fail_message)
+            continue
+        layers.append(variables)
 
-    return jinja_context
+    if not layers:
+        return None
+    return layered_context(layers)
 
 def sanitize_element(element):
     """
@@ -116,6 +140,9 @@ def env_or_prompt(prompt, args, prompt_long=None, secret=False):
     if args.__dict__[prompt]:
         return args.__dict__[prompt]
 
+    if not INTERACTIVE:
+        raise EOFError("No {} given, and there is nobody to prompt for it.".format(prompt))
+
     if secret:
         e = getpass.getpass(prompt + ": ")
         return e
@@ -148,65 +175,566 @@ def check_resp(r, print_result=True):
             print("{}{} : Failed.{}".format(Fore.RED, r.text, Style.RESET_ALL))
         return False
 
-def push_from_gcloud(args):
+def parse_resp(r):
     """
-    Pull snippets from Gcloud instead of Git repos.
-    :param args: parsed args from argparse
+    Get the outcome of a PANOS API request.
+    :param r: Response
+    :return: (dict): status (success, error, or invalid if the response could not be parsed), PANOS error code and
+    error message.
     """
-    if args.repopath:
-        api_url = args.repopath
-    else:
-        api_url = DEFAULT_API_URL
+    try:
+        root = ElementTree.fromstring(r.content)
+    except ParseError as e:
+        return {"status": "invalid", "code": None, "message": str(e)}
 
-    gc = Gcloud(api_url)
+    status = root.attrib.get("status", "invalid")
+    message = ""
+    if status != "success":
+        message = " ".join(t.strip() for t in root.itertext() if t.strip())
+    return {"status": status, "code": root.attrib.get("code"), "message": message}
 
-    if len(args.snippetnames) == 0:
-        print("{}New: browse the available objects via SkilletCloud: https://skilletcloud-prod.appspot.com/skillets/{}{}".format(
-            Fore.GREEN, args.repository, Style.RESET_ALL))
-        snippets = gc.List(args.repository)
-        names = set()
-        for s in snippets:
-            names.add(s['name'])
-
-        for n in names:
-            print(n)
+class ResultLog:
+    """
+    Records the outcome of every snippet pushed to a device.
 
-        sys.exit(0)
+    In text mode each result is printed as it always has been. In jsonl mode each result is written as a JSON object on
+    its own line, with timings, followed by a summary record, and all other output goes to stderr instead.
+    """
+    def __init__(self, output="text", stream=None, journal=None, ledger=None):
+        """
+        :param output: text or jsonl
+        :param stream: Stream to write results to, stdout by default.
+        :param journal: Journal of completed requests. Requests already in the journal are skipped.
+        :param ledger: Ledger of what has been pushed to each device. Snippets unchanged since they were last pushed are
+        skipped.
+        """
+        self.output = output
+        self.stream = stream or sys.stdout
+        self.journal = journal
+        self.ledger = ledger
+        # Number of requests so far for each (job, device, snippet), as snippets can be split into many requests
+        self.chunks = {}
+        self.records = []
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def redirect(self):
+        """
+        Context manager sending everything except results to stderr, when writing JSON Lines.
+        """
+        if self.output == "jsonl":
+            return contextlib.redirect_stdout(sys.stderr)
+        return contextlib.ExitStack()
+
+    def push(self, fw, snippet, job=None, chunk=None, inline=True):
+        """
+        Push a rendered snippet to a device and record the result.
+        :param fw: Panos device
+        :param snippet: Rendered Snippet
+        :param job: Plan job this push is part of, if any.
+        :param chunk: Position of this request within its snippet, if the snippet was split. Counted in push order if
+        not given.
+        :param inline: In text mode, print what is being pushed before sending it. Must be False when pushing
+        concurrently, so each result is printed on one line.
+        :return: (bool): True if the device accepted the snippet.
+        """
+        job_name = job["name"] if job else None
+        inline = inline and job is None
+        if self.output == "text" and inline:
+            print("Doing {} at {}...".format(snippet.name, snippet.rendered_xpath), end="", flush=True)
+
+        journal_key = None
+        if self.journal:
+            if chunk is None:
+                chunk = self.next_chunk(fw, snippet, job_name)
+            journal_key = self.journal.key(fw.addr, snippet.name, chunk, snippet.rendered_xpath,
+                                           snippet.rendered_xmlstr, job=job_name)
+            if self.journal.done(journal_key):
+                self.skipped(fw, snippet, job_name, inline)
+                return True
+
+        if self.ledger and self.ledger.unchanged(fw, snippet.rendered_xpath, snippet.rendered_xmlstr):
+            self.skipped(fw, snippet, job_name, inline, message="Unchanged since last pushed")
+            return True
+
+        start = time.time()
+        r = set_at_path(fw, snippet.rendered_xpath, snippet.rendered_xmlstr)
+        latency = time.time() - start
+        result = parse_resp(r)
+        if result["status"] == "invalid" and self.output == "text" and inline:
+            print(r.content)
+            print(result["message"])
+            exit(1)
+
+        if journal_key and result["status"] == "success":
+            self.journal.record(journal_key)
+        if self.ledger and result["status"] == "success":
+            self.ledger.record(fw, snippet.rendered_xpath, snippet.rendered_xmlstr)
+
+        return self.response(fw, snippet.name, snippet.rendered_xpath, r, latency, job_name=job_name, inline=inline,
+                             result=result)
+
+    def response(self, fw, name, xpath, r, latency, job_name=None, inline=False, result=None):
+        """
+        Record the response to a request.
+        :param name: What was sent, such as the snippet name.
+        :param xpath: xpath the request was for
+        :param r: Response
+        :param latency: Seconds taken
+        :return: (bool): True if the device accepted the request.
+        """
+        if result is None:
+            result = parse_resp(r)
+        body = r.request.body or ""
+        self.add({
+            "job": job_name,
+            "device": fw.addr,
+            "snippet": name,
+            "xpath": xpath,
+            "request_bytes": len(body),
+            "http_status": r.status_code,
+            "status": result["status"],
+            "code": result["code"],
+            "message": result["message"] if self.output == "jsonl" else r.text,
+            "latency": round(latency, 6),
+        }, inline)
+        return result["status"] == "success"
+
+    def next_chunk(self, fw, snippet, job_name):
+        """
+        Count a request towards its snippet, returning its position within the snippet.
+        """
+        with self.lock:
+            chunk_key = (job_name, fw.addr, snippet.name)
+            chunk = self.chunks.get(chunk_key, 0)
+            self.chunks[chunk_key] = chunk + 1
+        return chunk
+
+    def skipped(self, fw, snippet, job_name, inline=False, message="Already pushed"):
+        self.add({
+            "job": job_name,
+            "device": fw.addr,
+            "snippet": snippet.name,
+            "xpath": snippet.rendered_xpath,
+            "request_bytes": 0,
+            "http_status": None,
+            "status": "skipped",
+            "code": None,
+            "message": message,
+            "latency": 0,
+        }, inline)
 
+    def error(self, job, message):
+        """
+        Record a job that failed before its snippets could be pushed.
+        """
+        self.add({
+            "job": job["name"],
+            "device": job["device"],
+            "snippet": None,
+            "xpath": None,
+            "request_bytes": 0,
+            "http_status": None,
+            "status": "error",
+            "code": None,
+            "message": message,
+            "latency": 0,
+        })
+
+    def add(self, record, inline=False):
+        record["type"] = "result"
+        record["time"] = time.time()
+        with self.lock:
+            self.records.append(record)
+            if self.output == "jsonl":
+                self.stream.write(json.dumps(record) + "\n")
+                self.stream.flush()
+                return
+
+            if record["status"] == "success":
+                status = "{}Success!{}".format(Fore.GREEN, Style.RESET_ALL)
+            elif record["status"] == "skipped":
+                status = "{}Skipped, {}.{}".format(Fore.CYAN, record["message"].lower(), Style.RESET_ALL)
+            else:
+                status = "{}{} : Failed.{}".format(Fore.RED, record["message"], Style.RESET_ALL)
+            if inline:
+                print(status)
+            elif record["job"] is None:
+                print("Doing {} at {}...{}".format(record["snippet"], record["xpath"], status))
+            else:
+                print("[{}] {}: Doing {} at {}...{}".format(record["device"], record["job"], record["snippet"],
+                                                          record["xpath"], status))
+
+    def failed(self):
+        return [r for r in self.records if r["status"] not in ["success", "skipped"]]
+
+    def summary(self):
+        """
+        Write the summary record, in jsonl mode.
+        """
+        if self.output != "jsonl":
+            return
+
+        seconds = time.time() - self.start
+        latencies = sorted(r["latency"] for r in self.records if r["http_status"] is not None)
+        record = {
+            "type": "summary",
+            "operations": len(self.records),
+            "succeeded": len([r for r in self.records if r["status"] == "success"]),
+            "skipped": len([r for r in self.records if r["status"] == "skipped"]),
+            "failed": len(self.failed()),
+            "request_bytes": sum(r["request_bytes"] for r in self.records),
+            "seconds": round(seconds, 6),
+            "operations_per_second": round(len(self.records) / seconds, 3) if seconds > 0 else None,
+            "latency_max": latencies[-1] if latencies else None,
+            "latency_median": latencies[len(latencies) // 2] if latencies else None,
+        }
+        self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()
+
+def push_snippets(fw, snippets, results, schedule=False, workers=1, job=None):
+    """
+    Push rendered snippets to a device.
+
+    When scheduling, snippets are pushed in dependency order, and the snippets in each wave of the schedule, which
+    don't depend on each other, are pushed concurrently.
+    :param fw: Panos device
+    :param snippets: [ Snippet ]: Rendered snippets
+    :param results: ResultLog to record pushes in
+    :param schedule: Push in dependency order rather than the given order.
+    :param workers: Maximum concurrent requests within a wave.
+    :param job: Plan job the snippets are for, if any.
+    """
+    if not schedule:
+        for snippet in snippets:
+            results.push(fw, snippet, job=job)
+        return
+
+    # Count split snippets in their original order, so a resumed run matches them up with the journal. Keyed by
+    # position, as the same snippet can be given more than once.
+    chunks = {}
+    if results.journal:
+        for i, snippet in enumerate(snippets):
+            chunks[i] = results.next_chunk(fw, snippet, job["name"] if job else None)
+
+    from concurrent.futures import ThreadPoolExecutor
+    for wave in PushScheduler(snippets).wave_indexes():
+        if workers <= 1 or len(wave) == 1:
+            for i in wave:
+                results.push(fw, snippets[i], job=job, chunk=chunks.get(i))
+            continue
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(wave))) as executor:
+            list(executor.map(
+                lambda i: results.push(fw, snippets[i], job=job, chunk=chunks.get(i), inline=False), wave))
+
+def assemble_config(snippets, base=None):
+    """
+    Merge rendered snippets into a single configuration, in the order given.
+    :param snippets: [ Snippet ]: Rendered snippets
+    :param base: XML of the configuration to merge them into, an empty configuration if not set.
+    :return: ConfigTree
+    """
+    try:
+        tree = ConfigTree(base)
+    except (ValueError, ParseError) as e:
+        print("{}The configuration to assemble onto is not valid: {}{}".format(Fore.RED, e, Style.RESET_ALL))
+        exit(1)
+    for snippet in snippets:
+        try:
+            tree.set(snippet.rendered_xpath, sanitize_element(snippet.rendered_xmlstr))
+        except (ValueError, ParseError) as e:
+            print("{}Snippet {} can't be assembled: {}{}".format(Fore.RED, snippet.name, e, Style.RESET_ALL))
+            exit(1)
+    return tree
+
+def read_assembly_base(fw, base):
+    """
+    Get the configuration to assemble snippets into.
+    :param fw: Panos device, or None when only rendering.
+    :param base: Path of a configuration file, "device" for the device's candidate configuration, or None.
+    :return: (string) Configuration XML, or None
+    """
+    if not base:
+        return None
+    if base == "device":
+        if not fw:
+            print("A device is needed to assemble onto its candidate configuration.")
+            exit(1)
+        # The candidate, not the running configuration, so uncommitted changes are kept when parts are loaded back
+        return fw.candidate_config()
+    with open(base) as f:
+        return f.read()
+
+def push_assembled(fw, snippets, results, base=None):
+    """
+    Push rendered snippets as one configuration: merged locally, imported in a single request, then applied with a
+    load config partial for each part of the configuration they change.
+    :param fw: Panos device
+    :param snippets: [ Snippet ]: Rendered snippets
+    :param results: ResultLog to record requests in
+    :param base: Configuration to assemble onto, as per read_assembly_base()
+    :return: (bool): True if every request succeeded.
+    """
+    tree = assemble_config(snippets, read_assembly_base(fw, base))
+    filename = tree.filename()
+
+    start = time.time()
+    r = fw.import_config(filename, tree.tostring())
+    if not results.response(fw, "import", filename, r, time.time() - start):
+        return False
+
+    for xpath in tree.partial_xpaths():
+        start = time.time()
+        r = fw.load_partial(filename, xpath)
+        if not results.response(fw, "load partial", xpath, r, time.time() - start):
+            return False
+    return True
+
+def connect_device(args):
+    """
+    Get the PANOS device to configure, prompting for the address and login if required.
+
+    Devices are pooled for the life of the process, so repeated runs in the daemon reuse the same API key, connections
+    and device details.
+    :param args: parsed args from argparse
+    :return: Panos instance
+    """
     # Address must be passed, then lookup keystore if it exists.
     addr = env_or_prompt("address", args, prompt_long="address or address:port of PANOS Device to configure: ")
+    return get_device(
+        addr,
+        lambda: env_or_prompt("username", args),
+        lambda: env_or_prompt("password", args, secret=True),
+        debug=args.debug,
+        verify=args.validate,
+    )
+
+def get_device(addr, get_user, get_password, debug=False, verify=False):
+    """
+    Get a connected PANOS device from the pool, logging in if there is no stored API key for it.
+    :param addr: Address of the device
+    :param get_user: Function returning the username, only called if a login is needed.
+    :param get_password: Function returning the password, only called if a login is needed.
+    :return: Panos instance
+    """
+    pool_key = (addr, verify)
+    with DEVICE_POOL_LOCK:
+        if pool_key in DEVICE_POOL:
+            fw = DEVICE_POOL[pool_key]
+            fw.log_level = 1 if debug else 0
+            return fw
+
     apikey = KEY_DB.lookup(addr)
     if not apikey:
-        user = env_or_prompt("username", args)
-        pw = env_or_prompt("password", args, secret=True)
-        fw = Panos(addr, user=user, pw=pw, debug=args.debug, verify=args.validate)
+        fw = Panos(addr, user=get_user(), pw=get_password(), debug=debug, verify=verify)
         KEY_DB.add_key(addr, fw.key)
     else:
-        fw = Panos(addr, apikey=apikey, debug=args.debug, verify=args.validate)
+        fw = Panos(addr, apikey=apikey, debug=debug, verify=verify)
+
+    with DEVICE_POOL_LOCK:
+        return DEVICE_POOL.add(pool_key, fw)
+
+def print_rendered(snippet):
+    """
+    Print a rendered snippet rather than pushing it.
+    """
+    print("{}{} at {}{}".format(Fore.GREEN, snippet.name, snippet.rendered_xpath, Style.RESET_ALL))
+    print(snippet.rendered_xmlstr)
+
+def get_mirror(path):
+    """
+    Get the mirror at path, keeping its index loaded for the life of the process.
+    """
+    path = os.path.abspath(path)
+    if path not in MIRRORS:
+        MIRRORS[path] = Mirror(path)
+    return MIRRORS[path]
+
+def get_api_url(args):
+    if args.repopath:
+        return args.repopath
+
+    return DEFAULT_API_URL
+
+def sync_mirror(args):
+    """
+    Sync the SkilletCloud catalog for the selected repository into the local mirror.
+    :param args: parsed args from argparse
+    """
+    api_url = get_api_url(args)
+    m = get_mirror(args.mirror_path)
+    print("Mirroring {} from {} into {}...".format(args.repository, api_url, args.mirror_path))
+    counts = m.sync(api_url, args.repository)
+    print("{}Mirror synced: {} added, {} unchanged, {} removed.{}".format(
+        Fore.GREEN, counts["added"], counts["unchanged"], counts["removed"], Style.RESET_ALL))
 
-    t = fw.get_type()
-    v = fw.get_version()
+def sync_all(args):
+    """
+    Clone or update every indexed skillet repository in parallel, prebuilding each one so later pushes don't wait.
+    :param args: parsed args from argparse
+    """
+    from beautifultable import BeautifulTable
+    github = Github()
+    print("Syncing all skillet repositories with {} workers...".format(args.workers))
+    results = github.sync(workers=args.workers, depth=args.clone_depth, blob_filter=args.clone_filter,
+                          sparse=args.sparse)
 
-    context = create_context(args.config)
-    snippets = gc.Query(args.repository, t, args.snippetstack, args.snippetnames, v, context)
+    result_table = BeautifulTable()
+    result_table.set_style(BeautifulTable.STYLE_NONE)
+    result_table.column_headers = ['Repository Name', 'Snippets', 'Seconds', 'Result']
+    result_table.column_alignments['Repository Name'] = BeautifulTable.ALIGN_LEFT
+    result_table.column_alignments['Result'] = BeautifulTable.ALIGN_LEFT
+    result_table.header_separator_char = '-'
+    failed = 0
+    for result in results:
+        if result["error"]:
+            failed += 1
+            status = "{}{}{}".format(Fore.RED, result["error"], Style.RESET_ALL)
+        else:
+            status = "{}OK{}".format(Fore.GREEN, Style.RESET_ALL)
+        result_table.append_row([result["name"], result["snippets"], "{:.2f}".format(result["seconds"]), status])
+    print(result_table)
+
+    if failed > 0:
+        print("{}{} of {} repositories failed to sync.{}".format(Fore.RED, failed, len(results), Style.RESET_ALL))
+        sys.exit(1)
 
-    if len(snippets) == 0:
+def push_from_gcloud(args, results):
+    """
+    Pull snippets from Gcloud instead of Git repos.
+    If the repotype is mirror, the snippets are instead queried from the local mirror of Gcloud.
+    :param args: parsed args from argparse
+    :param results: ResultLog to record pushes in
+    """
+    if args.repotype == "mirror":
+        gc = get_mirror(args.mirror_path)
+    else:
+        gc = Gcloud(get_api_url(args))
+
+    if len(args.snippetnames) == 0:
+        if args.repotype != "mirror":
+            print("{}New: browse the available objects via SkilletCloud: https://skilletcloud-prod.appspot.com/skillets/{}{}".format(
+                Fore.GREEN, args.repository, Style.RESET_ALL))
+        for n in gc.StreamNames(args.repository):
+            print(n)
+
+        sys.exit(0)
+
+    if args.render:
+        fw = None
+        t = args.device_type
+        v = args.panos_version
+    else:
+        fw = connect_device(args)
+        t = fw.get_type(refresh=False)
+        v = fw.get_version()
+
+    context = create_context(args.config, args.overlay or [])
+    if args.repotype == "mirror":
+        snippets = gc.StreamQuery(args.repository, t, args.snippetstack, args.snippetnames, v, context,
+                                  untyped=args.mirror_untyped)
+    else:
+        snippets = gc.StreamQuery(args.repository, t, args.snippetstack, args.snippetnames, v, context)
+    count = 0
+    if args.schedule:
+        # The whole response is needed to work out the order
+        snippets = list(snippets)
+        count = len(snippets)
+        if args.render:
+            for snippet in PushScheduler(snippets).order():
+                print_rendered(snippet)
+        else:
+            push_snippets(fw, snippets, results, schedule=True, workers=args.push_workers)
+    else:
+        # Push each snippet as it arrives rather than waiting for the whole response
+        for snippet in snippets:
+            count += 1
+            if args.render:
+                print_rendered(snippet)
+                continue
+            results.push(fw, snippet)
+
+    if count == 0:
         print("{}Snippets {} not found for device type {}.{}".format(Fore.RED, ",".join(args.snippetnames), t,
                                                                      Style.RESET_ALL))
-    for snippet in snippets:
-        print("Doing {} at {}...".format(snippet.name, snippet.rendered_xpath), end="")
-        r = set_at_path(fw, snippet.rendered_xpath, snippet.rendered_xmlstr)
-        check_resp(r)
 
-def push_skillets(args):
+def print_catalog(catalog):
+    """
+    Print every skillet, snippet stack, snippet and entry in a catalog.
+    """
+    skillet_name = None
+    stack_name = None
+    for record in catalog.records:
+        if record["skillet"] != skillet_name:
+            skillet_name = record["skillet"]
+            stack_name = None
+            print(skillet_name)
+        if record["stack"] != stack_name:
+            stack_name = record["stack"]
+            print("  " + stack_name)
+        print("    " + record["name"])
+        for entry in record["entries"]:
+            print("      " + entry)
+
+def print_search(args, catalog):
+    """
+    Print a page of the snippets matching a catalog search.
+    :param args: parsed args from argparse
+    :param catalog: Catalog to search
+    """
+    from beautifultable import BeautifulTable
+    matches = catalog.search(args.search, field=args.search_field, prefix=args.prefix)
+    if len(matches) == 0:
+        print("{}No snippets match {}.{}".format(Fore.RED, args.search, Style.RESET_ALL))
+        return
+
+    result_table = BeautifulTable(max_width=160)
+    result_table.set_style(BeautifulTable.STYLE_NONE)
+    result_table.column_headers = ['Type', 'Stack', 'Snippet', 'XPath', 'Entries']
+    for column in result_table.column_headers:
+        result_table.column_alignments[column] = BeautifulTable.ALIGN_LEFT
+    result_table.header_separator_char = '-'
+    for record in page(matches, args.page, args.page_size):
+        entries = record["entries"]
+        if args.search_field != "entry" and len(entries) > 3:
+            entries = entries[:3] + ["(+{} more)".format(len(entries) - 3)]
+        elif args.search_field == "entry":
+            entries = [e for e in entries if args.search.lower() in e.lower()]
+        result_table.append_row([record["skillet"], record["stack"], record["name"], record["xpath"],
+                                 "\n".join(entries)])
+    print(result_table)
+
+    start = (max(args.page, 1) - 1) * args.page_size
+    shown = len(page(matches, args.page, args.page_size))
+    print("Showing {}-{} of {} matching snippets.".format(start + 1, start + shown, len(matches)))
+    if start + shown < len(matches):
+        print("Use --page {} to see more.".format(max(args.page, 1) + 1))
+
+def local_clone_exists(repo_name):
+    """
+    Check whether a repository has already been cloned into the current directory.
+    :param repo_name: Name of repository
+    """
+    return os.path.isdir(os.getcwd() + os.sep + repo_name + os.sep + ".git")
+
+def push_skillets(args, results):
     """
     Based on user configuration (cmdline args), pushes given snippets to a PANOS device.
     :param args: parsed args from argparse
+    :param results: ResultLog to record pushes in
     """
-    if args.repotype == "git":
-        github = Github()
-        repo_list = github.index()
+    if args.repotype in ["git", "archive"]:
+        from beautifultable import BeautifulTable
         repo_url = args.repopath
+        # An existing clone already knows its remote, so there's no need to look it up.
+        use_local_clone = args.repotype == "git" and args.repository is not None and not args.refresh and \
+            local_clone_exists(args.repository)
+        if use_local_clone:
+            repo_list = []
+        else:
+            github = Github()
+            repo_list = github.index(remote=Archive if args.repotype == "archive" else None)
         repo_table = BeautifulTable()
         repo_table.set_style(BeautifulTable.STYLE_NONE)
         repo_table.column_headers = ['Repository Name', 'Description']
@@ -225,29 +753,39 @@ def push_skillets(args):
                 if repo.github_info['name'] == args.repository:
                     repo_url = repo.github_info['clone_url']
                     break
-            if repo_url is 'unset':
+            if not repo_url and not use_local_clone:
                 print('Invalid Repository was specified. Available Repositories are:')
                 for repo in repo_list:
                     repo_table.append_row([repo.github_info['name'],repo.github_info['description']])
                 print(repo_table)
                 sys.exit(0)
         repo_name = args.repository
-        g = Git(repo_url)
-        g.clone(repo_name, ow=args.refresh, update=args.update)
-        if args.branch is None:
-            print("Branches available for "+args.repository+" are :")
-            print("\n".join(g.list_branches()))
-            sys.exit(0)
-        elif args.branch == "default":
-            print("Using default branch for repository.")
-        elif args.branch not in g.list_branches():
-            print("Invalid Branch was choosen. Please select from below list:")
-            print("\n".join(g.list_branches()))
-            sys.exit(0)
+        if args.repotype == "archive":
+            if args.branch is None:
+                print("Branches can't be listed without git. Pass a branch or tag with --branch.")
+                sys.exit(0)
+            # Archives are fetched for a single branch or tag, so there's nothing to check out
+            g = Archive(repo_url)
+            g.clone(repo_name, ow=args.refresh, update=args.update,
+                    ref=None if args.branch == "default" else args.branch)
         else:
-            g.branch(args.branch)
+            g = Git(repo_url)
+            g.clone(repo_name, ow=args.refresh, update=args.update, depth=args.clone_depth,
+                    blob_filter=args.clone_filter, sparse=args.sparse)
+            if args.branch is None:
+                print("Branches available for "+args.repository+" are :")
+                print("\n".join(g.list_branches()))
+                sys.exit(0)
+            elif args.branch == "default":
+                print("Using default branch for repository.")
+            elif args.branch not in g.list_branches():
+                print("Invalid Branch was choosen. Please select from below list:")
+                print("\n".join(g.list_branches()))
+                sys.exit(0)
+            else:
+                g.branch(args.branch)
 
-        sc = g.build()
+        sc = g.build_cached()
     elif args.repotype == "local":
         repo_name = args.repopath
         g = Git("")
@@ -257,59 +795,378 @@ def push_skillets(args):
         exit(1)
 
     if len(args.snippetnames) == 0:
+        if args.search is not None or args.print_entries:
+            catalog = g.catalog() if args.repotype in ["git", "archive"] else build_catalog(sc)
+            if args.search is not None:
+                print_search(args, catalog)
+            else:
+                print("printing available {} snippets".format(repo_name))
+                print_catalog(catalog)
+            sys.exit(0)
+
         print("printing available {} snippets".format(repo_name))
         sc.print_all_skillets(elements=args.print_entries)
         sys.exit(0)
     else:
-        addr = env_or_prompt("address", args, prompt_long="address or address:port of PANOS Device to configure: ")
-        apikey = KEY_DB.lookup(addr)
-        if not apikey:
-            user = env_or_prompt("username", args)
-            pw = env_or_prompt("password", args, secret=True)
-            fw = Panos(addr, user=user, pw=pw, debug=args.debug, verify=args.validate)
-            KEY_DB.add_key(addr, fw.key)
+        if args.render:
+            fw = None
+            t = args.device_type
         else:
-            fw = Panos(addr, apikey=apikey, debug=args.debug, verify=args.validate)
-
-        t = fw.get_type()
+            fw = connect_device(args)
+            t = fw.get_type(refresh=False)
 
         skillet = sc.get_skillet(t.lower())
-        context = create_context(args.config)
+        context = create_context(args.config, args.overlay or [])
         skillet.template(context)
         snippets = skillet.select_snippets(args.snippetstack, args.snippetnames)
         if len(snippets) == 0:
             print("{}Snippets {} not found for device type {}.{}".format(Fore.RED, ",".join(args.snippetnames), t,
                                                                          Style.RESET_ALL))
 
-        for snippet in skillet.select_snippets(args.snippetstack, args.snippetnames):
-            print("Doing {} at {}...".format(snippet.name, snippet.rendered_xpath), end="")
-            r = set_at_path(fw, snippet.rendered_xpath, snippet.rendered_xmlstr)
-            check_resp(r)
+        if args.render and args.assemble:
+            print(assemble_config(snippets, read_assembly_base(fw, args.assemble_base)).tostring())
+        elif args.render:
+            if args.schedule:
+                snippets = PushScheduler(snippets).order()
+            for snippet in snippets:
+                print_rendered(snippet)
+        elif args.assemble:
+            if not push_assembled(fw, snippets, results, base=args.assemble_base):
+                print("{}The assembled configuration was not fully applied. Check the candidate configuration before "
+                      "committing.{}".format(Fore.RED, Style.RESET_ALL))
+                exit(1)
+        else:
+            push_snippets(fw, snippets, results, schedule=args.schedule, workers=args.push_workers)
 
 
-def main():
+# Values used for any job setting not given in a plan, or its defaults section
+PLAN_JOB_DEFAULTS = {
+    "repotype": "git",
+    "repository": "iron-skillet",
+    "repopath": None,
+    "branch": "default",
+    "snippetstack": "snippets",
+    "snippets": [],
+    "variables": [],
+}
+
+def load_plan(plan_file):
     """
-    Main runtime. Decides which function to break into, either push for snippet pushes or other.
+    Load a batch plan, expanding it into one job per device.
+
+    A plan looks like::
+        inventory:
+          branches: [10.0.0.1, 10.0.0.2]
+        defaults:
+          repository: iron-skillet
+          variables: [base.yaml]
+        jobs:
+          - name: baseline
+            devices: [branches, 10.0.1.1]
+            branch: panos_v9.1
+            snippets: [all]
+            variables: [base.yaml, site.yaml]
+        device_variables:
+          10.0.1.1: [fw1.yaml]
+
+    Devices can be addresses or inventory group names. Later variable files override earlier ones, and any
+    device_variables files for a device are layered over the variables of every job for that device.
+    :param plan_file: Path to YAML plan
+    :return: [ dict ]: Jobs, each with a single device address
     """
-    colorama_init()
+    import oyaml
+    with open(plan_file) as f:
+        plan = oyaml.safe_load(f.read())
+
+    if not plan or "jobs" not in plan:
+        raise ValueError("Plan {} has no jobs.".format(plan_file))
+
+    inventory = plan.get("inventory", {})
+    device_variables = plan.get("device_variables", {})
+    defaults = dict(PLAN_JOB_DEFAULTS)
+    defaults.update(plan.get("defaults", {}))
+
+    jobs = []
+    for i, job_def in enumerate(plan["jobs"]):
+        job = dict(defaults)
+        job.update(job_def)
+        job.setdefault("name", "job{}".format(i + 1))
+        devices = job.pop("devices", [])
+        if "device" in job:
+            devices = devices + [job.pop("device")]
+        if isinstance(job["variables"], str):
+            job["variables"] = [job["variables"]]
+        if len(devices) == 0 or len(job["snippets"]) == 0:
+            raise ValueError("Job {} in plan {} must list devices and snippets.".format(job["name"], plan_file))
+
+        for device in devices:
+            for addr in inventory.get(device, [device]):
+                device_job = dict(job)
+                device_job["device"] = addr
+                device_job["device_variables"] = device_variables.get(addr, [])
+                if isinstance(device_job["device_variables"], str):
+                    device_job["device_variables"] = [device_job["device_variables"]]
+                jobs.append(device_job)
+
+    return jobs
+
+class PlanRunner:
+    """
+    Runs the jobs of a batch plan in a single process.
+
+    Built skillet collections, rendered snippets, variable files and device sessions are shared by every job. Jobs for
+    different devices run concurrently, while the jobs for each device run one after another in plan order.
+    """
+    def __init__(self, jobs, workers=4, debug=False, validate=False, results=None, schedule=False, push_workers=1,
+                 mirror_untyped=False):
+        self.jobs = jobs
+        self.mirror_untyped = mirror_untyped
+        self.workers = workers
+        self.schedule = schedule
+        self.push_workers = push_workers
+        self.debug = debug
+        self.validate = validate
+        self.lock = threading.Lock()
+        self.repo_locks = {}
+        self.collections = {}
+        self.contexts = {}
+        self.render_cache = {}
+        self.github_repos = None
+        self.results = results or ResultLog()
+
+    def run(self):
+        """
+        Run every job in the plan.
+        :return: ResultLog of every pushed snippet
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        jobs_by_device = {}
+        for job in self.jobs:
+            jobs_by_device.setdefault(job["device"], []).append(job)
+
+        self.query_api(jobs_by_device)
+        # Devices render with the hashing settings of the run
+        service = current_service()
+
+        def run_device(device_jobs):
+            with use_service(service):
+                self.run_device(device_jobs)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            list(executor.map(run_device, jobs_by_device.items()))
+
+        return self.results
+
+    def run_device(self, device_jobs):
+        addr, jobs = device_jobs
+        for job in jobs:
+            try:
+                fw = self.device(addr)
+                push_snippets(fw, self.resolve(job, fw), self.results, schedule=self.schedule,
+                              workers=self.push_workers, job=job)
+            except (Exception, SystemExit) as e:
+                # Anything that would have stopped a single push only stops this job
+                self.results.error(job, "{}: {}".format(type(e).__name__, e))
+
+    def device(self, addr):
+        return get_device(
+            addr,
+            lambda: os.getenv("SKCLI_USERNAME", "admin"),
+            lambda: os.getenv("SKCLI_PASSWORD"),
+            debug=self.debug,
+            verify=self.validate,
+        )
+
+    def context(self, job):
+        """
+        Get the template variables of a job: its variable files, with the device's own variables layered on top.
+
+        Every device shares the layers of the job variables, so a device context only costs its own overlay.
+        """
+        key = (tuple(job["variables"]), tuple(job.get("device_variables", [])))
+        with self.lock:
+            if key in self.contexts:
+                return self.contexts[key]
+
+        context = None
+        files = list(job["variables"]) + list(job.get("device_variables", []))
+        if files:
+            context = create_context(files[0], files[1:])
+
+        with self.lock:
+            self.contexts[key] = context
+        return context
+
+    def render_key(self, job, t, version, context):
+        return (job["repotype"], job["repository"], job["repopath"], job["branch"], job["snippetstack"],
+                tuple(job["snippets"]), t, version, context.fingerprint() if context else None)
+
+    def resolve(self, job, fw):
+        """
+        Get the rendered snippets of a job for a device.
+        :return: [ Snippet ]
+        """
+        t = fw.get_type(refresh=False)
+        context = self.context(job)
+        key = self.render_key(job, t, fw.get_version(), context)
+        with self.lock:
+            if key in self.render_cache:
+                return self.render_cache[key]
+
+        if job["repotype"] == "api":
+            # Filled in by query_api
+            raise ValueError("No API results for {}".format(job["repository"]))
+        elif job["repotype"] == "mirror":
+            snippets = get_mirror(job["repopath"] or "skilletcloud-mirror").Query(
+                job["repository"], t, job["snippetstack"], job["snippets"], fw.get_version(), context,
+                untyped=self.mirror_untyped)
+        else:
+            skillet = self.collection(job).get_skillet(t.lower())
+            snippets = skillet.render(job["snippetstack"], job["snippets"], context)
+
+        with self.lock:
+            self.render_cache[key] = snippets
+        return snippets
 
-    # Setup argparse
+    def query_api(self, jobs_by_device):
+        """
+        Resolve the snippets of every API job in one concurrent batch of queries.
+        """
+        queries_by_url = {}
+        for addr, jobs in jobs_by_device.items():
+            for job in jobs:
+                if job["repotype"] != "api":
+                    continue
+                try:
+                    fw = self.device(addr)
+                    t = fw.get_type(refresh=False)
+                except (Exception, SystemExit) as e:
+                    self.results.error(job, "{}: {}".format(type(e).__name__, e))
+                    continue
+                context = self.context(job)
+                query = (job["repository"], t, job["snippetstack"], job["snippets"], fw.get_version(), context)
+                key = self.render_key(job, t, fw.get_version(), context)
+                queries_by_url.setdefault(job["repopath"] or DEFAULT_API_URL, {})[key] = query
+
+        for url, queries in queries_by_url.items():
+            results = Gcloud(url).BatchQuery(queries.values(), workers=self.workers)
+            for key, query in queries.items():
+                self.render_cache[key] = results[query_key(*query)]
+
+    def collection(self, job):
+        """
+        Get the built skillet collection for a job's repository and branch, building it the first time it is needed.
+        """
+        repo_key = (job["repotype"], job["repository"], job["repopath"])
+        with self.lock:
+            repo_lock = self.repo_locks.setdefault(repo_key, threading.Lock())
+
+        # Clones and builds of a repository happen one at a time, different repositories in parallel
+        with repo_lock:
+            key = repo_key + (job["branch"],)
+            if key in self.collections:
+                return self.collections[key]
+
+            if job["repotype"] == "local":
+                sc = Git("").build_from_local(job["repopath"])
+            elif job["repotype"] == "archive":
+                g = Archive(self.repo_url(job))
+                g.clone(job["repository"], ref=None if job["branch"] == "default" else job["branch"])
+                sc = g.build_cached()
+            else:
+                g = Git(self.repo_url(job))
+                g.clone(job["repository"])
+                ref = None if job["branch"] == "default" else job["branch"]
+                sc = g.build_cached(ref=ref)
+
+            self.collections[key] = sc
+            return sc
+
+    def repo_url(self, job):
+        if job["repopath"] or (job["repotype"] == "git" and local_clone_exists(job["repository"])):
+            return job["repopath"]
+
+        with self.lock:
+            if self.github_repos is None:
+                # Only the repository details are needed, so this works without a git client for archives
+                self.github_repos = Github().search()
+
+        for repo in self.github_repos:
+            if repo['name'] == job["repository"]:
+                return repo['clone_url']
+
+        raise ValueError("Invalid repository {}".format(job["repository"]))
+
+def run_plan(args, results):
+    """
+    Run a batch plan of jobs, then print a summary.
+    :param args: parsed args from argparse
+    :param results: ResultLog to record pushes in
+    """
+    try:
+        jobs = load_plan(args.plan)
+    except ValueError as e:
+        print("{}{}{}".format(Fore.RED, e, Style.RESET_ALL))
+        sys.exit(1)
+
+    print("Running {} jobs from {} with {} workers...".format(len(jobs), args.plan, args.workers))
+    runner = PlanRunner(jobs, workers=args.workers, debug=args.debug, validate=args.validate, results=results,
+                        schedule=args.schedule, push_workers=args.push_workers, mirror_untyped=args.mirror_untyped)
+    runner.run()
+
+    failed = results.failed()
+    skipped = [r for r in results.records if r["status"] == "skipped"]
+    print("{} snippets pushed, {} skipped, {} failed.".format(len(results.records) - len(failed) - len(skipped),
+                                                             len(skipped), len(failed)))
+    if len(failed) > 0:
+        sys.exit(1)
+
+def build_parser():
+    """
+    Build the command line argument parser.
+    :return: argparse.ArgumentParser
+    """
     parser = argparse.ArgumentParser(description="Deploy a Skillet to a PANOS device from one of the possible repo types.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     config_arg_group = parser.add_argument_group("Configuration options")
     repo_arg_group = parser.add_argument_group("Repository options")
     selection_options = parser.add_argument_group("Selection options")
     script_options = parser.add_argument_group("Script options")
     kdb_options = parser.add_argument_group("Keystore options")
+    daemon_options = parser.add_argument_group("Daemon options")
 
     repo_arg_group.add_argument('--repository', default="iron-skillet", help="Name of skillet to use. Use without a value to see list of all available repositories.", nargs='?')
-    repo_arg_group.add_argument('--repotype', default="git", help="Type of skillet repo. Available options are [git, api, local]")
+    repo_arg_group.add_argument('--repotype', default="git", help="Type of skillet repo. Available options are [git, archive, api, mirror, local]")
     repo_arg_group.add_argument("--branch", default="default", help="Git repo branch to use. Use without a value to view all available branches.",nargs='?')
     repo_arg_group.add_argument('--repopath', help="Path to repository")
     repo_arg_group.add_argument("--refresh", help="Refresh the cloned repository directory.", action='store_true')
     repo_arg_group.add_argument("--update", help="Update the cloned repository", action='store_true')
+    repo_arg_group.add_argument("--clone_depth", type=int, help="Only clone this many commits of history for each branch.")
+    repo_arg_group.add_argument("--clone_filter", help="Partial clone filter, such as blob:none, to only fetch the files that are checked out.")
+    repo_arg_group.add_argument("--sparse", help="Only check out the template directories when cloning.", action='store_true')
+    repo_arg_group.add_argument("--sync", help="Clone or update every available skillet repository in parallel, then exit.", action='store_true')
+    repo_arg_group.add_argument("--workers", type=int, default=4, help="Number of repositories to sync, or devices to configure from a plan, at once.")
+    repo_arg_group.add_argument("--mirror", help="Sync the SkilletCloud catalog for the repository into the local mirror, for use with --repotype mirror.", action='store_true')
+    repo_arg_group.add_argument("--mirror_path", default="skilletcloud-mirror", help="Directory to store the local SkilletCloud mirror in.")
+    repo_arg_group.add_argument("--mirror_untyped", help="Also push snippets the mirror doesn't know the device type or stack of, whatever the device. They are left out by default.", action='store_true')
 
     config_arg_group.add_argument("--config", default="config_variables.yaml", help="Path to YAML variable configuration file.")
+    config_arg_group.add_argument("--overlay", action="append", help="Variable file overriding those in --config, such as site or device variables. Can be given more than once, later files take precedence.")
+    config_arg_group.add_argument("--plan", help="Path to a YAML batch plan of devices, snippets and variables to run instead of a single push.")
     script_options.add_argument("--debug", help="Enable debugging.", action='store_true')
+    script_options.add_argument("--profile", help="Write a timeline of where time was spent to this file, in Chrome trace format (open with chrome://tracing or Perfetto).")
+    script_options.add_argument("--profile_stats", help="Write cProfile statistics for the run to this file.")
+    script_options.add_argument("--trace_hook", help="Send every trace span to a hook, given as module:name of a TraceHook class or instance.")
+    script_options.add_argument("--journal", help="Record each completed request in this file, so the run can be resumed with --resume. Defaults to {} when using --resume.".format(JOURNAL_FILENAME))
+    script_options.add_argument("--resume", help="Skip every request already completed in the journal from an earlier, interrupted run.", action='store_true')
+    script_options.add_argument("--skip_unchanged", "--skip-unchanged", help="Skip snippets that are unchanged since they were last pushed to the device, as recorded in the ledger. Committing the pushes keeps them recorded, but reverting them, or any change made by someone else, pushes everything again.", action='store_true')
+    script_options.add_argument("--ledger", help="Ledger of what has been pushed to each device, for --skip_unchanged. Defaults to {} in the home directory.".format(LEDGER_FILENAME))
+    script_options.add_argument("--hash_salt_secret", help="Derive the salts of password hashes (md5_hash, sha512_hash) from this secret instead of making them random, so the same password always renders the same hash. Can also use envvar SKCLI_HASH_SALT_SECRET.")
+    script_options.add_argument("--hash_salt_variable", help="Template variable that makes derived salts differ between devices, such as FW_NAME.")
+    script_options.add_argument("--metrics", help="Write request, latency, split and cache metrics to this file in the Prometheus text format at the end of the run.")
+    script_options.add_argument("--metrics_port", type=int, help="Serve metrics over HTTP at /metrics on this port while running, such as for the length of a plan or the life of the daemon.")
+    script_options.add_argument("--metrics_address", default="127.0.0.1", help="Address to serve metrics on with --metrics_port.")
+    script_options.add_argument("--output", default="text", choices=["text", "jsonl"], help="Print push results as text, or as JSON Lines with timings followed by a summary record.")
     script_options.add_argument("--validate", help="Enable certificate validation on all endpoints.", action='store_true')
     script_options.add_argument("--username", help="Firewall/Panorama username. Can also use envvar SKCLI_USERNAME.")
     script_options.add_argument("--address", help="Firewall/Panorama address. Can also use envvar SKCLI_ADDRESS")
@@ -320,12 +1177,113 @@ def main():
     selection_options.add_argument("--snippetstack", default="snippets", help="Snippet stack to use. ")
     selection_options.add_argument("--print_entries", help="Print not just the snippet names, but the entries within them.", action='store_true')
 
+    selection_options.add_argument("--search", help="Search the snippets for this text, instead of listing them all.")
+    selection_options.add_argument("--search_field", choices=CATALOG_FIELDS, help="Only search snippet names, xpaths, entry names or variables.")
+    selection_options.add_argument("--prefix", help="Only match snippets where the searched field starts with the search text.", action='store_true')
+    selection_options.add_argument("--page", type=int, default=1, help="Page of search results to show.")
+    selection_options.add_argument("--page_size", type=int, default=50, help="Number of search results per page.")
+    selection_options.add_argument("--schedule", help="Push snippets in dependency order, parents and referenced objects first, instead of the order given.", action='store_true')
+    selection_options.add_argument("--push_workers", type=int, default=1, help="With --schedule, push up to this many independent snippets to a device at once.")
+    selection_options.add_argument("--assemble", help="Merge the snippets into one configuration, import it, and apply it with load config partial, instead of pushing each snippet. With --render, print the merged configuration.", action='store_true')
+    selection_options.add_argument("--assemble_base", help="Configuration file to merge snippets into with --assemble, or \"device\" for the device's candidate configuration. An empty configuration if not set.")
+    selection_options.add_argument("--render", help="Print the rendered snippets instead of pushing them to a device.", action='store_true')
+    selection_options.add_argument("--device_type", default="panos", help="Device type to render snippets for when using --render.")
+    selection_options.add_argument("--panos_version", help="PANOS version to render snippets for when using --render with --repotype api or mirror.")
+
+    daemon_options.add_argument("--daemon", help="Run as a daemon, serving requests from other skilletcli invocations with warm caches.", action='store_true')
+    daemon_options.add_argument("--no_daemon", help="Don't use a running daemon, even if there is one.", action='store_true')
+    daemon_options.add_argument("--socket", default=str(Path.home()) + os.sep + SOCKET_FILENAME, help="Unix socket the daemon listens on.")
+
     parser.add_argument("snippetnames", help="List of snippets to push by name.", nargs="*")
-    args = parser.parse_args()
+    return parser
+
+def main():
+    """
+    Main runtime. Decides which function to break into, either push for snippet pushes or other.
+    """
+    colorama_init()
+    args = build_parser().parse_args()
+
+    if args.daemon:
+        serve_daemon(args.socket, metrics_port=args.metrics_port, metrics_address=args.metrics_address)
+        return
+
+    # Hand the request to the daemon if one is running. Refreshes prompt for confirmation, so always run here.
+    if not args.no_daemon and not args.refresh and daemon_running(args.socket):
+        sys.exit(run_client(args, sys.argv[1:]))
 
+    run(args)
+
+def run(args):
+    """
+    Run the CLI with parsed arguments.
+    :param args: parsed args from argparse
+    """
+    journal = None
+    if args.journal or args.resume:
+        journal = Journal(args.journal or JOURNAL_FILENAME, resume=args.resume)
+    ledger = None
+    if args.skip_unchanged:
+        ledger = Ledger(args.ledger or str(Path.home()) + os.sep + LEDGER_FILENAME)
+    results = ResultLog(args.output, journal=journal, ledger=ledger)
+    # Hashes are only reused within a run, and each run served by the daemon has its own settings
+    hash_service = HashService(args.hash_salt_secret or os.getenv("SKCLI_HASH_SALT_SECRET"), args.hash_salt_variable)
+    hook = None
+    profiler = None
+    if args.trace_hook:
+        hook = load_hook(args.trace_hook)
+        TRACER.add_hook(hook)
+    if args.profile:
+        TRACER.start_recording()
+    if args.profile_stats:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    # The metrics file only covers this run, even when the daemon has served others before it
+    metrics_start = METRICS.snapshot() if args.metrics else None
+    # The daemon serves metrics for its whole life, rather than for each request
+    metrics_server = None
+    if args.metrics_port is not None and not args.daemon:
+        metrics_server = serve_metrics(args.metrics_port, addr=args.metrics_address)
+
+    try:
+        with results.redirect(), use_service(hash_service):
+            run_command(args, results)
+    finally:
+        results.summary()
+        if args.metrics:
+            METRICS.write(args.metrics, since=metrics_start)
+        if metrics_server:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_stats)
+        if args.profile:
+            TRACER.stop_recording()
+            write_profile(args.profile)
+        if hook:
+            TRACER.remove_hook(hook)
+        if journal:
+            journal.close()
+        if ledger:
+            ledger.save()
+
+def write_profile(path):
+    """
+    Write the recorded trace, and print the time spent in each phase.
+    :param path: Path to write the trace to
+    """
+    TRACER.write_chrome_trace(path)
+    print("Trace of {} spans written to {}".format(len(TRACER.spans), path), file=sys.stderr)
+    for name, count, seconds in TRACER.totals():
+        print("  {:<20} {:>6} calls {:>10.3f}s".format(name, count, seconds), file=sys.stderr)
+
+def run_command(args, results):
     if not args.validate:
         print("""{}Warning: SSL validation of PANOS device is currently disabled. Use --validate to enable it.{}""".format(Fore.YELLOW, Style.RESET_ALL))
-        requests.packages.urllib3.disable_warnings()
+        import urllib3
+        urllib3.disable_warnings()
 
     if args.enable_keystore:
         print("""{}API keys will be saved, per device, at {}.{}""".format(
@@ -337,12 +1295,244 @@ def main():
     if args.clear_keystore:
         KEY_DB.reinit()
 
+    if args.mirror:
+        sync_mirror(args)
+        sys.exit(0)
+
+    if args.sync:
+        sync_all(args)
+        sys.exit(0)
+
+    if args.plan:
+        run_plan(args, results)
+        sys.exit(0)
+
     # Url pull
-    if args.repotype == "api":
-        push_from_gcloud(args)
+    if args.repotype in ["api", "mirror"]:
+        push_from_gcloud(args, results)
     # Git based pull
     else:
-        push_skillets(args)
+        push_skillets(args, results)
+
+def serve_daemon(socket_path, metrics_port=None, metrics_address="127.0.0.1"):
+    """
+    Run the daemon, serving requests from thin clients over a unix socket until interrupted.
+
+    Everything the CLI caches in memory - built skillet collections, compiled templates, the keystore and connected
+    devices - stays warm between requests.
+    :param socket_path: Path of the unix socket to listen on.
+    :param metrics_port: If set, serve the metrics of every request over HTTP on this port.
+    """
+    import signal
+    import socket
+    import socketserver
+    global INTERACTIVE
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("{}The daemon is not supported on this platform.{}".format(Fore.RED, Style.RESET_ALL))
+        exit(1)
+
+    if daemon_running(socket_path):
+        print("{}A daemon is already listening on {}.{}".format(Fore.RED, socket_path, Style.RESET_ALL))
+        exit(1)
+
+    # Remove a socket left behind by a daemon that didn't exit cleanly
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    INTERACTIVE = False
+
+    class DaemonHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline().decode("utf-8")
+            # Clients checking whether the daemon is running connect without sending anything
+            if not line.strip():
+                return
+            request = json.loads(line)
+            lock = threading.Lock()
+            out = FrameStream(self.wfile, "stdout", lock)
+            err = FrameStream(self.wfile, "stderr", lock)
+            code = run_request(request, out, err)
+            send_frame(self.wfile, lock, "exit", code)
+            # Requests redirect sys.stdout, so log to the daemon's own
+            print("Served request from {}, exit code {}".format(request["cwd"], code), file=sys.__stdout__,
+                  flush=True)
+
+    # Only the user running the daemon may connect to it, as requests can carry credentials
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, DaemonHandler)
+    finally:
+        os.umask(umask)
+
+    # Stop cleanly when terminated, so the socket is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("skilletcli daemon listening on {}".format(socket_path))
+    if metrics_port is not None:
+        metrics_server = serve_metrics(metrics_port, addr=metrics_address)
+        print("Serving metrics on http://{}:{}/metrics".format(metrics_address, metrics_server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping daemon.")
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+class FrameStream(io.TextIOBase):
+    """
+    Text stream sending everything written to it to a daemon client, as frames of one of its output streams.
+    """
+    def __init__(self, wfile, name, lock):
+        """
+        :param wfile: Socket file of the client
+        :param name: stdout or stderr
+        :param lock: Lock shared by every stream to the same client, so frames aren't interleaved.
+        """
+        self.wfile = wfile
+        self.name = name
+        self.lock = lock
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text:
+            send_frame(self.wfile, self.lock, self.name, text)
+        return len(text)
+
+def send_frame(wfile, lock, name, value):
+    """
+    Send one frame to a daemon client: a JSON object on its own line, with a single key of stdout, stderr or exit.
+    """
+    data = (json.dumps({name: value}) + "\n").encode("utf-8")
+    with lock:
+        wfile.write(data)
+        wfile.flush()
+
+def run_request(request, out, err=None):
+    """
+    Run a single CLI request in the daemon, as if skilletcli had been run with its arguments, environment and working
+    directory.
+    :param request: (dict): argv, env (SKCLI_ environment variables) and cwd of the client
+    :param out: Text stream to write the standard output of the request to.
+    :param err: Text stream to write the standard error of the request to, out if not set.
+    :return: (int): Exit code
+    """
+    with DAEMON_LOCK:
+        saved_env = dict(os.environ)
+        saved_cwd = os.getcwd()
+        saved_stdin = sys.stdin
+        for k in list(os.environ.keys()):
+            if k.startswith("SKCLI_"):
+                del os.environ[k]
+        os.environ.update(request["env"])
+        # The keystore is enabled per invocation, and read again as clients may have added keys
+        KEY_DB.enabled = False
+        KEY_DB.reload()
+        # There's nobody to answer prompts, so any attempt to read input fails straight away
+        sys.stdin = io.StringIO()
+
+        code = 0
+        try:
+            os.chdir(request["cwd"])
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err or out):
+                try:
+                    run(build_parser().parse_args(request["argv"]))
+                except SystemExit as e:
+                    if e.code is None or isinstance(e.code, int):
+                        code = e.code or 0
+                    else:
+                        print(e.code)
+                        code = 1
+                except EOFError:
+                    print("{}This request needs interactive input. Run it with --no_daemon.{}".format(
+                        Fore.RED, Style.RESET_ALL))
+                    code = 1
+                except Exception:
+                    traceback.print_exc()
+                    code = 1
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_env)
+            os.chdir(saved_cwd)
+            sys.stdin = saved_stdin
+
+        return code
+
+def daemon_running(socket_path):
+    """
+    Check if a daemon is accepting requests on the given socket.
+    """
+    if not os.path.exists(socket_path):
+        return False
+
+    import socket
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+def run_client(args, argv):
+    """
+    Run a request through the daemon, printing its output as it arrives.
+
+    Anything that may need to be prompted for is resolved here first, as the daemon can't prompt.
+    :param args: parsed args from argparse
+    :param argv: Command line arguments to send to the daemon.
+    :return: (int): Exit code of the request
+    """
+    import socket
+
+    env = {}
+    for k, v in os.environ.items():
+        if k.startswith("SKCLI_"):
+            env[k] = v
+
+    if len(args.snippetnames) > 0 and not args.render and not args.mirror and not args.sync:
+        addr = env_or_prompt("address", args, prompt_long="address or address:port of PANOS Device to configure: ")
+        env["SKCLI_ADDRESS"] = addr
+        if not KEY_DB.lookup(addr):
+            env["SKCLI_USERNAME"] = env_or_prompt("username", args)
+            env["SKCLI_PASSWORD"] = env_or_prompt("password", args, secret=True)
+
+    request = {
+        "argv": argv,
+        "env": env,
+        "cwd": os.getcwd(),
+    }
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(args.socket)
+    streams = {"stdout": sys.stdout, "stderr": sys.stderr}
+    # Output arrives as frames, one per line, ending with the exit code
+    code = None
+    try:
+        s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with s.makefile("rb") as f:
+            for line in f:
+                frame = json.loads(line.decode("utf-8"))
+                if "exit" in frame:
+                    code = frame["exit"]
+                    break
+                for name, text in frame.items():
+                    streams[name].write(text)
+                    streams[name].flush()
+    finally:
+        s.close()
+
+    if code is None:
+        print("{}Lost connection to the daemon.{}".format(Fore.RED, Style.RESET_ALL), file=sys.stderr)
+        return 1
+
+    return code
 
 if __name__ == '__main__':
     main()
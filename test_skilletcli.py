@@ -1,12 +1,29 @@
 from Remotes import Git, Github
-from skilletcli import create_context, set_at_path, check_resp, CREDS_FILENAME
-from panosxml import KeyDB
+from Remotes.gcloud import iter_json_array, query_key
+from Remotes.github import sync_repositories
+from Remotes.catalog import load_catalog, page
+from Remotes.context import load_variables
+from Remotes.scheduler import PushScheduler
+from Remotes.skillet import CONTENT_STORE, Skillet, Snippet
+from Remotes import Gcloud, Mirror
+from skilletcli import create_context, set_at_path, check_resp, CREDS_FILENAME, load_plan, PlanRunner, ResultLog, \
+    push_assembled, push_snippets, assemble_config
+from panosxml import KeyDB, TRACER, TraceHook, Journal
 from pytest import fixture
 from skilletcli import Panos
 import os
+import io
+import sys
+import json
+import time
+import subprocess
+import threading
 import pytest
-from git import GitCommandError
+from xml.etree import ElementTree
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from git import GitCommandError, Repo, Actor
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 
 @fixture
@@ -42,6 +59,54 @@ def hsk():
     return g
 
 
+@fixture(autouse=True)
+def build_cache(tmp_path, monkeypatch):
+    """
+    Keep each test's build cache to itself, rather than in the home directory.
+    """
+    monkeypatch.setenv("SKCLI_CACHE_DIR", str(tmp_path / "build-cache"))
+
+@fixture
+def local_skillet(tmp_path):
+    """
+    A small skillet repository created on local disk, so tests can clone it without network access.
+    It has a "master" branch with a templates directory and a "panos_v9.1" branch with a root-level layout.
+    """
+    path = tmp_path / "origin"
+    path.mkdir()
+    repo = Repo.init(str(path))
+    author = Actor("skilletcli", "skilletcli@localhost")
+
+    write_skillet(path / "templates" / "panos" / "snippets", "panos", ["tag", "address"])
+    write_skillet(path / "templates" / "panorama" / "snippets", "panorama", ["tag"])
+    (path / "docs").mkdir()
+    (path / "docs" / "README.md").write_text("Not required to build the skillet.")
+    repo.git.add(A=True)
+    repo.index.commit("templates layout", author=author, committer=author)
+    repo.git.branch("-M", "master")
+
+    repo.git.checkout("-b", "panos_v9.1")
+    repo.git.rm("-r", "templates")
+    write_skillet(path / "snippets", "panos", ["tag"])
+    repo.git.add(A=True)
+    repo.index.commit("root layout", author=author, committer=author)
+    repo.git.checkout("master")
+
+    return path
+
+def write_skillet(snippet_dir, skillet_type, names):
+    """
+    Write a snippet directory with a metafile and one tag style snippet file per name.
+    """
+    snippet_dir.mkdir(parents=True)
+    meta = "name: {}\ntype: {}\nvariables:\n  - name: TAG_COLOR\n    default: color1\nsnippets:\n".format(
+        snippet_dir.name, skillet_type)
+    for name in names:
+        meta += "  - name: {0}\n    xpath: /config/shared/{0}\n    file: {0}.xml\n".format(name)
+        (snippet_dir / "{}.xml".format(name)).write_text(
+            "<entry name='{}-{{{{ TAG_COLOR }}}}'><color>{{{{ TAG_COLOR }}}}</color></entry>".format(name))
+    (snippet_dir / ".meta-cnc.yaml").write_text(meta)
+
 def test_build(g):
     """
     Test a skillet build based on the fixture.
@@ -182,11 +247,1189 @@ def test_get_first_real_dir(g, gps):
     r = gps.get_first_real_dir(template_dirs)
     assert "gps" in r
 
+def test_iter_json_array():
+    """
+    Test the incremental decoding of streamed API responses, regardless of where the chunk boundaries fall.
+    """
+    data = [{"name": "tag", "path": "/config/tag", "xml": "<entry name='t'/>"}, {"name": "address", "xml": "]"}]
+    raw = json.dumps(data).encode("utf-8")
+    for size in [1, 7, len(raw)]:
+        chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+        assert list(iter_json_array(chunks)) == data
+
+    assert list(iter_json_array([b"[", b"]"])) == []
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'[{"name": "tag"}']))
+
+def test_batch_query():
+    """
+    Test concurrent querying of the snippet API against a local stand-in, making sure duplicate queries are only sent
+    once.
+    """
+    received = []
+
+    class SnippetHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            received.append(query)
+            body = json.dumps([{
+                "name": query["filters"]["name"][0],
+                "path": "/config/{}".format(query["filters"]["type"]),
+                "xml": "<entry name='{}'/>".format(query["filters"]["panos_version"]),
+            }]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            return
+
+    server = start_server(SnippetHandler)
+    try:
+        gc = Gcloud("http://127.0.0.1:{}".format(server.server_port))
+        queries = [
+            ("iron-skillet", "panos", "snippets", ["tag"], "9.0", {"a": 1}),
+            ("iron-skillet", "panorama", "snippets", ["tag"], "9.1", {"a": 1}),
+            ("iron-skillet", "panos", "snippets", ["tag"], "9.0", {"a": 1}),
+        ]
+        results = gc.BatchQuery(queries)
+    finally:
+        server.shutdown()
+
+    assert len(received) == 2
+    assert len(results) == 2
+    snippets = results[query_key("iron-skillet", "panorama", "snippets", ["tag"], "9.1", {"a": 1})]
+    assert snippets[0].name == "tag"
+    assert snippets[0].rendered_xpath == "/config/panorama"
+    assert snippets[0].rendered_xmlstr == "<entry name='9.1'/>"
+
+def test_mirror(tmp_path):
+    """
+    Test syncing the catalog into a local mirror, then querying and rendering from it without the API.
+    """
+    catalog = [
+        {"name": "tag", "type": "panos", "stack": "snippets", "panos_version": "9.0", "path": "/config/{{ VSYS }}/tag",
+         "xml": "<entry name='{{ TAG }}'/>", "variables": [{"name": "TAG", "default": "t1"}, {"name": "VSYS", "default": "vsys1"}]},
+        {"name": "tag", "type": "panos", "stack": "snippets", "panos_version": "9.1", "path": "/config/tag",
+         "xml": "<entry name='91'/>"},
+        {"name": "address", "type": "panorama", "stack": "snippets", "panos_version": "9.0", "path": "/config/address",
+         "xml": "<entry name='a'/>"},
+        # The list API may leave out everything but the name, path and body
+        {"name": "zone", "path": "/config/zone", "xml": "<entry name='z'/>"},
+    ]
+
+    class CatalogHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(catalog).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            return
+
+    server = start_server(CatalogHandler)
+    try:
+        m = Mirror(str(tmp_path))
+        url = "http://127.0.0.1:{}".format(server.server_port)
+        counts = m.sync(url, "iron-skillet")
+        assert counts == {"added": 4, "unchanged": 0, "removed": 0}
+        catalog.pop(2)
+        # A blob that is already gone is not an error
+        os.remove(m.blob_path("iron-skillet", m.load_index("iron-skillet")["snippets"][2]["hash"]))
+        counts = m.sync(url, "iron-skillet")
+        assert counts == {"added": 0, "unchanged": 3, "removed": 1}
+    finally:
+        server.shutdown()
+
+    m = Mirror(str(tmp_path))
+    assert list(m.StreamNames("iron-skillet")) == ["tag", "zone"]
+    snippets = m.Query("iron-skillet", "panos", "snippets", ["tag"], "9.0", None)
+    assert len(snippets) == 1
+    # Snippets of unknown type are only pushed when asked for
+    assert m.Query("iron-skillet", "panorama", "snippets", ["all"], "9.1", None) == []
+    assert [s.name for s in m.Query("iron-skillet", "panorama", "snippets", ["all"], "9.1", None, untyped=True)] == [
+        "zone"]
+    assert snippets[0].rendered_xpath == "/config/vsys1/tag"
+    assert snippets[0].rendered_xmlstr == "<entry name='t1'/>"
+    snippets = m.Query("iron-skillet", "panos", "snippets", ["all"], "9.0", {"TAG": "t2", "VSYS": "vsys2"})
+    assert snippets[0].rendered_xmlstr == "<entry name='t2'/>"
+
+def start_server(handler):
+    """
+    Start a local HTTP server in the background, as a stand-in for remote APIs.
+    :param handler: BaseHTTPRequestHandler class
+    :return: HTTPServer instance. Stop it with shutdown().
+    """
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return server
+
+def test_sparse_clone(local_skillet, tmp_path):
+    """
+    Test that shallow, partial and sparse clones only check out what is needed to build the skillet, across branches.
+    """
+    store = tmp_path / "store"
+    store.mkdir()
+    g = Git("file://" + str(local_skillet), store=str(store))
+    path = g.clone("sparse", depth=1, blob_filter="blob:none", sparse=True)
+    assert os.path.isdir(os.path.join(path, "templates", "panos"))
+    assert not os.path.exists(os.path.join(path, "docs"))
+    assert "panos_v9.1" in g.list_branches()
+    assert len(g.build().get_skillet("panos").snippet_stack["snippets"].snippets) == 2
+
+    g.branch("panos_v9.1")
+    assert os.path.isdir(os.path.join(path, "snippets"))
+    assert len(g.build().get_skillet("panos").snippet_stack["snippets"].snippets) == 1
+
+    # Reopening the clone keeps it sparse
+    g = Git("file://" + str(local_skillet), store=str(store))
+    g.clone("sparse", update=True)
+    assert g.sparse
+
+def test_sync_repositories(local_skillet, tmp_path):
+    """
+    Test syncing several repositories at once, including one that fails, and that the builds are cached.
+    """
+    store = tmp_path / "store"
+    store.mkdir()
+    good = Git("file://" + str(local_skillet), store=str(store), github_info={"name": "good"})
+    bad = Git("file://" + str(tmp_path / "missing"), store=str(store), github_info={"name": "bad"})
+    results = sync_repositories([good, bad], workers=2)
+
+    assert results[0]["name"] == "good"
+    assert results[0]["error"] is None
+    assert results[0]["snippets"] == 3
+    assert results[1]["error"] is not None
+
+    cache_file = good.build_cache_path(good.Repo.head.commit.hexsha)
+    assert os.path.isfile(cache_file)
+    assert cache_file.startswith(str(tmp_path / "build-cache"))
+    # Clones made differently are cached separately
+    good.sparse = True
+    assert good.build_cache_path(good.Repo.head.commit.hexsha) != cache_file
+    good.sparse = False
+    sc = good.build_cached()
+    assert len(sc.get_skillet("panos").snippet_stack["snippets"].snippets) == 2
+
+def test_build_from_ref(local_skillet, tmp_path):
+    """
+    Test building several branches concurrently from one clone, straight from the git objects.
+    """
+    g = Git("file://" + str(local_skillet), store=str(tmp_path))
+    path = g.clone("refs")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        builds = list(executor.map(g.build, ["master", "panos_v9.1"] * 4))
+
+    for i, sc in enumerate(builds):
+        snippets = sc.get_skillet("panos").snippet_stack["snippets"].snippets
+        assert len(snippets) == (2 if i % 2 == 0 else 1)
+        assert snippets[0].xmlstr.startswith("<entry name='tag-")
+
+    # The working tree was never touched
+    assert g.Repo.active_branch.name == "master"
+    assert not os.path.exists(os.path.join(path, "snippets"))
+
+def test_content_store_dedup(local_skillet, tmp_path):
+    """
+    Test that identical snippet files from different branches are stored, and compiled, only once.
+    """
+    g = Git("file://" + str(local_skillet), store=str(tmp_path))
+    g.clone("dedup")
+    master = g.build("master").get_skillet("panos").snippet_stack["snippets"].snippets
+    v91 = g.build("panos_v9.1").get_skillet("panos").snippet_stack["snippets"].snippets
+    local = g.build().get_skillet("panos").snippet_stack["snippets"].snippets
+
+    assert master[0].name == v91[0].name == "tag"
+    assert master[0].xmlstr is v91[0].xmlstr
+    assert local[0].xmlstr is master[0].xmlstr
+    assert CONTENT_STORE.template(master[0].xmlstr) is CONTENT_STORE.template(v91[0].xmlstr)
+
+def test_content_store_bounds(monkeypatch):
+    """
+    Test that every part of the content store drops its oldest entries once full.
+    """
+    from Remotes import skillet
+    monkeypatch.setattr(skillet, "OBJECT_CACHE_ENTRIES", 2)
+    monkeypatch.setattr(skillet, "BLOB_CACHE_SIZE", 10)
+    store = skillet.ContentStore()
+    for i in range(5):
+        source = "<a>{{ V%d }}</a>" % i
+        store.blob(source)
+        assert store.render(source, {"V%d" % i: i}) == "<a>%d</a>" % i
+        store.parsed(source, len)
+
+    assert len(store.templates) == len(store.template_variables) == len(store.parsed_objects) == 2
+    assert len(store.blobs) == 0
+    assert store.blob("<a/>") is store.blob("<a/>")
+    assert list(store.blobs) == [skillet.blob_hash("<a/>")]
+
+def test_plan(local_skillet, tmp_path):
+    """
+    Test that a plan expands inventory groups into per-device jobs, and that devices sharing a skillet and variables
+    share the rendered snippets.
+    """
+    (tmp_path / "base.yaml").write_text("variables:\n  - name: TAG_COLOR\n    value: color1\n")
+    (tmp_path / "site.yaml").write_text("variables:\n  - name: TAG_COLOR\n    value: color7\n")
+    plan = tmp_path / "plan.yaml"
+    plan.write_text("""
+inventory:
+  branches: [fw1, fw2]
+defaults:
+  repotype: local
+  repopath: {}
+  snippetstack: snippets
+  variables: [{}]
+jobs:
+  - name: tags
+    devices: [branches, fw3]
+    snippets: [tag]
+  - name: site
+    device: fw3
+    snippets: [all]
+    variables: [{}, {}]
+""".format(local_skillet / "templates", tmp_path / "base.yaml", tmp_path / "base.yaml", tmp_path / "site.yaml"))
+
+    jobs = load_plan(str(plan))
+    assert [(j["name"], j["device"]) for j in jobs] == [("tags", "fw1"), ("tags", "fw2"), ("tags", "fw3"),
+                                                        ("site", "fw3")]
+
+    class Device:
+        def get_type(self, refresh=True):
+            return "panos"
+
+        def get_version(self):
+            return "9.0"
+
+    runner = PlanRunner(jobs)
+    fw1 = runner.resolve(jobs[0], Device())
+    fw2 = runner.resolve(jobs[1], Device())
+    assert fw1 is fw2
+    assert [s.rendered_xmlstr for s in fw1] == ["<entry name='tag-color1'><color>color1</color></entry>"]
+
+    site = runner.resolve(jobs[3], Device())
+    assert sorted(s.name for s in site) == ["address", "tag"]
+    assert "<entry name='tag-color7'><color>color7</color></entry>" in [s.rendered_xmlstr for s in site]
+    assert len(runner.collections) == 1
+
+def test_plan_run(local_skillet, tmp_path, monkeypatch):
+    """
+    Test running a plan against stand-in devices, with jobs for different devices pushed concurrently.
+    """
+    import skilletcli
+    from Remotes.skillet import BoundedDict
+    state = {"active": 0, "most": 0, "sets": []}
+    lock = threading.Lock()
+
+    class DeviceHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+            if "system" in body:
+                resp = b"<response status='success'><result><system><model>PA-VM</model>" \
+                       b"<sw-version>9.0.3</sw-version></system></result></response>"
+            else:
+                with lock:
+                    state["active"] += 1
+                    state["most"] = max(state["most"], state["active"])
+                    state["sets"].append(self.server.server_port)
+                # Hold the request, so pushes to the other device overlap it
+                time.sleep(0.2)
+                with lock:
+                    state["active"] -= 1
+                resp = b'<response status="success" code="20"><msg>command succeeded</msg></response>'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(resp)))
+            self.end_headers()
+            self.wfile.write(resp)
+
+        def log_message(self, *args):
+            pass
+
+    servers = [start_server(DeviceHandler) for i in range(2)]
+    monkeypatch.setattr(skilletcli, "DEVICE_POOL", BoundedDict(skilletcli.DEVICE_POOL_SIZE))
+    addrs = []
+    for server in servers:
+        addr = "127.0.0.1:{}".format(server.server_port)
+        fw = Panos(addr, apikey="key")
+        fw.url = "http://127.0.0.1:{}/api".format(server.server_port)
+        skilletcli.DEVICE_POOL.add((addr, False), fw)
+        addrs.append(addr)
+
+    plan = tmp_path / "plan.yaml"
+    plan.write_text("""
+defaults:
+  repotype: local
+  repopath: {}
+  snippetstack: snippets
+jobs:
+  - name: tags
+    devices: [{}, {}]
+    snippets: [tag]
+  - name: all
+    device: {}
+    snippets: [all]
+""".format(local_skillet / "templates", addrs[0], addrs[1], addrs[0]))
+
+    out = io.StringIO()
+    try:
+        PlanRunner(load_plan(str(plan)), workers=2, results=ResultLog("jsonl", stream=out)).run()
+    finally:
+        for server in servers:
+            server.shutdown()
+
+    records = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert [r["status"] for r in records if "status" in r] == ["success"] * 4
+    assert sorted(state["sets"]) == sorted([servers[0].server_port] * 3 + [servers[1].server_port])
+    assert state["most"] == 2
+
+def test_jsonl_results():
+    """
+    Test that JSON Lines results record the outcome and timing of each push, followed by a summary.
+    """
+    class DeviceHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+            if "bad" in body:
+                resp = b'<response status="error" code="12"><msg><line>bad -> invalid</line></msg></response>'
+            else:
+                resp = b'<response status="success" code="20"><msg>command succeeded</msg></response>'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(resp)))
+            self.end_headers()
+            self.wfile.write(resp)
+
+        def log_message(self, *args):
+            pass
+
+    server = start_server(DeviceHandler)
+    try:
+        fw = Panos("127.0.0.1:{}".format(server.server_port), apikey="key")
+        fw.url = "http://127.0.0.1:{}/api".format(server.server_port)
+        out = io.StringIO()
+        results = ResultLog("jsonl", stream=out)
+        for name in ["good", "bad"]:
+            snippet = Snippet("/config/shared/" + name, "<entry name='{}'/>".format(name))
+            snippet.name = name
+            snippet.set_metadata({"variables": []})
+            snippet.template({})
+            results.push(fw, snippet)
+        results.summary()
+    finally:
+        server.shutdown()
+
+    good, bad, summary = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert good["status"] == "success" and good["snippet"] == "good" and good["request_bytes"] > 0
+    assert bad["status"] == "error" and bad["code"] == "12" and bad["message"] == "bad -> invalid"
+    assert bad["device"] == "127.0.0.1:{}".format(server.server_port) and bad["latency"] >= 0
+    assert summary["type"] == "summary"
+    assert (summary["operations"], summary["succeeded"], summary["failed"]) == (2, 1, 1)
+
+def test_trace(local_skillet, tmp_path):
+    """
+    Test that building and rendering a skillet is traced to hooks and to a Chrome trace.
+    """
+    class Hook(TraceHook):
+        def __init__(self):
+            self.finished = []
+
+        def span_finished(self, span):
+            self.finished.append(span.name)
+
+    hook = Hook()
+    TRACER.add_hook(hook)
+    TRACER.start_recording()
+    try:
+        g = Git("file://" + str(local_skillet), store=str(tmp_path))
+        g.clone("traced")
+        g.build().get_skillet("panos").render("snippets", ["tag"], None)
+    finally:
+        TRACER.stop_recording()
+        TRACER.remove_hook(hook)
+
+    for name in ["git.clone", "git.build", "metafile.parse", "snippet.template", "snippet.split"]:
+        assert name in hook.finished
+
+    trace_file = tmp_path / "trace.json"
+    TRACER.write_chrome_trace(str(trace_file))
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    assert len(events) == len(hook.finished)
+    build = [e for e in events if e["name"] == "git.build"][0]
+    parses = [e for e in events if e["name"] == "metafile.parse"]
+    # Metafiles are parsed during the build
+    assert all(build["ts"] <= e["ts"] <= build["ts"] + build["dur"] for e in parses)
+
+def test_benchmarks(tmp_path):
+    """
+    Test that the benchmark suite generates a buildable repository and times every benchmark against it.
+    """
+    import benchmark
+    shape = {"stacks": 2, "snippets": 2, "entries": 300, "depth": 2}
+    results = benchmark.run_benchmarks(shape, repeat=1, workdir=str(tmp_path))
+    assert sorted(results.keys()) == ["build", "list", "push", "render_many", "select", "template"]
+
+    sc = Git("").build_from_local(str(tmp_path / "skillet"))
+    skillet = sc.get_skillet("panos")
+    skillet.template(None)
+    snippets = skillet.select_snippets("stack0", ["stack0-snippet0"])
+    # Large snippets are split into one snippet per entry, plus the entries from the nested blocks
+    assert len(snippets) == 300 + 2 + 4
+
+def test_split_views(tmp_path):
+    """
+    Test that split snippets are views into the rendered snippet they were split from, matching each entry exactly.
+    """
+    import benchmark
+    entries = ["<entry name='n{}'><color>c\u00e9{}</color></entry>".format(i, i) for i in range(200)]
+    xmlstr = "\n".join(entries[:100]) + "<!-- c --><entry name='empty'/>" + "".join(entries[100:])
+    s = Snippet("/config/shared/tag", xmlstr)
+    s.set_metadata({"variables": []})
+    s.template({})
+    pieces = Skillet("split", "panos", []).split_snippet(s)
+    assert [p.rendered_xmlstr for p in pieces] == entries[:100] + ["<entry name='empty'/>"] + entries[100:]
+    assert all(p.rendered_buffer is s.rendered_buffer for p in pieces)
+    assert pieces[0].metadata is s.metadata
+    assert not hasattr(s, "__dict__")
+
+    memory = benchmark.measure_memory({"stacks": 1, "snippets": 1, "entries": 300, "depth": 1}, workdir=str(tmp_path))
+    assert memory["pieces"] == 302
+    assert memory["peak"] >= memory["build"] + memory["template"]
+
+def test_benchmark_results(tmp_path, monkeypatch, capsys):
+    """
+    Test that memory and timing runs share a results file, each only compared with earlier runs of its own kind.
+    """
+    import benchmark
+    results = str(tmp_path / "results.jsonl")
+    for argv in [["--memory"], ["--repeat", "1", "--only", "build"], ["--repeat", "1", "--only", "build",
+                                                                      "--threshold", "1000"]]:
+        monkeypatch.setattr(sys, "argv", ["benchmark.py", "--size", "tiny", "--results", results] + argv)
+        benchmark.main()
+
+    runs = benchmark.load_results(results)
+    assert ["memory" in r for r in runs] == [True, False, False]
+    assert "Compared with" in capsys.readouterr().out.split("Running tiny benchmarks")[2]
+
+def test_render_many():
+    """
+    Test that batch rendering matches rendering each context separately, with and without workers.
+    """
+    from Remotes.skillet import SnippetStack
+    s = Snippet("/config/devices/entry/device-group/entry[@name='{{ DG }}']/tag",
+                "<entry name='{{ DG }}-tag'><color>{{ COLOR }}</color></entry>")
+    s.name = "tag"
+    s.set_metadata({"variables": [{"name": "DG", "default": "dg"}, {"name": "COLOR", "default": "color1"}]})
+    contexts = [{"DG": "dg{}".format(i), "COLOR": "color{}".format(i % 3)} for i in range(600)] + [{}]
+
+    expected = []
+    for context in contexts:
+        c = s.copy()
+        c.template(context)
+        expected.append((c.rendered_xpath, c.rendered_xmlstr))
+    assert list(s.render_many(iter(contexts))) == expected
+    assert list(s.render_many(contexts, workers=4)) == expected
+    assert expected[-1][1] == "<entry name='dg-tag'><color>color1</color></entry>"
+
+    skillet = Skillet("panorama", "panorama", [])
+    skillet.add_snippet_stacks({"snippets": SnippetStack([s], s.metadata)})
+    rendered = list(skillet.render_many("snippets", ["tag"], contexts[:2]))
+    assert [[(r.name, r.rendered_xpath, r.rendered_xmlstr) for r in snippets] for snippets in rendered] == [
+        [("tag", xpath, xmlstr)] for xpath, xmlstr in expected[:2]]
+    # The skillet itself is left untouched
+    assert s.rendered_xmlstr == ""
+
+def test_hashing(monkeypatch):
+    """
+    Test that password hashes are memoized, and derived salts are repeatable for each device but differ between them.
+    """
+    import concurrent.futures
+    import Remotes.skillet
+    from Remotes.hashing import HashService, use_service
+    from passlib.hash import md5_crypt, sha512_crypt
+    s = Snippet("/config/mgt-config/users/entry[@name='admin']",
+                "<phash>{{ PASSWORD | md5_hash }}</phash>")
+    s.set_metadata({"variables": []})
+
+    # Random salts, but each password is only hashed once per run
+    with use_service(HashService()):
+        s.template({"PASSWORD": "secret", "FW_NAME": "fw1"})
+        first = s.rendered_xmlstr
+        s.template({"PASSWORD": "secret", "FW_NAME": "fw2"})
+        assert s.rendered_xmlstr == first
+        assert md5_crypt.verify("secret", first[len("<phash>"):-len("</phash>")])
+
+        # Renders with random salts are only reused within a run, as the daemon runs many
+        h = CONTENT_STORE.render("{{ PASSWORD | md5_hash }}", {"PASSWORD": "other"})
+        assert CONTENT_STORE.render("{{ PASSWORD | md5_hash }}", {"PASSWORD": "other"}) == h
+    with use_service(HashService()):
+        assert CONTENT_STORE.render("{{ PASSWORD | md5_hash }}", {"PASSWORD": "other"}) != h
+
+    # Every batch hashes with the same worker processes
+    pools = []
+
+    class CountingPool(concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", CountingPool)
+    monkeypatch.setattr(Remotes.skillet, "RENDER_BATCH_SIZE", 2)
+    contexts = [{"PASSWORD": "secret", "FW_NAME": "fw{}".format(i % 3)} for i in range(6)]
+    with use_service(HashService(secret="s3cret", salt_variable="FW_NAME")):
+        rendered = [xmlstr for xpath, xmlstr in s.render_many(contexts, workers=2)]
+    assert rendered[:3] == rendered[3:]
+    assert len(set(rendered)) == 3
+    assert len(pools) == 1
+
+    # The same hashes again in a later run
+    CONTENT_STORE.clear()
+    with use_service(HashService(secret="s3cret", salt_variable="FW_NAME")):
+        assert [xmlstr for xpath, xmlstr in s.render_many(contexts)] == rendered
+        h = CONTENT_STORE.render("{{ PASSWORD | sha512_hash }}", {"PASSWORD": "secret", "FW_NAME": "fw1"})
+        assert h.startswith("$6$") and sha512_crypt.verify("secret", h)
+        assert CONTENT_STORE.render("{{ PASSWORD | sha512_hash }}", {"PASSWORD": "secret", "FW_NAME": "fw1"}) == h
+
+    # Runs at the same time, such as in the daemon, each hash with their own settings
+    services = [HashService(secret="s{}".format(i), salt_variable="FW_NAME") for i in range(4)]
+    barrier = threading.Barrier(len(services))
+    failures = []
+
+    def render(service):
+        with use_service(service):
+            barrier.wait()
+            for i in range(20):
+                context = {"PASSWORD": "secret", "FW_NAME": "fw{}".format(i % 2)}
+                h = CONTENT_STORE.render("{{ PASSWORD | md5_hash }}", context)
+                if h != "$1${}${}".format(service.salt("md5_crypt", "secret", context["FW_NAME"]), h.split("$")[3]):
+                    failures.append((service.secret, h))
+
+    threads = [threading.Thread(target=render, args=(service,)) for service in services]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert failures == []
+
+def test_assemble():
+    """
+    Test that snippets are merged into one configuration, then imported and applied in a few requests.
+    """
+    requests = []
+
+    class DeviceHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+            requests.append(body)
+            if "name=\"type\"\r\n\r\nimport" in body:
+                resp = b'<response status="success"><msg>imported</msg></response>'
+            elif "action=show" in body:
+                resp = b"<response status='success'><result><config version='9.1.0'><shared><tag><entry name='old'>" \
+                       b"<color>color9</color></entry></tag></shared></config></result></response>"
+            else:
+                resp = b'<response status="success"><result>Config loaded</result></response>'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(resp)))
+            self.end_headers()
+            self.wfile.write(resp)
+
+        def log_message(self, *args):
+            pass
+
+    snippets = []
+    for xpath, xmlstr in [
+        ("/config/shared/tag", "<entry name='red'>\n  <color>color1</color>\n</entry><entry name='old'><comments>c</comments></entry>"),
+        ("/config/shared/tag/entry[@name='red']", "<color>color2</color>"),
+        ("/config/shared/address", "<entry name='a'><ip-netmask>10.0.0.1</ip-netmask><tag><member>red</member></tag></entry>"),
+        ("/config/devices/entry[@name='localhost.localdomain']/vsys/entry[@name='vsys1']/rulebase", "<security/>"),
+        ("/config/devices/entry[@name='localhost.localdomain']/deviceconfig/system", "<hostname>fw1</hostname>"),
+    ]:
+        s = Snippet(xpath, xmlstr)
+        s.name = xpath.split("/")[-1]
+        s.set_metadata({"variables": []})
+        s.template({})
+        snippets.append(s)
+
+    server = start_server(DeviceHandler)
+    try:
+        fw = Panos("127.0.0.1:{}".format(server.server_port), apikey="key")
+        fw.url = "http://127.0.0.1:{}/api".format(server.server_port)
+        out = io.StringIO()
+        results = ResultLog("jsonl", stream=out)
+        assert push_assembled(fw, snippets, results, base="device")
+    finally:
+        server.shutdown()
+
+    # Read the candidate, import, and one load for each part of the configuration changed
+    assert len(requests) == 5
+    imported = ElementTree.fromstring(requests[1][requests[1].index("<config"):requests[1].index("</config>") + 9])
+    assert imported.get("version") == "9.1.0"
+    assert imported.find("./shared/tag/entry[@name='red']/color").text == "color2"
+    assert imported.find("./shared/tag/entry[@name='old']/color").text == "color9"
+    assert imported.find("./shared/tag/entry[@name='old']/comments").text == "c"
+    assert imported.find("./devices/entry[@name='localhost.localdomain']/deviceconfig/system/hostname").text == "fw1"
+    records = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert [(r["snippet"], r["status"]) for r in records][0] == ("import", "success")
+    assert [r["xpath"] for r in records[1:]] == ["/config/shared/tag", "/config/shared/address",
+                                                 "/config/devices/entry[@name='localhost.localdomain']"]
+
+    # A base that isn't a configuration, such as an error response, stops the push before anything is sent
+    for base in ["<response status='error'/>", "<config"]:
+        with pytest.raises(SystemExit):
+            assemble_config(snippets, base)
+
+def test_archive(local_skillet, tmp_path, monkeypatch):
+    """
+    Test that a skillet can be fetched and built from a tarball over HTTP without a git client, only keeping the
+    template directories, and that unchanged archives aren't downloaded again.
+    """
+    import Remotes.github
+    from Remotes import Archive
+    from Remotes.archive import archive_url, read_archive
+    import tarfile
+    archives = {}
+    for ref in ["master", "panos_v9.1"]:
+        archives[ref] = subprocess.run(["git", "-C", str(local_skillet), "archive", "--format=tar.gz",
+                                        "--prefix=origin-{}/".format(ref), ref], stdout=subprocess.PIPE,
+                                       check=True).stdout
+    requests = []
+
+    class ArchiveHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            ref = self.path.split("/")[-1][:-len(".tar.gz")]
+            etag = '"{}"'.format(ref)
+            requests.append((ref, self.headers.get("If-None-Match")))
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(archives[ref])))
+            self.end_headers()
+            self.wfile.write(archives[ref])
+
+        def log_message(self, *args):
+            pass
+
+    # To compare with, before git is made to look missing
+    local = Git("")
+    monkeypatch.setattr(Remotes.github, "check_git_exists", lambda: None)
+    server = start_server(ArchiveHandler)
+    try:
+        url = "http://127.0.0.1:{}/archive/{{ref}}.tar.gz".format(server.server_port)
+        a = Archive(url, store=str(tmp_path))
+        path = a.clone("archived", ref="master")
+        assert sorted(os.listdir(path)) == [".skcli_archive.json", "templates"]
+        sc = a.build_cached()
+        assert len(sc.get_skillet("panos").snippet_stack["snippets"].snippets) == 2
+        assert a.cache_commit() == Repo(str(local_skillet)).commit("master").hexsha
+
+        Archive(url, store=str(tmp_path)).clone("archived", ref="master")
+        Archive(url, store=str(tmp_path)).clone("archived", ref="master", update=True)
+        assert requests == [("master", None), ("master", '"master"')]
+
+        a.branch("panos_v9.1")
+        assert os.path.isdir(os.path.join(path, "snippets"))
+        assert len(a.build().get_skillet("panos").snippet_stack["snippets"].snippets) == 1
+
+        # Snippet files nested within a root level snippet directory are kept, even if they come before its metafile
+        nested = tmp_path / "nested"
+        (nested / "tags" / "xml").mkdir(parents=True)
+        (nested / "tags" / "xml" / "tag.xml").write_text("<entry name='t'><color>color1</color></entry>")
+        (nested / "tags" / ".meta-cnc.yaml").write_text(
+            "name: tags\ntype: panos\nsnippets:\n  - name: tag\n    xpath: /config/shared/tag\n    file: xml/tag.xml\n")
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+            tar.add(str(nested / "tags" / "xml"), arcname="origin-nested/tags/xml")
+            tar.add(str(nested / "tags" / ".meta-cnc.yaml"), arcname="origin-nested/tags/.meta-cnc.yaml")
+        archives["nested"] = buf.getvalue()
+        a.branch("nested")
+        expected = local.build_from_local(str(nested)).get_skillet("panos").snippet_stack["tags"].snippets
+        snippets = a.build().get_skillet("panos").snippet_stack["tags"].snippets
+        assert [s.xmlstr for s in snippets] == [s.xmlstr for s in expected] == [
+            "<entry name='t'><color>color1</color></entry>"]
+
+        # Anything else in the way, such as a git clone, is left alone
+        clone = tmp_path / "cloned"
+        (clone / ".git").mkdir(parents=True)
+        with pytest.raises(SystemExit):
+            Archive(url, store=str(tmp_path)).clone("cloned", ref="master")
+        assert os.listdir(str(clone)) == [".git"]
+        assert len(requests) == 4
+    finally:
+        server.shutdown()
+
+    # Only files that could be templates are read
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for name in ["repo/README.md", "repo/docs/img/a.png", "repo/templates/panos/snippets/tag.xml",
+                     "repo/snippets/xml/tag.xml", "repo/snippets/.meta-cnc.yaml"]:
+            info = tarfile.TarInfo(name)
+            info.size = 1
+            tar.addfile(info, io.BytesIO(b"x"))
+    buf.seek(0)
+    assert sorted(read_archive(buf)[0]) == ["snippets/.meta-cnc.yaml", "snippets/xml/tag.xml",
+                                            "templates/panos/snippets/tag.xml"]
+
+    assert archive_url("https://github.com/PaloAltoNetworks/iron-skillet.git") == \
+        "https://github.com/PaloAltoNetworks/iron-skillet/archive/{ref}.tar.gz"
+
+def test_metrics(tmp_path):
+    """
+    Test that pushes record request, byte and latency metrics, exported as a Prometheus text file and over HTTP.
+    """
+    import urllib.request
+    from panosxml.metrics import METRICS, REQUESTS, REQUEST_SECONDS, SPLITS, serve_metrics
+
+    class DeviceHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            resp = b'<response status="success" code="20"><msg>command succeeded</msg></response>'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(resp)))
+            self.end_headers()
+            self.wfile.write(resp)
+
+        def log_message(self, *args):
+            pass
+
+    METRICS.clear()
+    CONTENT_STORE.clear()
+    server = start_server(DeviceHandler)
+    metrics_server = serve_metrics(0)
+    try:
+        fw = Panos("127.0.0.1:{}".format(server.server_port), apikey="key")
+        fw.url = "http://127.0.0.1:{}/api".format(server.server_port)
+        s = Snippet("/config/shared/tag", "".join("<entry name='t{}'><color>color1</color></entry>".format(i)
+                                                  for i in range(200)))
+        s.set_metadata({"variables": []})
+        s.template({})
+        results = ResultLog("jsonl", stream=io.StringIO())
+        for piece in Skillet("panos", "panos", []).split_snippet(s):
+            results.push(fw, piece)
+
+        exposed = urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(metrics_server.server_port)).read()
+    finally:
+        server.shutdown()
+        metrics_server.shutdown()
+
+    device = fw.addr
+    assert REQUESTS.value(device=device, type="config", action="set", code="200") == 200
+    assert REQUEST_SECONDS.count(device=device, type="config") == 200
+    assert SPLITS.value() == 1
+
+    METRICS.write(str(tmp_path / "skilletcli.prom"))
+    text = (tmp_path / "skilletcli.prom").read_text()
+    assert exposed.decode("utf-8") == text
+    assert "# TYPE skcli_request_seconds histogram" in text
+    assert 'skcli_requests_total{{device="{}",type="config",action="set",code="200"}} 200'.format(device) in text
+    assert 'skcli_request_seconds_bucket{{device="{}",type="config",le="+Inf"}} 200'.format(device) in text
+    assert "skcli_snippet_split_pieces_total 200" in text
+    assert 'skcli_cache_requests_total{cache="render",result="miss"} 2' in text
+
+    # A later run only writes what it did itself, as the daemon keeps the totals of every run
+    start = METRICS.snapshot()
+    server = start_server(DeviceHandler)
+    try:
+        fw.url = "http://127.0.0.1:{}/api".format(server.server_port)
+        results.push(fw, piece)
+    finally:
+        server.shutdown()
+    METRICS.write(str(tmp_path / "run.prom"), since=start)
+    text = (tmp_path / "run.prom").read_text()
+    assert 'skcli_requests_total{{device="{}",type="config",action="set",code="200"}} 1'.format(device) in text
+    assert 'skcli_request_seconds_bucket{{device="{}",type="config",le="+Inf"}} 1'.format(device) in text
+    assert not any(line.startswith("skcli_snippet_split") for line in text.splitlines())
+    assert REQUESTS.value(device=device, type="config", action="set", code="200") == 201
+
+def test_ledger(tmp_path):
+    """
+    Test that snippets unchanged since they were last pushed are skipped, still once they are committed, but not once
+    they are reverted or someone else changes the configuration.
+    """
+    from panosxml import Ledger
+    state = {"version": 1, "pending": False, "sets": 0}
+
+    class DeviceHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+            if "audit" in body:
+                resp = '<response status="success"><result>{}</result></response>'.format("".join(
+                    "<entry><version>{}</version></entry>".format(v) for v in range(1, state["version"] + 1))).encode(
+                    "utf-8")
+            elif "pending-changes" in body:
+                resp = '<response status="success"><result>{}</result></response>'.format(
+                    "yes" if state["pending"] else "no").encode("utf-8")
+            else:
+                state["sets"] += 1
+                state["pending"] = True
+                resp = b'<response status="success" code="20"><msg>command succeeded</msg></response>'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(resp)))
+            self.end_headers()
+            self.wfile.write(resp)
+
+        def log_message(self, *args):
+            pass
+
+    def push(colors):
+        snippets = []
+        for name, color in colors.items():
+            s = Snippet("/config/shared/tag", "<entry name='{}'><color>{}</color></entry>".format(name, color))
+            s.name = "tag"
+            s.set_metadata({"variables": []})
+            s.template({})
+            snippets.append(s)
+
+        ledger = Ledger(str(tmp_path / "ledger.json"))
+        out = io.StringIO()
+        results = ResultLog("jsonl", stream=out, ledger=ledger)
+        for s in snippets:
+            results.push(fw, s)
+        ledger.save()
+        return [json.loads(l)["status"] for l in out.getvalue().splitlines()]
+
+    server = start_server(DeviceHandler)
+    try:
+        fw = Panos("127.0.0.1:{}".format(server.server_port), apikey="key")
+        fw.url = "http://127.0.0.1:{}/api".format(server.server_port)
+        assert push({"a": "color1", "b": "color2"}) == ["success", "success"]
+        # Entries sharing an xpath are recorded separately
+        assert push({"a": "color1", "b": "color2"}) == ["skipped", "skipped"]
+        assert push({"a": "color1", "b": "color3"}) == ["skipped", "success"]
+        assert state["sets"] == 3
+
+        # Committing our pushes keeps them
+        state["version"], state["pending"] = 2, False
+        assert push({"a": "color1", "b": "color3"}) == ["skipped", "skipped"]
+
+        # Reverting drops what was pushed since the commit
+        assert push({"a": "color1", "b": "color4"}) == ["skipped", "success"]
+        state["pending"] = False
+        assert push({"a": "color1", "b": "color4"}) == ["skipped", "success"]
+
+        # Someone else's uncommitted changes, or commit, drop everything
+        state["version"], state["pending"] = 3, False
+        assert push({"a": "color1", "b": "color4"}) == ["skipped", "skipped"]
+        state["pending"] = True
+        assert push({"a": "color1", "b": "color4"}) == ["success", "success"]
+        state["version"], state["pending"] = 4, False
+        assert push({"a": "color1", "b": "color4"}) == ["skipped", "skipped"]
+        state["version"] = 5
+        assert push({"a": "color1", "b": "color4"}) == ["success", "success"]
+
+        # Our pushes were committed, but then someone else committed again, perhaps changing them
+        state["version"], state["pending"] = 7, False
+        assert push({"a": "color1", "b": "color4"}) == ["success", "success"]
+    finally:
+        server.shutdown()
+
+def test_catalog(local_skillet, tmp_path):
+    """
+    Test that the snippet catalog can be searched by name, xpath, entry and variable, and is saved with the build cache.
+    """
+    g = Git("file://" + str(local_skillet), store=str(tmp_path))
+    g.clone("catalog")
+    catalog = g.catalog()
+    catalog_file = g.catalog_path(g.Repo.head.commit.hexsha)
+    assert os.path.isfile(catalog_file)
+    assert load_catalog(catalog_file).records == catalog.records
+
+    assert sorted((r["skillet"], r["name"]) for r in catalog.search("/config/shared/t", field="xpath", prefix=True)) == [
+        ("panorama", "tag"), ("panos", "tag")]
+    assert catalog.search("shared/t", field="xpath", prefix=True) == []
+    assert [r["name"] for r in catalog.search("ADDRESS-COLOR")] == ["address"]
+    assert [r["name"] for r in catalog.search("ess-col", field="entry")] == ["address"]
+    assert len(catalog.search("tag_color", field="variable")) == 3
+    assert page(catalog.search("color"), 2, 2) == catalog.records[2:3]
+
+def test_layered_context(local_skillet, tmp_path, capsys):
+    """
+    Test that variable files are layered without copying, parsed once, and that renders are shared between contexts
+    that only differ in variables a snippet doesn't use.
+    """
+    base = tmp_path / "base.yaml"
+    base.write_text("variables:\n  - name: TAG_COLOR\n    value: color1\n  - name: HOSTNAME\n    value: base\n")
+    site = tmp_path / "site.json"
+    site.write_text(json.dumps({"variables": [{"name": "HOSTNAME", "value": "fw1"}]}))
+
+    context = create_context(str(base), [str(site)])
+    assert dict(context) == {"TAG_COLOR": "color1", "HOSTNAME": "fw1"}
+    assert context.changed() == {"HOSTNAME"}
+    assert load_variables(str(base)) is context.base()
+
+    device = context.overlay({"TAG_COLOR": "color2"})
+    assert device.changed() == {"HOSTNAME", "TAG_COLOR"}
+    assert context["TAG_COLOR"] == "color1"
+
+    sc = Git("").build_from_local(str(local_skillet / "templates"))
+    skillet = sc.get_skillet("panos")
+    base_tag = skillet.render("snippets", ["tag"], context.base())[0]
+    site_tag = skillet.render("snippets", ["tag"], context)[0]
+    device_tag = skillet.render("snippets", ["tag"], device)[0]
+    # Only HOSTNAME changed, which the snippet doesn't use
+    assert site_tag.rendered_xmlstr is base_tag.rendered_xmlstr
+    assert device_tag.rendered_xmlstr == "<entry name='tag-color2'><color>color2</color></entry>"
+    # Template sources are only hashed once
+    hashes = device_tag.hashes
+    device_tag.template(context)
+    assert device_tag.hashes is hashes
+
+    capsys.readouterr()
+    assert dict(create_context(str(base), [str(tmp_path / "missing.yaml")])) == dict(context.base())
+    assert "overlay {} not found".format(tmp_path / "missing.yaml") in capsys.readouterr().out
+
+def test_resume_journal(tmp_path):
+    """
+    Test that a resumed run skips every request completed before the previous run died, and only those.
+    """
+    received = []
+
+    class DeviceHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+            received.append(body)
+            resp = b'<response status="success" code="20"><msg>command succeeded</msg></response>'
+            if "fail" in body:
+                resp = b'<response status="error" code="12"><msg>failed</msg></response>'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(resp)))
+            self.end_headers()
+            self.wfile.write(resp)
+
+        def log_message(self, *args):
+            pass
+
+    def snippets(names):
+        r = []
+        for name in names:
+            snippet = Snippet("/config/shared/tag", "<entry name='{}'/>".format(name))
+            snippet.name = "tags"
+            snippet.set_metadata({"variables": []})
+            snippet.template({})
+            r.append(snippet)
+        return r
+
+    journal_file = str(tmp_path / "journal.jsonl")
+    server = start_server(DeviceHandler)
+    try:
+        fw = Panos("127.0.0.1:{}".format(server.server_port), apikey="key")
+        fw.url = "http://127.0.0.1:{}/api".format(server.server_port)
+
+        journal = Journal(journal_file)
+        results = ResultLog("jsonl", stream=io.StringIO(), journal=journal)
+        for snippet in snippets(["a", "b", "fail"]):
+            results.push(fw, snippet)
+        journal.close()
+        # A record torn by the process dying mid write
+        with open(journal_file, "a") as f:
+            f.write('{"job": null, "dev')
+
+        received.clear()
+        journal = Journal(journal_file, resume=True)
+        results = ResultLog("jsonl", stream=io.StringIO(), journal=journal)
+        for snippet in snippets(["a", "b", "c", "d"]):
+            results.push(fw, snippet)
+        journal.close()
+        resumed = len(received)
+
+        # The same snippet given twice is two requests, when scheduled too
+        twice_file = str(tmp_path / "twice.jsonl")
+        same = snippets(["e"])[0]
+        journal = Journal(twice_file)
+        push_snippets(fw, [same, same], ResultLog("jsonl", stream=io.StringIO(), journal=journal), schedule=True)
+        journal.close()
+        assert len(Journal(twice_file, resume=True).completed) == 2
+    finally:
+        server.shutdown()
+
+    # Split chunks of the same snippet are tracked separately, by position and content
+    assert [r["status"] for r in results.records] == ["skipped", "skipped", "success", "success"]
+    assert resumed == 2
+    assert len(Journal(journal_file, resume=True).completed) == 4
+
+def test_push_scheduler():
+    """
+    Test that snippets are scheduled after the snippets creating their parent xpath and the objects they reference.
+    """
+    vsys = "/config/devices/entry[@name='localhost.localdomain']/vsys/entry[@name='vsys1']"
+
+    def snippet(name, xpath, xmlstr):
+        s = Snippet(xpath, xmlstr)
+        s.name = name
+        s.rendered_xpath = xpath
+        s.rendered_xmlstr = xmlstr
+        return s
+
+    rule = snippet("rule", vsys + "/rulebase/security/rules",
+                   "<entry name='allow-web'><source><member>web-servers</member></source>"
+                   "<tag><member>web</member></tag><action>allow</action></entry>")
+    address = snippet("address", vsys + "/address", "<entry name='web-servers'><ip-netmask>10.0.0.0/24</ip-netmask></entry>")
+    tag = snippet("tag", vsys + "/tag", "<entry name='web'><color>color1</color></entry>")
+    zone = snippet("zone", vsys + "/zone/entry[@name=\"trust\"]", "<network><layer3/></network>")
+    base = snippet("vsys", "/config/devices/entry[@name='localhost.localdomain']/vsys",
+                   "<entry name='vsys1'><display-name>main</display-name></entry>")
+    other = snippet("other", "/config/shared/log-settings", "<syslog/>")
+    # Configuration values aren't references, even when an object happens to share their name
+    allow = snippet("allow", "/config/shared/tag", "<entry name='allow'><color>color2</color></entry>")
+
+    scheduler = PushScheduler([rule, address, tag, zone, base, other, allow])
+    waves = [[s.name for s in wave] for wave in scheduler.waves()]
+    assert waves == [["vsys", "other", "allow"], ["address", "tag", "zone"], ["rule"]]
+    assert scheduler.wave_indexes() == [[4, 5, 6], [1, 2, 3], [0]]
+
+    # A cycle is broken in the original order, without losing any snippets
+    a = snippet("a", "/config/shared/a", "<entry name='a'><member>b</member></entry>")
+    b = snippet("b", "/config/shared/b", "<entry name='b'><member>a</member></entry>")
+    assert [s.name for s in PushScheduler([b, a]).order()] == ["b", "a"]
+    assert PushScheduler([]).order() == []
+
+# Modules that must only be imported by the code paths that use them
+HEAVY_MODULES = ["requests", "urllib3", "git", "jinja2", "passlib", "oyaml", "yaml", "beautifultable",
+                 "concurrent.futures"]
+# Seconds a bare "skilletcli --help" may take. Override with SKCLI_STARTUP_BUDGET on slow machines.
+STARTUP_BUDGET = float(os.getenv("SKCLI_STARTUP_BUDGET", "0.5"))
+
+def test_startup_budget():
+    """
+    Test that importing the CLI does not import any heavy dependencies, and that a bare --help stays within the
+    startup budget.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = "import json, sys, skilletcli; print(json.dumps(sorted(sys.modules)))"
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=here)
+    loaded = json.loads(out.decode("utf-8").splitlines()[-1])
+    assert [m for m in HEAVY_MODULES if m in loaded] == []
+
+    timings = []
+    for i in range(3):
+        start = time.time()
+        subprocess.check_output([sys.executable, os.path.join(here, "skilletcli.py"), "--help"], cwd=here)
+        timings.append(time.time() - start)
+    assert min(timings) < STARTUP_BUDGET
+
+def test_daemon(tmp_path, monkeypatch):
+    """
+    Test that the CLI hands requests to a running daemon, which runs them in the client's working directory, and that
+    the daemon never waits for input.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    cli = os.path.join(here, "skilletcli.py")
+    write_skillet(tmp_path / "repo" / "snippets", "panos", ["tag"])
+    socket_path = str(tmp_path / "skcli.sock")
+
+    daemon_log = open(str(tmp_path / "daemon.log"), "w")
+    daemon = subprocess.Popen([sys.executable, cli, "--daemon", "--socket", socket_path], cwd=here,
+                              stdout=daemon_log, stderr=subprocess.DEVNULL)
+    try:
+        for i in range(50):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.1)
+
+        args = [sys.executable, cli, "--socket", socket_path, "--repotype", "local", "--repopath", "repo", "--render",
+                "tag"]
+        r = subprocess.run(args, cwd=str(tmp_path), stdout=subprocess.PIPE, timeout=30)
+        assert r.returncode == 0
+        assert "<entry name='tag-color1'>" in r.stdout.decode("utf-8")
+        # Served by the daemon, not by the client falling back to running it locally
+        assert "Served request from {}, exit code 0".format(tmp_path) in (tmp_path / "daemon.log").read_text()
+
+        r = subprocess.run(args + ["--snippetstack", "missing"], cwd=str(tmp_path), stdout=subprocess.PIPE, timeout=30)
+        assert r.returncode == 1
+
+        # With JSON Lines, stdout only carries results, and everything else stays on stderr
+        r = subprocess.run(args + ["--output", "jsonl"], cwd=str(tmp_path), stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, timeout=30)
+        assert r.returncode == 0
+        lines = r.stdout.decode("utf-8").splitlines()
+        assert [json.loads(l)["type"] for l in lines] == ["summary"]
+        assert "<entry name='tag-color1'>" in r.stderr.decode("utf-8")
+    finally:
+        daemon.terminate()
+        daemon.wait(timeout=10)
+        daemon_log.close()
+
+    assert not os.path.exists(socket_path)
+
+    import skilletcli
+    monkeypatch.setattr(skilletcli, "INTERACTIVE", False)
+    monkeypatch.delenv("SKCLI_PASSWORD", raising=False)
+    with pytest.raises(EOFError):
+        skilletcli.env_or_prompt("password", skilletcli.build_parser().parse_args([]), secret=True)
+
 def test_github():
     g = Github()
     r = g.index()
     assert len(r) >= 1
 
+def test_github_index_cache(tmp_path):
+    """
+    Test that the Github index follows every result page, is served from the cache within the TTL, and is revalidated
+    with conditional requests after it.
+    """
+    requests_seen = []
+    limited = []
+
+    class SearchHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if limited:
+                body = b'{"message": "API rate limit exceeded"}'
+                self.send_response(403)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            page = 2 if "page=2" in self.path else 1
+            requests_seen.append((page, self.headers.get("If-None-Match")))
+            etag = '"page{}"'.format(page)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            name = "repo{}".format(page)
+            body = json.dumps({"items": [{"name": name, "clone_url": name, "description": ""}]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            if page == 1:
+                self.send_header("Link", '<http://127.0.0.1:{}/search/repositories?page=2>; rel="next"'.format(
+                    self.server.server_port))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            return
+
+    server = start_server(SearchHandler)
+    try:
+        github = Github(cache_file=str(tmp_path / "index.json"))
+        github.url = "http://127.0.0.1:{}".format(server.server_port)
+        names = [r['name'] for r in github.search()]
+        assert names == ["repo1", "repo2"]
+        assert len(requests_seen) == 2
+
+        # Within the TTL, Github is not contacted at all
+        assert [r['name'] for r in github.search()] == names
+        assert len(requests_seen) == 2
+
+        # After it, every page is revalidated
+        github.ttl = 0
+        assert [r['name'] for r in github.search()] == names
+        assert requests_seen[2:] == [(1, '"page1"'), (2, '"page2"')]
+
+        # When rate limited, the stale index is used, unless there isn't one
+        limited.append(True)
+        assert [r['name'] for r in github.search()] == names
+        github.cache_file = str(tmp_path / "empty.json")
+        with pytest.raises(RuntimeError):
+            github.search()
+    finally:
+        server.shutdown()
+
 def test_all_github_repos():
     """
     This test function retrieves all of the skillets marked with the "skillets" topic from github